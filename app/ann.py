@@ -0,0 +1,229 @@
+import io
+import os
+import threading
+
+import numpy as np
+
+try:
+    from .vector_index import DEFAULT_TOP_K, normalize_queries, normalize_query, resolve_top_k, select_top_k
+except ImportError:  # "streamlit run app.py" でスクリプトとして実行された場合
+    from vector_index import DEFAULT_TOP_K, normalize_queries, normalize_query, resolve_top_k, select_top_k
+
+# -----------------------------------------------------------------------------
+# 近似最近傍探索（IVF: 転置ファイル + k-means 粗量子化器）
+#   - 行列は VectorIndex のものをそのまま参照し、追加で持つのはセントロイドと
+#     リスト（行番号の配列）だけ。
+#   - search / search_batch / get_texts は VectorIndex と同じ形で呼べる。
+#   - 厳密検索（VectorIndex.search）は残るので、recall_at_k で再現率を比較できる。
+# -----------------------------------------------------------------------------
+
+DEFAULT_NLIST = int(os.environ.get("ANN_NLIST", "256"))
+DEFAULT_NPROBE = int(os.environ.get("ANN_NPROBE", "8"))
+ANN_BLOB_NAME = os.environ.get("ANN_BLOB_NAME", "_ann/ivf.npz")
+
+# k-means の学習に使う 1 クラスタあたりのサンプル数の上限
+TRAIN_POINTS_PER_CLUSTER = 256
+ASSIGN_BLOCK_ROWS = 65536
+
+
+def assign_to_centroids(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """各行を内積が最大のセントロイドへ割り当てる（ブロック単位で計算し、メモリを抑える）。"""
+    labels = np.empty(X.shape[0], dtype=np.int32)
+    for start in range(0, X.shape[0], ASSIGN_BLOCK_ROWS):
+        block = X[start : start + ASSIGN_BLOCK_ROWS]
+        labels[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(X: np.ndarray, n_clusters: int, *, n_iter: int = 20, seed: int = 0) -> np.ndarray:
+    """正規化済みベクトル向けの k-means（内積で割り当て、重心は再正規化）。(n_clusters, d) を返す。
+
+    学習データは最大 n_clusters * TRAIN_POINTS_PER_CLUSTER 行にサンプリングする。
+    空になったクラスタはランダムな点で再初期化する。
+    """
+    rng = np.random.default_rng(seed)
+    n = X.shape[0]
+    if n == 0:
+        raise ValueError("cannot train k-means on an empty matrix")
+    n_clusters = min(n_clusters, n)
+    n_train = min(n, n_clusters * TRAIN_POINTS_PER_CLUSTER)
+    sample = np.asarray(X[np.sort(rng.choice(n, n_train, replace=False))], dtype=np.float32)
+
+    centroids = sample[rng.choice(n_train, n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign_to_centroids(sample, centroids)
+        # クラスタ番号で並べ替えてから区間和を取る（np.add.at より大幅に速い）
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=n_clusters)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        sums[counts > 0] = np.add.reduceat(sample[order], starts[counts > 0], axis=0)
+        empty = counts == 0
+        if np.any(empty):
+            sums[empty] = sample[rng.choice(n_train, int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        np.divide(sums, norms, out=sums, where=norms != 0.0)
+        centroids = sums
+    return centroids
+
+
+class IVFIndex:
+    """VectorIndex に被せる転置ファイル型の近似検索インデックス。
+
+    仕様:
+      - nlist 個のセントロイドに全行を割り当て、検索時はクエリに近い nprobe 個のリストだけを採点
+      - 学習後に VectorIndex へ追加された行は、次の検索時に最寄りのリストへ割り当てる
+      - VectorIndex で削除（tombstone）された行は結果に含めない
+    """
+
+    def __init__(self, index, centroids: np.ndarray, labels: np.ndarray | None = None, *, nprobe: int = DEFAULT_NPROBE):
+        self.base = index
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        if self.centroids.ndim != 2 or self.centroids.shape[1] != index.dim:
+            raise ValueError("centroid dimension must match the index")
+        self.nprobe = max(1, int(nprobe))
+        self._lock = threading.Lock()
+
+        matrix = index.matrix
+        if labels is None or len(labels) != matrix.shape[0]:
+            labels = assign_to_centroids(matrix, self.centroids)
+        self.labels = np.asarray(labels, dtype=np.int32)
+        order = np.argsort(self.labels, kind="stable")
+        bounds = np.searchsorted(self.labels[order], np.arange(self.nlist + 1))
+        self._lists = [order[bounds[i] : bounds[i + 1]] for i in range(self.nlist)]
+
+    @classmethod
+    def train(cls, index, *, nlist: int = DEFAULT_NLIST, nprobe: int = DEFAULT_NPROBE, n_iter: int = 20, seed: int = 0):
+        """VectorIndex の行列から粗量子化器を学習して IVFIndex を作る。"""
+        centroids = spherical_kmeans(index.matrix, nlist, n_iter=n_iter, seed=seed)
+        return cls(index, centroids, nprobe=nprobe)
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.base.dim
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    def _sync(self, n: int) -> None:
+        """学習後に追加された行（labels に無い行）を最寄りのリストへ割り当てる。"""
+        if n <= len(self.labels):
+            return
+        with self._lock:
+            start = len(self.labels)
+            if n <= start:
+                return
+            new_labels = assign_to_centroids(self.base.matrix[start:n], self.centroids)
+            new_rows = np.arange(start, n)
+            for c in np.unique(new_labels):
+                self._lists[c] = np.concatenate([self._lists[c], new_rows[new_labels == c]])
+            self.labels = np.concatenate([self.labels, new_labels])
+
+    def _candidates(self, q: np.ndarray, E: np.ndarray, live, nprobe: int) -> np.ndarray:
+        probe, _ = select_top_k(self.centroids @ q, nprobe)
+        rows = np.concatenate([self._lists[c] for c in probe])
+        rows = rows[rows < E.shape[0]]
+        if live is not None:
+            rows = rows[live[rows]]
+        return rows
+
+    def search(self, query_embedding, k: int = DEFAULT_TOP_K, *, nprobe: int | None = None):
+        """近似的に上位 k 件の (行インデックス, コサイン類似度) を返す（検証規則は VectorIndex.search と同じ）。"""
+        q = normalize_query(query_embedding, self.dim)
+        E, live = self.base.snapshot()
+        self._sync(E.shape[0])
+        n = E.shape[0] if live is None else int(live.sum())
+        if n == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        k = resolve_top_k(k, n)
+
+        rows = self._candidates(q, E, live, nprobe or self.nprobe)
+        if rows.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        pos, scores = select_top_k(E[rows] @ q, k)
+        return rows[pos], scores
+
+    def search_batch(self, query_embeddings, k: int = DEFAULT_TOP_K, *, nprobe: int | None = None):
+        """(Q, d) のクエリを検索し (Q, k) を返す。候補が k 件に満たない行は -1 / -inf で埋める。"""
+        Q = normalize_queries(query_embeddings, self.dim)
+        n = len(self.base)
+        k = resolve_top_k(k, n) if n else 0
+        out_idx = np.full((Q.shape[0], k), -1, dtype=np.int64)
+        out_scores = np.full((Q.shape[0], k), -np.inf, dtype=np.float32)
+        for qi, q in enumerate(Q):
+            idx, scores = self.search(q, k, nprobe=nprobe) if k else ([], [])
+            out_idx[qi, : len(idx)] = idx
+            out_scores[qi, : len(scores)] = scores
+        return out_idx, out_scores
+
+    def get_texts(self, indices) -> list[str]:
+        return self.base.get_texts(indices)
+
+    def get_metadata(self, indices) -> list[dict]:
+        return self.base.get_metadata(indices)
+
+    # --- 永続化 ---------------------------------------------------------------
+
+    def to_bytes(self, fingerprint: str = "") -> bytes:
+        """セントロイドと割り当てを .npz にまとめる。fingerprint は行の並びを識別する文字列。"""
+        buf = io.BytesIO()
+        np.savez(
+            buf,
+            centroids=self.centroids,
+            labels=self.labels,
+            nprobe=np.array(self.nprobe),
+            fingerprint=np.array(fingerprint),
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, index, *, fingerprint: str = "", nprobe: int | None = None):
+        """保存済みの IVF を復元する。
+
+        fingerprint が一致すれば割り当てもそのまま使い、一致しなければ学習済みセントロイドだけを
+        使って割り当て直す（いずれにしても k-means の再学習はしない）。
+        """
+        with np.load(io.BytesIO(data), allow_pickle=False) as z:
+            centroids = z["centroids"]
+            labels = z["labels"] if str(z["fingerprint"]) == fingerprint and fingerprint else None
+            saved_nprobe = int(z["nprobe"])
+        return cls(index, centroids, labels, nprobe=nprobe or saved_nprobe)
+
+
+def load_or_train_ivf(store, *, nlist: int = DEFAULT_NLIST, nprobe: int = DEFAULT_NPROBE, blob_name: str = ANN_BLOB_NAME):
+    """ベクトルストアと同じバケットに保存した IVF を読み込み、無ければ学習して保存する。
+
+    次元やリスト数が合わない保存物は使わずに学習し直す。保存に失敗しても検索は続行する。
+    """
+    bucket = store.storage_client.bucket(store.bucket_name)
+    blob = bucket.blob(blob_name)
+    fingerprint = store.layout_fingerprint()
+    try:
+        ivf = IVFIndex.from_bytes(blob.download_as_bytes(), store.index, fingerprint=fingerprint, nprobe=nprobe)
+        if ivf.nlist == min(nlist, len(store.index.matrix)):
+            return ivf
+    except Exception as e:  # 未作成 / 形式違い / 次元違いなど
+        print(f"[INFO] 保存済み IVF を使わずに学習します: {e}")
+
+    ivf = IVFIndex.train(store.index, nlist=nlist, nprobe=nprobe)
+    try:
+        blob.upload_from_string(ivf.to_bytes(fingerprint), content_type="application/octet-stream")
+    except Exception as e:
+        print(f"[WARN] IVF の保存に失敗しました: {e}")
+    return ivf
+
+
+def recall_at_k(approx, exact, query_embeddings, k: int = 10, **search_kwargs) -> float:
+    """近似検索の recall@k（厳密検索の上位 k 件のうち、近似検索でも拾えた割合の平均）。"""
+    Q = np.asarray(query_embeddings)
+    hits = total = 0
+    for q in Q:
+        truth, _ = exact.search(q, k)
+        found, _ = approx.search(q, k, **search_kwargs)
+        hits += len(np.intersect1d(truth, found))
+        total += len(truth)
+    return hits / total if total else 1.0
@@ -0,0 +1,117 @@
+import os
+import threading
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# 意味的回答キャッシュ
+#   - 新しい質問の埋め込みが、過去の質問とコサイン類似度 threshold 以上で、
+#     かつ検索で選ばれたチャンク集合が同じなら、保存済みの回答をそのまま返す。
+#   - ベクトルストアの版（VectorStore.version）が変わったら全エントリを破棄する。
+# -----------------------------------------------------------------------------
+
+DEFAULT_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_SIZE", "256"))
+DEFAULT_POLICY = os.environ.get("ANSWER_CACHE_POLICY", "lru")
+
+
+class SemanticAnswerCache:
+    """質問埋め込みの近さ + 取得チャンク集合の一致で LLM 呼び出しを省くキャッシュ。
+
+    仕様:
+      - policy="lru" は最後に使われた時刻、"lfu" はヒット回数（同数なら古い方）で追い出す
+      - lookup / store に渡す version がキャッシュの版と違えば、先に全エントリを破棄する
+      - hits / misses / invalidations を数える
+    """
+
+    def __init__(
+        self,
+        *,
+        threshold: float = DEFAULT_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        policy: str = DEFAULT_POLICY,
+    ):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"unknown eviction policy: {policy}")
+        self.threshold = threshold
+        self.max_entries = max(1, int(max_entries))
+        self.policy = policy
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._queries = np.empty((0, 0), dtype=np.float32)  # 正規化済み質問埋め込み（行 = エントリ）
+        self._entries: list[dict] = []
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(query_embedding) -> np.ndarray | None:
+        q = np.nan_to_num(np.array(query_embedding, dtype=np.float32), nan=0.0, posinf=0.0, neginf=0.0)
+        norm = float(np.linalg.norm(q))
+        return q / norm if norm else None
+
+    def _check_version(self, version) -> None:
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._queries = np.empty((0, 0), dtype=np.float32)
+            self._entries = []
+            self.version = version
+
+    def lookup(self, query_embedding, chunk_ids, version=None) -> str | None:
+        """条件を満たす保存済み回答を返す（無ければ None）。"""
+        q = self._normalize(query_embedding)
+        chunks = frozenset(int(i) for i in chunk_ids)
+        with self._lock:
+            self._check_version(version)
+            if q is None or not self._entries or self._queries.shape[1] != q.shape[0]:
+                self.misses += 1
+                return None
+            sims = self._queries @ q
+            for i in np.argsort(-sims):
+                if sims[i] < self.threshold:
+                    break
+                entry = self._entries[i]
+                if entry["chunks"] == chunks:
+                    self._tick += 1
+                    entry["last_used"] = self._tick
+                    entry["hits"] += 1
+                    self.hits += 1
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, query_embedding, chunk_ids, answer: str, version=None) -> None:
+        q = self._normalize(query_embedding)
+        if q is None:
+            return
+        with self._lock:
+            self._check_version(version)
+            if self._entries and self._queries.shape[1] != q.shape[0]:
+                return
+            if len(self._entries) >= self.max_entries:
+                self._evict()
+            self._tick += 1
+            self._entries.append(
+                {"chunks": frozenset(int(i) for i in chunk_ids), "answer": answer, "hits": 0, "last_used": self._tick}
+            )
+            self._queries = np.vstack([self._queries.reshape(-1, q.shape[0]), q[None, :]])
+
+    def _evict(self) -> None:
+        if self.policy == "lfu":
+            victim = min(range(len(self._entries)), key=lambda i: (self._entries[i]["hits"], self._entries[i]["last_used"]))
+        else:
+            victim = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+        del self._entries[victim]
+        self._queries = np.delete(self._queries, victim, axis=0)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "invalidations": self.invalidations,
+        }
@@ -1,93 +1,92 @@
 import streamlit as st
-import numpy as np
-import json
 from google.cloud import storage
 import vertexai
 from vertexai.language_models import TextEmbeddingModel
 from vertexai.generative_models import GenerativeModel
 import os
 
+try:
+    from .ann import load_or_train_ivf
+    from .answer_cache import SemanticAnswerCache
+    from .embedding_cache import QueryEmbeddingCache
+    from .lexical import HybridSearcher, LexicalIndex
+    from .metadata_index import MetadataIndex, format_citation, parse_page_range
+    from .quantization import QuantizedIndex
+    from .rag import build_prompt, find_similar_chunks, generate_answer, generate_answer_stream  # noqa: F401 (互換のため再公開)
+    from .service_client import RagServiceClient
+    from .sharded import ShardedIndex
+    from .telemetry import TELEMETRY
+    from .vector_store import DEFAULT_SEGMENT_CACHE_DIR, DEFAULT_SHARED_DIR, VectorStore
+except ImportError:  # "streamlit run app.py" でスクリプトとして実行された場合
+    from ann import load_or_train_ivf
+    from answer_cache import SemanticAnswerCache
+    from embedding_cache import QueryEmbeddingCache
+    from lexical import HybridSearcher, LexicalIndex
+    from metadata_index import MetadataIndex, format_citation, parse_page_range
+    from quantization import QuantizedIndex
+    from rag import build_prompt, find_similar_chunks, generate_answer, generate_answer_stream  # noqa: F401 (互換のため再公開)
+    from service_client import RagServiceClient
+    from sharded import ShardedIndex
+    from telemetry import TELEMETRY
+    from vector_store import DEFAULT_SEGMENT_CACHE_DIR, DEFAULT_SHARED_DIR, VectorStore
+
 # -----------------------------------------------------------------------------
-# 純粋関数（テストしやすいようにトップレベルに分離）
+# 薄いクライアントモード（RAG_SERVICE_URL 設定時）
+#   検索・回答生成は service.py の HTTP サービスに任せ、ここでは描画だけを行う。
 # -----------------------------------------------------------------------------
+def run_thin_client(service_url: str):
+    st.set_page_config(page_title="RAG Portfolio", layout="wide")
+    st.title("RAGシステム ポートフォリオ")
+    client = RagServiceClient(service_url)
 
-def find_similar_chunks(query_embedding, embeddings, texts, top_k=None):
-    """コサイン類似度で類似チャンクを見つける（安全・非破壊・シンプル）
-
-    仕様:
-      - 入力は非破壊（コピーして扱う）
-      - 形状が不正なら ValueError（E: 2次元, q: 1次元, 行数==テキスト数, 列数==クエリ次元）
-      - コーパスが空なら []
-      - top_k 未指定(None) は 3 件（ただしコーパス件数を上限）
-      - top_k が整数でない/0以下は ValueError
-      - NaN/Inf は 0 に置換
-      - クエリがゼロベクトルなら ValueError
-      - コーパス側のゼロベクトルは類似度 0 とみなす
-    """
-    import numpy as np
-
-    # 非破壊コピー
-    q = np.array(query_embedding, dtype=float, copy=True)
-    E = np.array(embeddings, dtype=float, copy=True)
-    T = list(texts)
-
-    # 形状バリデーション（1行で集約）
-    if not (E.ndim == 2 and q.ndim == 1 and E.shape[0] == len(T) and E.shape[1] == q.shape[0]):
-        raise ValueError("invalid shapes")
-
-    # 空コーパスは空配列を返す
-    if len(T) == 0:
-        return []
-
-    # top_k の決定
-    if top_k is None:
-        k = min(3, len(T))
-    else:
+    if st.sidebar.button("知識ベースを再読み込み", key="refresh_button"):
         try:
-            k = int(top_k)
-        except (TypeError, ValueError):
-            raise ValueError("top_k must be an integer")
-        if k <= 0:
-            raise ValueError("top_k must be >= 1")
-        k = min(k, len(T))
-
-    # NaN/Inf を 0 に正規化
-    q = np.nan_to_num(q, nan=0.0, posinf=0.0, neginf=0.0)
-    E = np.nan_to_num(E, nan=0.0, posinf=0.0, neginf=0.0)
-
-    # コサイン類似度計算（ゼロ割/ゼロノルム対策）
-    qnorm = np.linalg.norm(q)
-    if qnorm == 0.0:
-        raise ValueError("query embedding has zero norm")
-
-    Enorms = np.linalg.norm(E, axis=1)
-    denom = Enorms * qnorm
-    denom_safe = np.where(denom == 0.0, 1.0, denom)
-    sims = (E @ q) / denom_safe
-    sims = np.where(Enorms == 0.0, 0.0, sims)
-
-    top_idx = np.argsort(-sims)[:k]
-    return [T[i] for i in top_idx]
-
-
-def build_prompt(query: str, similar_chunks: list[str]) -> str:
-    """回答生成用のプロンプトを作る純粋関数"""
-    context = "\n---\n".join(similar_chunks)
-    return f"""
-以下の情報を参考にして、質問に日本語で詳しく回答してください。
+            stats = client.refresh()
+        except Exception as e:
+            st.error(f"知識ベースの再読み込みに失敗しました: {e}")
+        else:
+            st.sidebar.info(
+                f"追加 {stats['added']} / 更新 {stats['updated']} / 削除 {stats['removed']} 件のドキュメントを反映しました。"
+            )
+    try:
+        sources = client.sources()
+    except Exception as e:
+        st.error(f"検索サービスに接続できません: {e}")
+        return
+    source_filter = st.sidebar.multiselect("対象ドキュメント（未選択なら全件）", sorted(sources))
+    page_filter = st.sidebar.text_input("ページ範囲（例: 3-10）", key="page_filter")
 
---- 情報 ---
-{context}
---- 情報終わり ---
+    query = st.text_input("ドキュメントに関する質問を入力してください:", key="query_input")
+    if not st.button("質問する", key="submit_button"):
+        return
+    if not query:
+        st.error("質問を入力してください。")
+        return
+    try:
+        pages = parse_page_range(page_filter)
+        hits: list[dict] = []
 
-質問: {query}
-""".strip()
+        def deltas():
+            for event in client.answer_stream(query, source_files=source_filter, pages=pages):
+                if "sources" in event:
+                    hits.extend(event["sources"])
+                elif "delta" in event:
+                    yield event["delta"]
 
+        st.subheader("🤖 回答:")
+        with st.spinner("回答を生成中です..."):
+            answer = st.write_stream(deltas())
+        if not answer:
+            st.write("(空の応答)" if hits else "絞り込み条件に合うチャンクがありません。")
+        with st.expander("AIが参考にした情報源を表示"):
+            for hit in hits:
+                st.caption(f"出典: {hit['citation']}")
+                st.info(hit["text"])
+    except ValueError as ve:
+        st.error(f"入力エラー: {ve}")
+    except Exception as e:
+        st.error(f"処理中にエラーが発生しました: {e}")
 
-def generate_answer(generative_model: GenerativeModel, prompt: str) -> str:
-    """LLMにプロンプトを渡して回答テキストを返す純粋関数"""
-    resp = generative_model.generate_content([prompt])
-    return getattr(resp, "text", "").strip()
 
 # -----------------------------------------------------------------------------
 # Streamlitアプリケーションのメインロジック
@@ -103,6 +102,24 @@ def main():
     VECTOR_BUCKET_NAME = os.environ.get("VECTOR_BUCKET_NAME")
     EMBEDDING_MODEL_NAME = "text-embedding-004"
     LLM_MODEL_NAME = "gemini-1.5-pro"  # 安定版
+    # 既定は手動（再読み込みボタン）のみ。正の値を設定するとその間隔で差分を取り込む
+    REFRESH_INTERVAL_SEC = float(os.environ.get("VECTOR_REFRESH_INTERVAL_SEC", "0"))
+    # "exact"（全件走査） / "ivf"（近似検索） / "sq"・"pq"（量子化コードで採点 + 厳密リランキング）
+    ANN_MODE = os.environ.get("ANN_MODE", "exact")
+    # 量子化モードでは元ベクトルをヒープに持たず、このディレクトリに書き出した .npy のメモリマップから
+    # リランキングの候補行だけを読む（VECTOR_SHARED_DIR が設定されていればそちらを使う）
+    QUANTIZED_SPILL_DIR = DEFAULT_SHARED_DIR or os.path.join(DEFAULT_SEGMENT_CACHE_DIR, "index")
+    # 既定の "off" は密ベクトル検索のみ。"rrf"（語彙検索と密ベクトル検索を順位統合） / "prefilter"
+    # （語彙候補だけを密ベクトルで採点）は明示したときだけ語彙インデックスを作って使う
+    HYBRID_MODE = os.environ.get("HYBRID_MODE", "off")
+    # 厳密検索を行方向に分割して並列に採点するシャード数（1 なら分割しない）
+    SEARCH_SHARDS = int(os.environ.get("SEARCH_SHARDS", "1"))
+    DEBUG_PANEL = os.environ.get("DEBUG_PANEL", "0") == "1"  # レイテンシ内訳パネルの初期表示
+    # 設定すると検索・回答生成を HTTP サービス（service.py）に任せ、この UI は描画だけを行う
+    SERVICE_URL = os.environ.get("RAG_SERVICE_URL")
+    if SERVICE_URL:
+        run_thin_client(SERVICE_URL)
+        return
 
     # --- 2. クライアントの初期化 ---
     try:
@@ -115,73 +132,172 @@ def main():
         return
 
     # --- 3. データローダ（ネスト: 親スコープの依存をそのまま使う） ---
-    @st.cache_data(show_spinner=False)
+    @st.cache_resource(show_spinner=False)
     def load_vectors_from_gcs():
-        """GCSから全てのJSONLファイルを読み込み、ベクトルとテキストをロードする"""
+        """GCSの全ドキュメント（セグメント優先、無ければJSONL）を読み込んだ VectorStore をプロセスで 1 つ作る"""
         if not VECTOR_BUCKET_NAME:
             st.error("環境変数 VECTOR_BUCKET_NAME が設定されていません。")
-            return None, None
-
-        bucket = storage_client.bucket(VECTOR_BUCKET_NAME)
-        blobs = list(bucket.list_blobs())
-
-        if not blobs:
-            return None, None
-
-        all_chunks = []
-        for blob in blobs:
-            if blob.name.endswith(".jsonl"):
-                content = blob.download_as_text()
-                for line in content.strip().split("\n"):
-                    if line:
-                        all_chunks.append(json.loads(line))
-
-        if not all_chunks:
-            return None, None
-
-        texts = [c["text_content"] for c in all_chunks]
-        embeddings = np.array([c["embedding"] for c in all_chunks], dtype=float)
-        embeddings = np.nan_to_num(embeddings, nan=0.0, posinf=0.0, neginf=0.0)
-        return texts, embeddings
+            return None
+        shared_dir = QUANTIZED_SPILL_DIR if ANN_MODE in ("sq", "pq") else DEFAULT_SHARED_DIR
+        store = VectorStore(storage_client, VECTOR_BUCKET_NAME, shared_dir=shared_dir)
+        store.refresh()
+        return store
+
+    @st.cache_resource(show_spinner=False, max_entries=1)
+    def load_ann_index(_store, index_id: int):
+        """IVF を用意する（バケットに保存済みなら読み込み、無ければ学習して保存）。
+        index_id はコンパクションでインデックスが差し替わったときに作り直すためのキー"""
+        return load_or_train_ivf(_store)
+
+    @st.cache_resource(show_spinner=False, max_entries=1)
+    def load_quantized_index(_store, index_id: int, mode: str):
+        """量子化インデックスを構築する（元ベクトルはメモリマップからリランキング時に候補行だけ参照）"""
+        return QuantizedIndex.build(_store.index, mode)
+
+    @st.cache_resource(show_spinner=False, max_entries=1)
+    def load_sharded_index(_store, index_id: int):
+        """シャード分割した並列検索器（ワーカープールは全セッションで共有。差し替え時に古いものは破棄）"""
+        return ShardedIndex.build(_store.index, SEARCH_SHARDS)
+
+    @st.cache_resource(show_spinner=False, max_entries=1)
+    def load_lexical_index(_store, index_id: int):
+        """全チャンクの文字 n-gram 転置インデックスを作る（以後の追加行は検索時に取り込まれる）"""
+        return LexicalIndex.build(_store.index)
+
+    @st.cache_resource(show_spinner=False, max_entries=1)
+    def load_metadata_index(_store, index_id: int):
+        """ソースファイル・ページでの絞り込み用の列指向メタデータ"""
+        return MetadataIndex.build(_store.index)
+
+    @st.cache_resource(show_spinner=False)
+    def get_query_cache():
+        """クエリ埋め込みキャッシュ（プロセス内 LRU + 任意で SQLite）。全セッションで共有"""
+        return QueryEmbeddingCache(EMBEDDING_MODEL_NAME)
+
+    @st.cache_resource(show_spinner=False)
+    def get_answer_cache():
+        """意味的回答キャッシュ。ベクトルストアの版が変わると自動で破棄される"""
+        return SemanticAnswerCache()
 
     # --- 4. UI ---
     st.set_page_config(page_title="RAG Portfolio", layout="wide")
     st.title("RAGシステム ポートフォリオ")
 
     with st.spinner("GCSから知識ベースを読み込み中..."):
-        texts, embeddings = load_vectors_from_gcs()
-
-    if embeddings is None:
+        store = load_vectors_from_gcs()
+
+    if store is not None:
+        # 新規/更新/削除されたドキュメントだけを取り込み直す（手動 or 一定間隔）
+        if st.sidebar.button("知識ベースを再読み込み", key="refresh_button"):
+            stats = store.refresh()
+            st.sidebar.info(
+                f"追加 {stats['added']} / 更新 {stats['updated']} / 削除 {stats['removed']} 件のドキュメントを反映しました。"
+            )
+        else:
+            store.maybe_refresh(REFRESH_INTERVAL_SEC)
+
+    index = store.index if store is not None else None
+    if index is None or len(index) == 0:
         st.error("GCSバケットにベクトルデータが見つかりません。Cloud Functionでドキュメントを処理してください。")
         return
 
-    st.success(f"{len(texts)}個のナレッジチャンクをGCSからロードしました。")
+    st.success(f"{len(index)}個のナレッジチャンクをGCSからロードしました。")
+
+    # 検索器: 既定は厳密検索。ANN_MODE に応じて同じ search API の近似/量子化インデックスを使う
+    if ANN_MODE == "ivf":
+        searcher = load_ann_index(store, id(index))
+    elif ANN_MODE in ("sq", "pq"):
+        searcher = load_quantized_index(store, id(index), ANN_MODE)
+    elif SEARCH_SHARDS > 1:
+        searcher = load_sharded_index(store, id(index))
+    else:
+        searcher = index
+    if HYBRID_MODE in ("rrf", "prefilter"):
+        searcher = HybridSearcher(searcher, load_lexical_index(store, id(index)), prefilter=HYBRID_MODE == "prefilter")
+
+    # 絞り込み（対象ドキュメント・ページ範囲）。指定した行だけを採点する
+    metadata_index = load_metadata_index(store, id(index))
+    source_filter = st.sidebar.multiselect("対象ドキュメント（未選択なら全件）", sorted(metadata_index.source_counts()))
+    page_filter = st.sidebar.text_input("ページ範囲（例: 3-10）", key="page_filter")
 
     query = st.text_input("ドキュメントに関する質問を入力してください:", key="query_input")
     if st.button("質問する", key="submit_button"):
         if not query:
             st.error("質問を入力してください。")
             return
-
-        with st.spinner("回答を生成中です..."):
+        try:
+            pages = parse_page_range(page_filter)
+        except ValueError as ve:
+            st.error(f"ページ範囲の指定が不正です: {ve}")
+            return
+        rows = None
+        if source_filter or pages is not None:
+            rows = metadata_index.select(source_files=source_filter or None, pages=pages)
+            if rows.size == 0:
+                st.warning("絞り込み条件に合うチャンクがありません。条件を見直してください。")
+                return
+
+        # 段階ごとの所要時間は 1 リクエスト分のトレースにまとめ、JSON ログとヒストグラムに記録する
+        with st.spinner("回答を生成中です..."), TELEMETRY.trace("query", mode=ANN_MODE) as trace:
             try:
-                # 埋め込み生成（NaN/Infを0に）
-                q_emb = embedding_model.get_embeddings([query])[0].values
-                q_emb = np.array(q_emb, dtype=float)
-                q_emb = np.nan_to_num(q_emb, nan=0.0, posinf=0.0, neginf=0.0)
+                # 埋め込み生成（同じ質問はキャッシュから。NaN/Inf の除去と正規化は search 側で行う）
+                query_cache = get_query_cache()
+                with TELEMETRY.span("query_embedding") as span:
+                    hits_before = query_cache.hits
+                    q_emb = query_cache.get_or_compute(
+                        query, lambda text: embedding_model.get_embeddings([text])[0].values
+                    )
+                    span["cache_hit"] = query_cache.hits > hits_before
 
                 # 類似チャンク抽出（デフォルト: 3件）
-                similar = find_similar_chunks(q_emb, embeddings, texts, top_k=None)
-
-                # 回答生成
-                prompt = build_prompt(query, similar)
-                answer = generate_answer(generative_model, prompt)
+                # 絞り込み時は条件に合う行だけを厳密に採点する（近似インデックスは使わない）
+                with TELEMETRY.span("retrieval", hybrid=HYBRID_MODE, filtered_rows=None if rows is None else len(rows)):
+                    if isinstance(searcher, HybridSearcher):
+                        top_idx, _ = searcher.search(q_emb, query_text=query, rows=rows)
+                    elif rows is not None:
+                        top_idx, _ = index.search(q_emb, rows=rows)
+                    else:
+                        top_idx, _ = searcher.search(q_emb)
+                    similar = searcher.get_texts(top_idx)
+                    sources = index.get_metadata(top_idx)
+                # 絞り込んだ行がすべて削除済みだったなど、参考にするチャンクが無ければ LLM を呼ばない
+                if len(top_idx) == 0:
+                    st.warning("絞り込み条件に合うチャンクがありません。条件を見直してください。" if rows is not None
+                               else "参考になるチャンクが見つかりませんでした。")
+                    return
+
+                # 回答生成（近い質問で同じチャンクが選ばれていれば、保存済みの回答を再利用）
+                answer_cache = get_answer_cache()
+                with TELEMETRY.span("answer_cache_lookup") as span:
+                    answer = answer_cache.lookup(q_emb, top_idx, version=store.version)
+                    span["hit"] = answer is not None
 
                 st.subheader("🤖 回答:")
-                st.write(answer or "(空の応答)")
+                if answer is None:
+                    # 届いた部分から順に描画し、体感待ち時間（最初の文字まで）を短くする
+                    with TELEMETRY.span("prompt_build"):
+                        prompt = build_prompt(query, similar)
+                    timings: dict = {}
+                    with TELEMETRY.span("llm_generation"):
+                        answer = st.write_stream(generate_answer_stream(generative_model, prompt, timings))
+                    if "ttft_sec" in timings:
+                        TELEMETRY.record("llm_ttft", timings["ttft_sec"])
+                    answer = (answer if isinstance(answer, str) else "".join(answer)).strip()
+                    if answer:
+                        answer_cache.store(q_emb, top_idx, answer, version=store.version)
+                    else:
+                        st.write("(空の応答)")
+                    if "total_sec" in timings:
+                        st.caption(
+                            f"最初の応答まで {timings.get('ttft_sec', timings['total_sec']):.2f} 秒 / "
+                            f"生成完了まで {timings['total_sec']:.2f} 秒"
+                        )
+                else:
+                    st.write(answer or "(空の応答)")
 
                 with st.expander("AIが参考にした情報源を表示"):
-                    for chunk in similar:
+                    for chunk, meta in zip(similar, sources):
+                        st.caption(f"出典: {format_citation(meta)}")
                         st.info(chunk)
 
             except ValueError as ve:
@@ -189,6 +305,18 @@ def main():
                 st.error(f"入力エラー: {ve}")
             except Exception as e:
                 st.error(f"処理中にエラーが発生しました: {e}")
+        st.session_state["last_trace"] = trace
+
+    # --- 5. デバッグパネル（直近リクエストの内訳と、プロセス内の p50/p95/p99） ---
+    if st.sidebar.checkbox("レイテンシ内訳を表示", value=DEBUG_PANEL, key="debug_panel"):
+        last_trace = st.session_state.get("last_trace")
+        if last_trace:
+            st.sidebar.caption(f"直近のリクエスト: 合計 {last_trace['total_ms']:.1f} ms")
+            st.sidebar.table(
+                [{"stage": s["name"], "ms": s["duration_ms"], "start_ms": s.get("offset_ms")} for s in last_trace["spans"]]
+            )
+        st.sidebar.caption("段階別レイテンシ（このプロセスの直近サンプル）")
+        st.sidebar.table([{"stage": name, **stats} for name, stats in TELEMETRY.summary().items()])
 
 # このファイルが "streamlit run app.py" で直接実行された時だけ、main()関数を呼び出す
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# クエリ埋め込みキャッシュ
+#   - キーは「モデル名 + 正規化したクエリ文字列」
+#   - 1 段目: プロセス内の LRU（件数上限 + TTL）
+#   - 2 段目（任意）: SQLite ファイル。再起動やインスタンス間（共有ディスク）で再利用する
+# -----------------------------------------------------------------------------
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+DEFAULT_TTL_SEC = float(os.environ.get("QUERY_CACHE_TTL_SEC", "86400"))
+DEFAULT_DB_PATH = os.environ.get("QUERY_CACHE_DB") or None
+
+
+def normalize_query_text(text: str) -> str:
+    """キャッシュキー用にクエリを正規化する（NFKC・前後空白除去・連続空白の圧縮・英字小文字化）。
+
+    全角/半角や空白の違いだけの質問を同じキーにまとめる。
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+
+
+class QueryEmbeddingCache:
+    """モデル名と正規化クエリをキーに埋め込みベクトル（float32）を保持するキャッシュ。
+
+    仕様:
+      - LRU は max_entries 件を超えたら最も古く使われたものから捨てる
+      - ttl_sec を過ぎたエントリは取得時に捨てる（0 以下なら無期限）
+      - db_path を指定すると SQLite に書き込み、LRU に無い場合はそちらを参照する
+      - hits / misses / persistent_hits を数える（persistent_hits は hits の内数）
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        *,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_sec: float = DEFAULT_TTL_SEC,
+        db_path: str | None = DEFAULT_DB_PATH,
+        clock=time.time,
+    ):
+        self.model_name = model_name
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_sec = ttl_sec
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+        self._entries: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, created REAL, vector BLOB)"
+            )
+            self._db.commit()
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_name}\x00{normalize_query_text(text)}"
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_sec > 0 and self.clock() - created > self.ttl_sec
+
+    def get(self, text: str) -> np.ndarray | None:
+        key = self._key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT created, vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[0]):
+                    vector = np.frombuffer(row[1], dtype=np.float32)
+                    self._remember(key, row[0], vector)
+                    self.hits += 1
+                    self.persistent_hits += 1
+                    return vector
+                if row is not None:
+                    self._db.execute("DELETE FROM query_embeddings WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, values) -> np.ndarray:
+        key = self._key(text)
+        vector = np.array(values, dtype=np.float32)
+        vector.setflags(write=False)
+        created = self.clock()
+        with self._lock:
+            self._remember(key, created, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, created, vector) VALUES (?, ?, ?)",
+                    (key, created, vector.tobytes()),
+                )
+                self._db.commit()
+        return vector
+
+    def _remember(self, key: str, created: float, vector: np.ndarray) -> None:
+        self._entries[key] = (created, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, text: str, compute) -> np.ndarray:
+        """キャッシュに無ければ compute(text) で埋め込みを求めて保存する。"""
+        vector = self.get(text)
+        if vector is None:
+            vector = self.put(text, compute(text))
+        return vector
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "persistent_hits": self.persistent_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,262 @@
+import math
+import os
+import threading
+import unicodedata
+
+import numpy as np
+
+try:
+    from .vector_index import DEFAULT_TOP_K, normalize_query, resolve_rows, resolve_top_k, select_top_k
+except ImportError:  # "streamlit run app.py" でスクリプトとして実行された場合
+    from vector_index import DEFAULT_TOP_K, normalize_query, resolve_rows, resolve_top_k, select_top_k
+
+# -----------------------------------------------------------------------------
+# 文字 n-gram の転置インデックス（BM25）と、ベクトル検索とのハイブリッド検索
+#   - 形態素解析器に依存せず、日本語の正式名称や様式番号（「第3条」「様式第1号」など）を
+#     文字 2-gram / 3-gram の一致で拾う。
+#   - n-gram は Unicode コードポイントを 21 ビットずつ詰めた 64 ビット整数で表し、転置リストには
+#     それを 32 ビットに畳んだハッシュを使う。転置リストは「ハッシュでソートした
+#     (uint32 ハッシュ, int32 行, uint16 出現回数) の平坦な配列」（1 エントリ 10 バイト）として持つ。
+#     まれなハッシュの衝突は、別の n-gram の一致として BM25 のスコアにわずかに混ざるだけ。
+#   - HybridSearcher は語彙検索と密ベクトル検索の順位を Reciprocal Rank Fusion で統合する。
+#     prefilter=True なら語彙検索の候補行だけを密ベクトルで採点する。
+# -----------------------------------------------------------------------------
+
+DEFAULT_HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "100"))
+DEFAULT_RRF_K = int(os.environ.get("HYBRID_RRF_K", "60"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_CODE_BITS = 21  # Unicode のコードポイントは 21 ビットに収まる
+_SPACE = ord(" ")
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)  # フィボナッチハッシュ（64 ビットの黄金比）
+_TF_MAX = np.iinfo(np.uint16).max
+
+
+def normalize_for_ngrams(text: str) -> str:
+    """NFKC・英字小文字化・連続空白の圧縮（全角/半角や大文字小文字の違いで一致を落とさない）。"""
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def char_ngram_ids(text: str) -> np.ndarray:
+    """正規化したテキストの文字 2-gram / 3-gram を uint64 の ID 列にする（空白を跨ぐものは除く）。
+
+    2-gram は (c0 << 21) | c1 で 2^42 未満、3-gram は (c0 << 42) | (c1 << 21) | c2 で 2^42 以上になるので衝突しない。
+    1 文字だけのテキストは 1-gram（コードポイントそのもの）を使う。
+    """
+    codes = np.frombuffer(normalize_for_ngrams(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if codes.size == 0:
+        return np.empty(0, dtype=np.uint64)
+    if codes.size == 1:
+        return codes
+    ids = [(codes[:-1] << _CODE_BITS) | codes[1:]]
+    keep = [(codes[:-1] != _SPACE) & (codes[1:] != _SPACE)]
+    if codes.size >= 3:
+        ids.append((codes[:-2] << (2 * _CODE_BITS)) | (codes[1:-1] << _CODE_BITS) | codes[2:])
+        keep.append(keep[0][:-1] & (codes[2:] != _SPACE))
+    return np.concatenate(ids)[np.concatenate(keep)]
+
+
+def hash_ngram_ids(ids: np.ndarray) -> np.ndarray:
+    """char_ngram_ids の 64 ビット ID を uint32 のハッシュにする（乗算した上位 32 ビット）。"""
+    ids = np.asarray(ids, dtype=np.uint64)
+    return ((ids * _HASH_MULTIPLIER) >> np.uint64(32)).astype(np.uint32)
+
+
+def merge_postings(old: tuple, new: tuple) -> tuple:
+    """ハッシュでソート済みの転置リスト 2 本 (terms, rows, tf) を、全体を並べ替えずに 1 本にまとめる。
+
+    new の各エントリは同じハッシュを持つ old のエントリの後ろに入る（new の行番号は old より大きいので、
+    同じハッシュの中でも行番号順が保たれる）。コストは O(len(new) log len(old) + 全体のコピー)。
+    """
+    if old[0].size == 0:
+        return new
+    positions = np.searchsorted(old[0], new[0], side="right") + np.arange(new[0].size)
+    is_new = np.zeros(old[0].size + new[0].size, dtype=bool)
+    is_new[positions] = True
+    merged = []
+    for a, b in zip(old, new):
+        out = np.empty(is_new.size, dtype=a.dtype)
+        out[is_new] = b
+        out[~is_new] = a
+        merged.append(out)
+    return tuple(merged)
+
+
+def reciprocal_rank_fusion(rankings, *, k: int = DEFAULT_RRF_K) -> tuple[np.ndarray, np.ndarray]:
+    """複数の順位リスト（行番号の配列、良い順）を RRF で統合し、(行, スコア) をスコアの降順で返す。
+
+    score(row) = Σ 1 / (k + 順位)（順位は 1 始まり）。
+    """
+    rows = [np.asarray(r, dtype=np.int64) for r in rankings if len(r)]
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    all_rows = np.concatenate(rows)
+    contrib = np.concatenate([1.0 / (k + np.arange(1, len(r) + 1)) for r in rows])
+    uniq, inverse = np.unique(all_rows, return_inverse=True)
+    scores = np.bincount(inverse, weights=contrib).astype(np.float32)
+    order = np.argsort(-scores, kind="stable")
+    return uniq[order], scores[order]
+
+
+class LexicalIndex:
+    """VectorIndex のテキストに対する文字 n-gram の BM25 インデックス。
+
+    仕様:
+      - search(query_text, k) は BM25 スコアの上位 k 件の (行, スコア) を返す（一致なしなら空）
+      - rows（行番号の配列）を渡すと、その行だけを候補にする
+      - 構築後に VectorIndex へ追加された行は次の検索時に取り込み（追加分だけを並べ替えて既存の
+        転置リストにマージする）、削除された行は結果に含めない
+    """
+
+    def __init__(self, index):
+        self.base = index
+        self._terms = np.empty(0, dtype=np.uint32)  # 転置リスト: n-gram のハッシュ（昇順）
+        self._rows = np.empty(0, dtype=np.int32)  # 転置リスト: 行番号
+        self._tf = np.empty(0, dtype=np.uint16)  # 転置リスト: 行内の出現回数（上限で頭打ち）
+        self._doc_len = np.empty(0, dtype=np.float32)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, index) -> "LexicalIndex":
+        lexical = cls(index)
+        lexical._sync(len(index.texts))
+        return lexical
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    @property
+    def nbytes(self) -> int:
+        """転置リストと文書長が使うバイト数。"""
+        return int(self._terms.nbytes + self._rows.nbytes + self._tf.nbytes + self._doc_len.nbytes)
+
+    def _sync(self, n: int) -> None:
+        """行 [索引済み, n) のテキストを転置リストへ取り込む。"""
+        if n <= len(self._doc_len):
+            return
+        with self._lock:
+            start = len(self._doc_len)
+            if n <= start:
+                return
+            terms, rows, tfs = [], [], []
+            doc_len = np.zeros(n - start, dtype=np.float32)
+            for i, text in enumerate(self.base.texts[start:n]):
+                ids = char_ngram_ids(text)
+                if ids.size == 0:
+                    continue
+                uniq, counts = np.unique(hash_ngram_ids(ids), return_counts=True)
+                terms.append(uniq)
+                rows.append(np.full(uniq.size, start + i, dtype=np.int32))
+                tfs.append(np.minimum(counts, _TF_MAX).astype(np.uint16))
+                doc_len[i] = ids.size
+            if terms:
+                # 追加分だけを並べ替え、既存の（ソート済みの）転置リストにマージする
+                new_terms = np.concatenate(terms)
+                order = np.argsort(new_terms, kind="stable")
+                new = (new_terms[order], np.concatenate(rows)[order], np.concatenate(tfs)[order])
+                self._terms, self._rows, self._tf = merge_postings((self._terms, self._rows, self._tf), new)
+            self._doc_len = np.concatenate([self._doc_len, doc_len])
+
+    def scores(self, query_text: str, n: int | None = None) -> np.ndarray:
+        """全行（先頭 n 行）の BM25 スコア（一致しない行は 0）。"""
+        n = len(self.base.texts) if n is None else n
+        self._sync(n)
+        terms, rows, tf, doc_len = self._terms, self._rows, self._tf, self._doc_len[:n]
+        out = np.zeros(n, dtype=np.float32)
+        query_terms = np.unique(hash_ngram_ids(char_ngram_ids(query_text)))
+        if query_terms.size == 0 or n == 0:
+            return out
+        lo = np.searchsorted(terms, query_terms, side="left")
+        hi = np.searchsorted(terms, query_terms, side="right")
+        avgdl = float(doc_len.mean()) or 1.0
+        for a, b in zip(lo, hi):
+            if a == b:
+                continue
+            r, f = rows[a:b], tf[a:b].astype(np.float32)
+            keep = r < n
+            r, f = r[keep], f[keep]
+            idf = math.log(1.0 + (n - len(r) + 0.5) / (len(r) + 0.5))
+            out[r] += idf * f * (BM25_K1 + 1.0) / (f + BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[r] / avgdl))
+        return out
+
+    def search(self, query_text: str, k: int = DEFAULT_TOP_K, *, rows=None) -> tuple[np.ndarray, np.ndarray]:
+        E, live = self.base.snapshot()
+        scores = self.scores(query_text, E.shape[0])
+        if live is not None:
+            scores[~live] = 0.0
+        if rows is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed[resolve_rows(rows, len(scores))] = True
+            scores[~allowed] = 0.0
+        matched = int(np.count_nonzero(scores))
+        if matched == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return select_top_k(scores, min(resolve_top_k(k, len(scores)), matched))
+
+
+class HybridSearcher:
+    """密ベクトル検索（VectorIndex / IVFIndex / QuantizedIndex）と LexicalIndex を組み合わせる検索器。
+
+    仕様:
+      - search(query_embedding, k, query_text=...) は RRF スコアの上位 k 件の (行, スコア) を返す
+      - query_text を省略した場合や語彙の一致が無い場合は、密ベクトル検索の結果をそのまま返す
+      - prefilter=True なら語彙検索の上位 candidates 件だけを元ベクトルで採点し（全件走査しない）、
+        両方の順位を統合する。False なら密ベクトル検索と語彙検索の上位 candidates 件ずつを統合する
+      - rows（メタデータ絞り込みの結果など）を渡すと、密ベクトル・語彙の両方をその行だけで検索する
+        （密ベクトル側は元ベクトルでの厳密採点になる）
+    """
+
+    def __init__(
+        self,
+        dense,
+        lexical: LexicalIndex,
+        *,
+        prefilter: bool = False,
+        candidates: int = DEFAULT_HYBRID_CANDIDATES,
+        rrf_k: int = DEFAULT_RRF_K,
+    ):
+        self.dense = dense
+        self.lexical = lexical
+        self.prefilter = prefilter
+        self.candidates = max(1, int(candidates))
+        self.rrf_k = rrf_k
+
+    @property
+    def dim(self) -> int:
+        return self.dense.dim
+
+    def __len__(self) -> int:
+        return len(self.dense)
+
+    def _dense_search(self, query_embedding, k: int, rows):
+        if rows is None:
+            return self.dense.search(query_embedding, k)
+        return self.lexical.base.search(query_embedding, k, rows=rows)
+
+    def search(self, query_embedding, k: int = DEFAULT_TOP_K, *, query_text: str | None = None, rows=None):
+        if not query_text:
+            return self._dense_search(query_embedding, k, rows)
+        lex_rows, _ = self.lexical.search(query_text, self.candidates, rows=rows)
+        if lex_rows.size == 0:
+            return self._dense_search(query_embedding, k, rows)
+
+        if self.prefilter:
+            # 語彙候補の行だけを元ベクトルで採点する（行順に読むと memmap でも順方向アクセスになる）
+            q = normalize_query(query_embedding, self.dim)
+            E, _ = self.lexical.base.snapshot()
+            rows = np.sort(lex_rows)
+            pos, _ = select_top_k(np.asarray(E[rows]) @ q, len(rows))
+            dense_rows = rows[pos]
+        else:
+            dense_rows, _ = self._dense_search(query_embedding, max(k, self.candidates), rows)
+
+        fused, scores = reciprocal_rank_fusion([dense_rows, lex_rows], k=self.rrf_k)
+        k = resolve_top_k(k, len(fused))
+        return fused[:k], scores[:k]
+
+    def get_texts(self, indices) -> list[str]:
+        return self.dense.get_texts(indices)
+
+    def get_metadata(self, indices) -> list[dict]:
+        return self.lexical.base.get_metadata(indices)
@@ -0,0 +1,144 @@
+import re
+import threading
+
+import numpy as np
+
+try:
+    from .vector_index import MISSING
+except ImportError:  # "streamlit run app.py" でスクリプトとして実行された場合
+    from vector_index import MISSING
+
+# -----------------------------------------------------------------------------
+# メタデータの列指向インデックス（ソースファイル・ページでの絞り込み検索と出典表示）
+#   - VectorIndex.metadata（MetadataColumns: ソースファイル番号・ページ範囲などの整数配列）をそのまま使う
+#   - ドキュメントの行は連続して追加されるので、ソースファイルごとの行集合は
+#     (開始, 終了) の区間リストで持つ（全行のビットマップより小さく、行番号列への展開も速い）
+#   - select で得た行番号を VectorIndex.search(rows=...) に渡すと、その行だけが採点される
+# -----------------------------------------------------------------------------
+
+NO_PAGE = MISSING  # ページ情報の無い行
+
+
+def parse_page_range(text: str) -> tuple[int, int] | None:
+    """"3" / "3-10" / "3〜10" 形式のページ指定を (開始, 終了) にする。空なら None、不正なら ValueError。"""
+    text = (text or "").strip()
+    if not text:
+        return None
+    m = re.fullmatch(r"(\d+)\s*(?:[-〜~]\s*(\d+))?", text)
+    if not m:
+        raise ValueError("page range must look like '3' or '3-10'")
+    lo = int(m.group(1))
+    hi = int(m.group(2)) if m.group(2) else lo
+    if hi < lo:
+        raise ValueError("page range end must be >= start")
+    return lo, hi
+
+
+def format_citation(meta: dict) -> str:
+    """行メタデータから出典の表記を作る（例: "a.pdf p.3-4" / "b.csv 行 10-20"）。"""
+    source = meta.get("source_file") or "(不明なソース)"
+    for key, label in (("page", "p."), ("row", "行 ")):
+        start, end = meta.get(f"{key}_start"), meta.get(f"{key}_end")
+        if start is not None:
+            span = f"{start}" if end in (None, start) else f"{start}-{end}"
+            return f"{source} {label}{span}"
+    if "chunk_id" in meta:
+        return f"{source} #{meta['chunk_id']}"
+    return source
+
+
+class MetadataIndex:
+    """VectorIndex の列指向メタデータ（MetadataColumns）の上で、ソースファイル・ページで行を絞り込む。
+
+    仕様:
+      - select(source_files=..., pages=(開始, 終了)) は条件を満たす行番号（昇順）を返す
+        （pages はページ範囲が重なるチャンクを選ぶ。ページ情報の無い行は pages 指定時に除外）
+      - 列はコピーせず VectorIndex の配列を参照し、ここではソースごとの行区間だけを持つ
+      - 構築後に VectorIndex へ追加された行は次の呼び出し時に取り込む
+      - 削除済みの行は select の結果に含まれうる（VectorIndex.search 側で除外される）
+    """
+
+    def __init__(self, index):
+        self.base = index
+        self._ranges: dict[int, list[list[int]]] = {}  # ソース番号 -> [[開始, 終了), ...]
+        self._synced = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, index) -> "MetadataIndex":
+        meta = cls(index)
+        meta._sync(len(index.metadata))
+        return meta
+
+    def __len__(self) -> int:
+        return self._synced
+
+    @property
+    def sources(self) -> list[str]:
+        return self.base.metadata.sources
+
+    @property
+    def source_ids(self) -> np.ndarray:
+        return self.base.metadata.source_ids
+
+    @property
+    def page_start(self) -> np.ndarray:
+        return self.base.metadata.column("page_start")
+
+    @property
+    def page_end(self) -> np.ndarray:
+        """ページ範囲の終端（page_end が無く page_start だけある行は page_start）。"""
+        start, end = self.page_start, self.base.metadata.column("page_end")
+        return np.where(end == NO_PAGE, start, end)
+
+    def _sync(self, n: int) -> None:
+        """行 [取り込み済み, n) のソース番号を、連続する区間ごとに _ranges へ足す。"""
+        if n <= self._synced:
+            return
+        with self._lock:
+            start = self._synced
+            if n <= start:
+                return
+            ids = self.source_ids[start:n]
+            bounds = np.flatnonzero(np.diff(ids)) + 1
+            for a, b in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(ids)]])):
+                code = int(ids[a])
+                if code < 0:
+                    continue
+                ranges = self._ranges.setdefault(code, [])
+                if ranges and ranges[-1][1] == start + a:
+                    ranges[-1][1] = start + int(b)
+                else:
+                    ranges.append([start + int(a), start + int(b)])
+            self._synced = n
+
+    def source_counts(self) -> dict[str, int]:
+        """ソースファイルごとの（削除済みを除く）行数。"""
+        E, live = self.base.snapshot()
+        self._sync(E.shape[0])
+        ids = self.source_ids[: E.shape[0]]
+        if live is not None:
+            ids = ids[live]
+        counts = np.bincount(ids[ids >= 0], minlength=len(self.sources))
+        return {source: int(counts[code]) for code, source in enumerate(self.sources) if counts[code]}
+
+    def select(self, *, source_files=None, pages: tuple[int, int] | None = None) -> np.ndarray:
+        """条件に合う行番号を昇順で返す。条件を何も指定しなければ全行。"""
+        n = len(self.base.texts)
+        self._sync(n)
+        if source_files is None:
+            rows = np.arange(n, dtype=np.int64)
+        else:
+            codes = [self.base.metadata.source_code(source) for source in source_files]
+            spans = [
+                np.arange(a, min(b, n), dtype=np.int64)
+                for code in codes
+                if code is not None
+                for a, b in self._ranges.get(code, [])
+            ]
+            rows = np.sort(np.concatenate(spans)) if spans else np.empty(0, dtype=np.int64)
+        if pages is not None and rows.size:
+            lo, hi = pages
+            start, end = self.page_start[rows], self.page_end[rows]
+            rows = rows[(start != NO_PAGE) & (start <= hi) & (end >= lo)]
+        return rows
@@ -0,0 +1,224 @@
+import os
+import threading
+
+import numpy as np
+
+try:
+    from .vector_index import DEFAULT_TOP_K, normalize_query, resolve_top_k, select_top_k
+except ImportError:  # "streamlit run app.py" でスクリプトとして実行された場合
+    from vector_index import DEFAULT_TOP_K, normalize_query, resolve_top_k, select_top_k
+
+# -----------------------------------------------------------------------------
+# 埋め込みの量子化（int8 スカラー量子化 / 直積量子化）と厳密リランキング
+#   - 一次採点は圧縮コード上で行い、上位 rerank_factor * k 件だけを
+#     float32 の元ベクトル（memmap など。必要な行だけが読まれる）で採点し直す。
+#   - メモリを減らすには元ベクトルがファイルのメモリマップである必要がある（VectorStore の
+#     shared_dir を設定すると refresh のたびに .npy へ書き出してマップし、ヒープの行列を手放す）。
+# -----------------------------------------------------------------------------
+
+DEFAULT_RERANK_FACTOR = int(os.environ.get("QUANT_RERANK_FACTOR", "4"))
+DEFAULT_PQ_SUBSPACES = int(os.environ.get("QUANT_PQ_SUBSPACES", "96"))
+PQ_CENTROIDS = 256
+# コードを float32 に展開して採点・符号化するときの 1 ブロックの行数（一時配列の大きさを抑える）
+SCORE_BLOCK_ROWS = 16384
+
+
+def _heap_bytes(array: np.ndarray) -> int:
+    """配列がファイルのメモリマップ（のビュー）なら 0、そうでなければ配列のバイト数。"""
+    base = array
+    while base is not None:
+        if isinstance(base, np.memmap):
+            return 0
+        base = base.base
+    return int(array.nbytes)
+
+
+def encode_blocks(quantizer, X: np.ndarray) -> np.ndarray:
+    """X を SCORE_BLOCK_ROWS 行ずつ符号化する（memmap 全体を一度に float32 の一時配列へ読み込まない）。"""
+    blocks = [quantizer.encode(X[start : start + SCORE_BLOCK_ROWS]) for start in range(0, X.shape[0], SCORE_BLOCK_ROWS)]
+    if blocks:
+        return np.concatenate(blocks)
+    return quantizer.encode(X[:0])
+
+
+class ScalarQuantizer:
+    """次元ごとの min/max で 256 段階に量子化する int8 量子化器（1 次元 1 バイト）。"""
+
+    def __init__(self, lo: np.ndarray, scale: np.ndarray):
+        self.lo = np.asarray(lo, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, X: np.ndarray) -> "ScalarQuantizer":
+        lo = X.min(axis=0)
+        scale = (X.max(axis=0) - lo) / 255.0
+        return cls(lo, np.where(scale > 0, scale, 1.0))
+
+    def encode(self, X: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(X, dtype=np.float32) - self.lo) / self.scale)
+        return (np.clip(codes, 0, 255) - 128).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.lo + (codes.astype(np.float32) + 128.0) * self.scale
+
+    def scores(self, codes: np.ndarray, q: np.ndarray) -> np.ndarray:
+        """q · decode(codes) を、コードを丸ごと展開せずブロック単位で計算する。"""
+        qs = q * self.scale
+        bias = float(q @ (self.lo + 128.0 * self.scale))
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORE_BLOCK_ROWS):
+            block = codes[start : start + SCORE_BLOCK_ROWS]
+            out[start : start + len(block)] = block.astype(np.float32) @ qs + bias
+        return out
+
+
+def _kmeans(X: np.ndarray, k: int, *, n_iter: int, rng) -> np.ndarray:
+    """ユークリッド距離の k-means（直積量子化の部分空間用）。"""
+    centroids = X[rng.choice(X.shape[0], k, replace=False)].copy()
+    for _ in range(n_iter):
+        # argmin ||x - c||^2 = argmax (x·c - ||c||^2 / 2)
+        labels = np.argmax(X @ centroids.T - 0.5 * np.sum(centroids**2, axis=1), axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, X)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return centroids
+
+
+class ProductQuantizer:
+    """次元を m 個の部分空間に分け、それぞれを 256 個のセントロイドで表す直積量子化器（1 ベクトル m バイト）。"""
+
+    def __init__(self, codebooks: np.ndarray):
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)  # (m, 256, d/m)
+
+    @property
+    def m(self) -> int:
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def fit(cls, X: np.ndarray, m: int = DEFAULT_PQ_SUBSPACES, *, n_iter: int = 15, seed: int = 0, max_train: int = 65536):
+        n, d = X.shape
+        if d % m != 0:
+            raise ValueError("dimension must be divisible by the number of subspaces")
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(X[np.sort(rng.choice(n, min(n, max_train), replace=False))], dtype=np.float32)
+        k = min(PQ_CENTROIDS, sample.shape[0])
+        sub = d // m
+        codebooks = np.zeros((m, PQ_CENTROIDS, sub), dtype=np.float32)
+        for j in range(m):
+            codebooks[j, :k] = _kmeans(sample[:, j * sub : (j + 1) * sub], k, n_iter=n_iter, rng=rng)
+            codebooks[j, k:] = codebooks[j, 0]  # 学習点が 256 未満のときの未使用枠
+        return cls(codebooks)
+
+    def encode(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        sub = self.codebooks.shape[2]
+        codes = np.empty((X.shape[0], self.m), dtype=np.uint8)
+        norms = np.sum(self.codebooks**2, axis=2)  # (m, 256)
+        for j in range(self.m):
+            part = X[:, j * sub : (j + 1) * sub]
+            codes[:, j] = np.argmax(part @ self.codebooks[j].T - 0.5 * norms[j], axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def scores(self, codes: np.ndarray, q: np.ndarray) -> np.ndarray:
+        """非対称距離計算: 部分空間ごとに q とセントロイドの内積表を作り、コードで引いて足し合わせる。"""
+        sub = self.codebooks.shape[2]
+        lut = np.einsum("mkd,md->mk", self.codebooks, q.reshape(self.m, sub))  # (m, 256)
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        cols = np.arange(self.m)
+        for start in range(0, codes.shape[0], SCORE_BLOCK_ROWS):
+            block = codes[start : start + SCORE_BLOCK_ROWS]
+            out[start : start + len(block)] = lut[cols, block].sum(axis=1)
+        return out
+
+
+class QuantizedIndex:
+    """VectorIndex の行を圧縮コードで保持し、コードで一次採点 → 元ベクトルで上位候補だけを再採点する。
+
+    仕様:
+      - mode="sq"（int8 スカラー量子化）/ "pq"（直積量子化）
+      - search の検証規則・戻り値は VectorIndex.search と同じ
+      - 元ベクトルは base.matrix から候補行だけを読む（memmap なら必要なページだけが読み込まれる）
+      - 構築後に base へ追加された行は次の検索時に符号化し、削除された行は結果に含めない
+      - 自身は元ベクトルを保持しない（ヒープに残るかどうかは base の行列がメモリマップかどうかで決まる）
+    """
+
+    def __init__(self, index, quantizer, *, rerank_factor: int = DEFAULT_RERANK_FACTOR):
+        self.base = index
+        self.quantizer = quantizer
+        self.rerank_factor = max(1, int(rerank_factor))
+        self.codes = encode_blocks(quantizer, index.matrix)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, index, mode: str = "sq", *, rerank_factor: int = DEFAULT_RERANK_FACTOR, pq_subspaces: int = DEFAULT_PQ_SUBSPACES):
+        if mode == "sq":
+            quantizer = ScalarQuantizer.fit(index.matrix)
+        elif mode == "pq":
+            quantizer = ProductQuantizer.fit(index.matrix, pq_subspaces)
+        else:
+            raise ValueError(f"unknown quantization mode: {mode}")
+        return cls(index, quantizer, rerank_factor=rerank_factor)
+
+    @property
+    def dim(self) -> int:
+        return self.base.dim
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    def _sync(self, n: int) -> None:
+        if n <= self.codes.shape[0]:
+            return
+        with self._lock:
+            start = self.codes.shape[0]
+            if n > start:
+                self.codes = np.concatenate([self.codes, encode_blocks(self.quantizer, self.base.matrix[start:n])])
+
+    def search(self, query_embedding, k: int = DEFAULT_TOP_K, *, rerank: bool = True):
+        q = normalize_query(query_embedding, self.dim)
+        E, live = self.base.snapshot()
+        self._sync(E.shape[0])
+        n = E.shape[0] if live is None else int(live.sum())
+        if n == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        k = resolve_top_k(k, n)
+
+        approx = self.quantizer.scores(self.codes[: E.shape[0]], q)
+        if live is not None:
+            approx[~live] = -np.inf
+        if not rerank:
+            return select_top_k(approx, k)
+
+        shortlist, _ = select_top_k(approx, min(n, k * self.rerank_factor))
+        shortlist = np.sort(shortlist)  # memmap からの読み出しを順方向にする
+        pos, scores = select_top_k(np.asarray(E[shortlist]) @ q, k)
+        return shortlist[pos], scores
+
+    def get_texts(self, indices) -> list[str]:
+        return self.base.get_texts(indices)
+
+    def get_metadata(self, indices) -> list[dict]:
+        return self.base.get_metadata(indices)
+
+    def memory_report(self) -> dict:
+        """実際にヒープに持っているバイト数と、float32 行列だけを持つ場合に対する圧縮率。
+
+        float_heap_bytes は元ベクトルのうちヒープにある分（memmap なら 0。ページキャッシュは OS が必要に応じて手放す）。
+        resident_bytes = code_bytes + float_heap_bytes で、compression = float_bytes / resident_bytes。
+        """
+        code_bytes = int(self.codes.nbytes)
+        float_bytes = int(self.codes.shape[0] * self.dim * 4)
+        float_heap_bytes = _heap_bytes(self.base.matrix)
+        resident = code_bytes + float_heap_bytes
+        return {
+            "code_bytes": code_bytes,
+            "float_bytes": float_bytes,
+            "float_heap_bytes": float_heap_bytes,
+            "resident_bytes": resident,
+            "compression": round(float_bytes / resident, 2) if resident else 0.0,
+        }
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+
+try:
+    from .vector_index import VectorIndex, resolve_top_k
+except ImportError:  # "streamlit run app.py" でスクリプトとして実行された場合
+    from vector_index import VectorIndex, resolve_top_k
+
+# -----------------------------------------------------------------------------
+# RAG の純粋関数（検索・プロンプト組み立て・回答生成）
+#   Streamlit UI（app.py）と HTTP サービス（service.py）の両方から使うため、
+#   streamlit / vertexai に依存しないモジュールに分けている。
+#   generative_model は generate_content を持つオブジェクトなら何でもよい（テストではフェイク）。
+# -----------------------------------------------------------------------------
+
+def find_similar_chunks(query_embedding, embeddings, texts, top_k=None):
+    """コサイン類似度で類似チャンクを見つける（安全・非破壊・シンプル）
+
+    呼び出しごとに VectorIndex を構築する互換ラッパ。アプリ本体では
+    ロード時に 1 度だけ構築した VectorIndex.search を直接使う。
+
+    仕様:
+      - 入力は非破壊（コピーして扱う）
+      - 形状が不正なら ValueError（E: 2次元, q: 1次元, 行数==テキスト数, 列数==クエリ次元）
+      - コーパスが空なら []
+      - top_k 未指定(None) は 3 件（ただしコーパス件数を上限）
+      - top_k が整数でない/0以下は ValueError
+      - NaN/Inf は 0 に置換
+      - クエリがゼロベクトルなら ValueError
+      - コーパス側のゼロベクトルは類似度 0 とみなす
+    """
+    q = np.asarray(query_embedding, dtype=float)
+    E = np.asarray(embeddings, dtype=float)
+    T = list(texts)
+
+    # 形状バリデーション（1行で集約）
+    if not (E.ndim == 2 and q.ndim == 1 and E.shape[0] == len(T) and E.shape[1] == q.shape[0]):
+        raise ValueError("invalid shapes")
+
+    # 空コーパスは空配列を返す
+    if len(T) == 0:
+        return []
+
+    k = resolve_top_k(top_k, len(T))
+    index = VectorIndex(E, T)
+    top_idx, _ = index.search(q, k)
+    return index.get_texts(top_idx)
+
+
+def build_prompt(query: str, similar_chunks: list[str]) -> str:
+    """回答生成用のプロンプトを作る純粋関数"""
+    context = "\n---\n".join(similar_chunks)
+    return f"""
+以下の情報を参考にして、質問に日本語で詳しく回答してください。
+
+--- 情報 ---
+{context}
+--- 情報終わり ---
+
+質問: {query}
+""".strip()
+
+
+def generate_answer(generative_model, prompt: str) -> str:
+    """LLMにプロンプトを渡して回答テキストを返す純粋関数"""
+    resp = generative_model.generate_content([prompt])
+    return getattr(resp, "text", "").strip()
+
+
+def generate_answer_stream(generative_model, prompt: str, timings: dict | None = None):
+    """LLM の応答を届いた順に部分テキストとして yield するジェネレータ。
+
+    timings に dict を渡すと、最初の部分テキストまでの秒数（ttft_sec）と
+    生成完了までの秒数（total_sec）を書き込む。
+    """
+    start = time.perf_counter()
+    for chunk in generative_model.generate_content([prompt], stream=True):
+        text = getattr(chunk, "text", "")
+        if not text:
+            continue
+        if timings is not None and "ttft_sec" not in timings:
+            timings["ttft_sec"] = time.perf_counter() - start
+        yield text
+    if timings is not None:
+        timings["total_sec"] = time.perf_counter() - start
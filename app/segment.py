@@ -0,0 +1,66 @@
+import json
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# 列指向ベクトルセグメントの読み込み（書き出しは document_processor/segment.py）
+#   - <name>.seg.npy  : L2 正規化済み float32 行列（メモリマップで開く）
+#   - <name>.seg.meta : JSON ヘッダ 1 行 + 改行 + UTF-8 テキスト連結
+#   - _segments/ 以下 : コンパクションで複数ドキュメントをまとめたセグメントと manifest
+#                       （書き出しは document_processor/compaction.py）
+# -----------------------------------------------------------------------------
+
+SEGMENT_FORMAT = "rag-segment"
+SEGMENT_VERSION = 1
+JSONL_SUFFIX = ".jsonl"
+VECTORS_SUFFIX = ".seg.npy"
+META_SUFFIX = ".seg.meta"
+TOMBSTONE_SUFFIX = ".tombstone"
+COMPACTED_PREFIX = "_segments/"
+CURRENT_NAME = COMPACTED_PREFIX + "CURRENT"
+MANIFEST_FORMAT = "rag-segment-manifest"
+MANIFEST_VERSION = 1
+
+
+def parse_segment_meta(data: bytes) -> tuple[dict, list[str]]:
+    """メタバイト列を (ヘッダ, テキスト一覧) に分解する。未知の形式/版は ValueError。"""
+    sep = data.index(b"\n")
+    header = json.loads(data[:sep].decode("utf-8"))
+    if header.get("format") != SEGMENT_FORMAT or header.get("version") != SEGMENT_VERSION:
+        raise ValueError("unsupported segment format")
+
+    blob = memoryview(data)[sep + 1 :]
+    offsets = header["text_offsets"]
+    texts = [bytes(blob[offsets[i] : offsets[i + 1]]).decode("utf-8") for i in range(header["count"])]
+    return header, texts
+
+
+def segment_metadata(header: dict) -> list[dict]:
+    """ヘッダの列指向メタデータを、行ごとの dict（source_file 付き）に展開する。"""
+    columns = header.get("columns", {})
+    return [
+        {"source_file": header.get("source_file", ""), **{name: values[i] for name, values in columns.items()}}
+        for i in range(header["count"])
+    ]
+
+
+def load_segment(vectors_path: str, meta_path: str) -> tuple[np.ndarray, list[str], list[dict]]:
+    """ローカルのセグメントを開き、(読み取り専用 memmap 行列, テキスト, 行メタデータ) を返す。"""
+    with open(meta_path, "rb") as f:
+        header, texts = parse_segment_meta(f.read())
+
+    if header["count"] == 0:
+        return np.empty((0, header["dim"]), dtype=np.float32), texts, []
+
+    matrix = np.load(vectors_path, mmap_mode="r", allow_pickle=False)
+    if matrix.dtype != np.float32 or matrix.shape != (header["count"], header["dim"]):
+        raise ValueError("segment matrix does not match its header")
+    return matrix, texts, segment_metadata(header)
+
+
+def parse_segment_manifest(data: bytes) -> dict:
+    """コンパクションの manifest を読み込む。未知の形式/版は ValueError。"""
+    manifest = json.loads(data.decode("utf-8"))
+    if manifest.get("format") != MANIFEST_FORMAT or manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("unsupported segment manifest format")
+    return manifest
@@ -0,0 +1,397 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+try:
+    from .answer_cache import SemanticAnswerCache
+    from .embedding_cache import QueryEmbeddingCache
+    from .lexical import HybridSearcher, LexicalIndex
+    from .metadata_index import MetadataIndex, format_citation, parse_page_range
+    from .rag import build_prompt, generate_answer, generate_answer_stream
+    from .sharded import ShardedIndex
+    from .telemetry import TELEMETRY
+    from .vector_index import DEFAULT_TOP_K
+    from .vector_store import VectorStore
+except ImportError:  # "python service.py" でスクリプトとして実行された場合
+    from answer_cache import SemanticAnswerCache
+    from embedding_cache import QueryEmbeddingCache
+    from lexical import HybridSearcher, LexicalIndex
+    from metadata_index import MetadataIndex, format_citation, parse_page_range
+    from rag import build_prompt, generate_answer, generate_answer_stream
+    from sharded import ShardedIndex
+    from telemetry import TELEMETRY
+    from vector_index import DEFAULT_TOP_K
+    from vector_store import VectorStore
+
+# -----------------------------------------------------------------------------
+# Streamlit から独立した検索・回答 HTTP サービス（asyncio / Starlette）
+#   - プロセスごとに VectorStore と検索器を 1 つだけ持ち、全リクエストで共有する
+#   - 採点・埋め込み・LLM 呼び出しはブロッキングなので上限付きスレッドプールで実行し、
+#     イベントループは止めない（numpy の行列演算は GIL を解放するので並行に進む）
+#   - POST /embed, /search, /answer と GET /healthz, /sources, /metrics, POST /refresh
+#   - Streamlit UI は RAG_SERVICE_URL を設定するとこのサービスの薄いクライアントになる
+# 起動: python service.py（Cloud Run では PORT を見る）
+# -----------------------------------------------------------------------------
+
+DEFAULT_SERVICE_WORKERS = int(os.environ.get("SERVICE_WORKERS", str(min(8, os.cpu_count() or 1))))
+DEFAULT_EMBEDDING_MODEL_NAME = "text-embedding-004"
+DEFAULT_HYBRID_MODE = os.environ.get("HYBRID_MODE", "off")
+MAX_EMBED_TEXTS = int(os.environ.get("SERVICE_MAX_EMBED_TEXTS", "250"))
+
+
+class RagService:
+    """共有インデックスに対する埋め込み・検索・回答生成（HTTP 層から独立した本体）。
+
+    仕様:
+      - 検索器はインデックスが差し替わったとき（コンパクションなど）だけ作り直す
+      - ブロッキング処理は executor で実行し、trace / span の文脈を引き継ぐ
+      - インデックスが未ロード（または空）のとき ready は False
+      - 絞り込み条件に合うチャンクが無いときは LLM を呼ばず、回答キャッシュにも書かない（answer は空文字）
+    """
+
+    def __init__(
+        self,
+        store,
+        embedding_model,
+        generative_model,
+        *,
+        embedding_model_name: str = DEFAULT_EMBEDDING_MODEL_NAME,
+        hybrid_mode: str = DEFAULT_HYBRID_MODE,
+        shards: int = 1,
+        query_cache=None,
+        answer_cache=None,
+        max_workers: int = DEFAULT_SERVICE_WORKERS,
+        telemetry=TELEMETRY,
+    ):
+        self.store = store
+        self.embedding_model = embedding_model
+        self.generative_model = generative_model
+        self.hybrid_mode = hybrid_mode
+        self.shards = max(1, int(shards))
+        self.query_cache = query_cache if query_cache is not None else QueryEmbeddingCache(embedding_model_name)
+        self.answer_cache = answer_cache if answer_cache is not None else SemanticAnswerCache()
+        self.telemetry = telemetry
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="rag-service")
+        self._resources: tuple | None = None  # (index, searcher, metadata_index)
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.store.index is not None and len(self.store.index) > 0
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._resources is not None and isinstance(self._resources[1], ShardedIndex):
+            self._resources[1].close()
+
+    def run(self, fn, *args):
+        """fn(*args) をスレッドプールで実行する awaitable（呼び出し元の contextvars を引き継ぐ）。"""
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, contextvars.copy_context().run, fn, *args)
+
+    def resources(self) -> tuple:
+        """(インデックス, 検索器, メタデータ索引)。インデックスが差し替わっていれば作り直す。"""
+        index = self.store.index
+        if index is None:
+            raise RuntimeError("vector index is not loaded")
+        with self._lock:
+            if self._resources is None or self._resources[0] is not index:
+                old = self._resources
+                searcher = ShardedIndex.build(index, self.shards) if self.shards > 1 else index
+                if self.hybrid_mode in ("rrf", "prefilter"):
+                    searcher = HybridSearcher(searcher, LexicalIndex.build(index), prefilter=self.hybrid_mode == "prefilter")
+                self._resources = (index, searcher, MetadataIndex.build(index))
+                if old is not None and isinstance(old[1], ShardedIndex):
+                    old[1].close()
+            return self._resources
+
+    def _embed_sync(self, texts: list[str]) -> list[np.ndarray]:
+        """キャッシュに無いテキストだけを（重複を除いて）1 回の get_embeddings でまとめて求める。"""
+        vectors = {text: self.query_cache.get(text) for text in dict.fromkeys(texts)}
+        missing = [text for text, vector in vectors.items() if vector is None]
+        if missing:
+            for text, emb in zip(missing, self.embedding_model.get_embeddings(missing)):
+                vectors[text] = self.query_cache.put(text, getattr(emb, "values", emb))
+        return [vectors[text] for text in texts]
+
+    def _retrieve_sync(self, query: str, q_emb, k, source_files, pages) -> tuple[np.ndarray, list[dict]]:
+        index, searcher, metadata_index = self.resources()
+        k = DEFAULT_TOP_K if k is None else k
+        rows = None
+        if source_files or pages is not None:
+            rows = metadata_index.select(source_files=source_files or None, pages=pages)
+            if rows.size == 0:
+                return rows, []
+        with self.telemetry.span("retrieval", hybrid=self.hybrid_mode, filtered_rows=None if rows is None else len(rows)):
+            if isinstance(searcher, HybridSearcher):
+                top_idx, scores = searcher.search(q_emb, k, query_text=query, rows=rows)
+            else:
+                top_idx, scores = searcher.search(q_emb, k, rows=rows)
+        texts = index.get_texts(top_idx)
+        metadata = index.get_metadata(top_idx)
+        hits = [
+            {"row": int(r), "score": float(s), "text": t, "metadata": m, "citation": format_citation(m)}
+            for r, s, t, m in zip(top_idx, scores, texts, metadata)
+        ]
+        return top_idx, hits
+
+    async def embed(self, texts: list[str]) -> list[np.ndarray]:
+        with self.telemetry.span("query_embedding", count=len(texts)):
+            return await self.run(self._embed_sync, list(texts))
+
+    async def search(self, query: str, *, k=None, source_files=None, pages=None) -> tuple[np.ndarray, list[dict]]:
+        (q_emb,) = await self.embed([query])
+        return await self.run(self._retrieve_sync, query, q_emb, k, source_files, pages)
+
+    async def answer(self, query: str, *, k=None, source_files=None, pages=None) -> dict:
+        (q_emb,) = await self.embed([query])
+        rows, hits = await self.run(self._retrieve_sync, query, q_emb, k, source_files, pages)
+        if not hits:
+            return {"answer": "", "cached": False, "sources": []}
+        version = self.store.version
+        with self.telemetry.span("answer_cache_lookup") as span:
+            answer = self.answer_cache.lookup(q_emb, rows, version=version)
+            span["hit"] = answer is not None
+        cached = answer is not None
+        if not cached:
+            prompt = build_prompt(query, [h["text"] for h in hits])
+            with self.telemetry.span("llm_generation"):
+                answer = await self.run(generate_answer, self.generative_model, prompt)
+            if answer:
+                self.answer_cache.store(q_emb, rows, answer, version=version)
+        return {"answer": answer, "cached": cached, "sources": hits}
+
+    async def answer_stream(self, query: str, *, k=None, source_files=None, pages=None):
+        """出典 → 部分テキスト → 完了 の順に dict を yield する（NDJSON で返す用）。
+
+        絞り込み条件に合うチャンクが無ければ、空の出典の後すぐに完了を返す。
+        """
+        (q_emb,) = await self.embed([query])
+        rows, hits = await self.run(self._retrieve_sync, query, q_emb, k, source_files, pages)
+        yield {"sources": hits}
+        if not hits:
+            yield {"done": True, "cached": False}
+            return
+        version = self.store.version
+        answer = self.answer_cache.lookup(q_emb, rows, version=version)
+        if answer is not None:
+            yield {"delta": answer}
+            yield {"done": True, "cached": True}
+            return
+
+        prompt = build_prompt(query, [h["text"] for h in hits])
+        timings: dict = {}
+        parts = []
+        async for delta in self._iterate_in_thread(lambda: generate_answer_stream(self.generative_model, prompt, timings)):
+            parts.append(delta)
+            yield {"delta": delta}
+        if "ttft_sec" in timings:
+            self.telemetry.record("llm_ttft", timings["ttft_sec"])
+        answer = "".join(parts).strip()
+        if answer:
+            self.answer_cache.store(q_emb, rows, answer, version=version)
+        yield {"done": True, "cached": False}
+
+    async def _iterate_in_thread(self, make_iter):
+        """同期イテレータをスレッドプールで回し、要素が届くたびに非同期で yield する。"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        end = object()
+
+        def pump():
+            try:
+                for item in make_iter():
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, end)
+
+        future = self.run(pump)
+        while True:
+            item = await queue.get()
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        await future
+
+
+# --- HTTP 層 -------------------------------------------------------------------
+
+
+def _filters(body: dict) -> dict:
+    """リクエスト本文から k / source_files / pages を取り出す（不正なら ValueError）。"""
+    pages = body.get("pages")
+    if isinstance(pages, str):
+        pages = parse_page_range(pages)
+    elif pages is not None:
+        if not isinstance(pages, (list, tuple)) or len(pages) != 2:
+            raise ValueError("pages must be 'start-end' or [start, end]")
+        pages = parse_page_range(f"{int(pages[0])}-{int(pages[1])}")
+    k = body.get("k")
+    if k is not None and (isinstance(k, bool) or not isinstance(k, int) or k <= 0):
+        raise ValueError("k must be a positive integer")
+    source_files = body.get("source_files")
+    if source_files is not None and not isinstance(source_files, list):
+        raise ValueError("source_files must be a list")
+    return {"k": k, "source_files": source_files, "pages": pages}
+
+
+async def _json_body(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ValueError("request body must be JSON")
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    return body
+
+
+def _query(body: dict) -> str:
+    query = body.get("query")
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("query is required")
+    return query
+
+
+def create_app(service: RagService, *, refresh_interval_sec: float = 0.0) -> Starlette:
+    """RagService を HTTP で公開する Starlette アプリ。
+
+    ValueError は 400、インデックス未ロードは 503 で返す（ストリーミング中の例外は {"error": ...} の行）。
+    refresh_interval_sec > 0 ならバックグラウンドで定期的に store.maybe_refresh を呼ぶ。
+    """
+
+    def endpoint(handler, *, needs_index: bool = True):
+        async def wrapped(request: Request):
+            if needs_index and not service.ready:
+                return JSONResponse({"error": "vector index is not loaded"}, status_code=503)
+            try:
+                with service.telemetry.trace(f"http {request.url.path}"):
+                    return await handler(request)
+            except ValueError as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
+
+        return wrapped
+
+    async def embed(request: Request):
+        texts = (await _json_body(request)).get("texts")
+        if not isinstance(texts, list) or not texts or not all(isinstance(t, str) for t in texts):
+            raise ValueError("texts must be a non-empty list of strings")
+        if len(texts) > MAX_EMBED_TEXTS:
+            raise ValueError(f"at most {MAX_EMBED_TEXTS} texts per request")
+        vectors = await service.embed(texts)
+        return JSONResponse({"embeddings": [np.asarray(v, dtype=np.float32).tolist() for v in vectors]})
+
+    async def search(request: Request):
+        body = await _json_body(request)
+        _, hits = await service.search(_query(body), **_filters(body))
+        return JSONResponse({"results": hits})
+
+    async def answer(request: Request):
+        body = await _json_body(request)
+        query, filters = _query(body), _filters(body)
+        if body.get("stream"):
+            async def lines():
+                # ステータスコードは送信済みなので、途中の例外は error イベントとして返して本文を閉じる
+                try:
+                    async for event in service.answer_stream(query, **filters):
+                        yield json.dumps(event, ensure_ascii=False) + "\n"
+                except Exception as e:
+                    if not isinstance(e, ValueError):
+                        print(f"[WARN] ストリーミング回答に失敗しました: {e}")
+                    yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+        return JSONResponse(await service.answer(query, **filters))
+
+    async def sources(request: Request):
+        _, _, metadata_index = await service.run(service.resources)
+        return JSONResponse({"sources": metadata_index.source_counts()})
+
+    async def refresh(request: Request):
+        stats = await service.run(service.store.refresh)
+        return JSONResponse({**stats, "version": service.store.version})
+
+    async def healthz(request: Request):
+        if not service.ready:
+            return JSONResponse({"status": "loading"}, status_code=503)
+        return JSONResponse({"status": "ok", "chunks": len(service.store.index), "version": service.store.version})
+
+    async def metrics(request: Request):
+        return JSONResponse(service.telemetry.summary())
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        task = None
+        if refresh_interval_sec > 0:
+            async def refresh_loop():
+                while True:
+                    await asyncio.sleep(refresh_interval_sec)
+                    try:
+                        await service.run(service.store.maybe_refresh, refresh_interval_sec)
+                    except Exception as e:
+                        print(f"[WARN] 定期 refresh に失敗しました: {e}")
+
+            task = asyncio.create_task(refresh_loop())
+        try:
+            yield
+        finally:
+            if task is not None:
+                task.cancel()
+            service.close()
+
+    return Starlette(
+        routes=[
+            Route("/embed", endpoint(embed, needs_index=False), methods=["POST"]),
+            Route("/search", endpoint(search), methods=["POST"]),
+            Route("/answer", endpoint(answer), methods=["POST"]),
+            Route("/sources", endpoint(sources), methods=["GET"]),
+            Route("/refresh", endpoint(refresh, needs_index=False), methods=["POST"]),
+            Route("/healthz", healthz, methods=["GET"]),
+            Route("/metrics", metrics, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+def main():
+    """環境変数から GCP クライアントを作り、ベクトルストアを読み込んでから HTTP サービスを起動する。"""
+    import uvicorn
+    import vertexai
+    from google.cloud import storage
+    from vertexai.generative_models import GenerativeModel
+    from vertexai.language_models import TextEmbeddingModel
+
+    project_id = os.environ.get("GCP_PROJECT", "serious-timer-467517-e1")
+    region = os.environ.get("REGION", "us-central1")
+    bucket_name = os.environ.get("VECTOR_BUCKET_NAME")
+    if not bucket_name:
+        raise SystemExit("環境変数 VECTOR_BUCKET_NAME が設定されていません。")
+
+    vertexai.init(project=project_id, location=region)
+    store = VectorStore(storage.Client(), bucket_name)
+    store.refresh()
+    service = RagService(
+        store,
+        TextEmbeddingModel.from_pretrained(DEFAULT_EMBEDDING_MODEL_NAME),
+        GenerativeModel("gemini-1.5-pro"),
+        shards=int(os.environ.get("SEARCH_SHARDS", "1")),
+    )
+    app = create_app(service, refresh_interval_sec=float(os.environ.get("VECTOR_REFRESH_INTERVAL_SEC", "0")))
+    uvicorn.run(app, host=os.environ.get("SERVICE_HOST", "0.0.0.0"), port=int(os.environ.get("PORT", "8080")))
+
+
+if __name__ == "__main__":
+    main()
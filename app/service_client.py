@@ -0,0 +1,83 @@
+import json
+import urllib.error
+import urllib.request
+
+# -----------------------------------------------------------------------------
+# RAG HTTP サービス（service.py）のクライアント
+#   Streamlit UI を薄いクライアントとして動かすときに使う（標準ライブラリだけで動く）。
+# -----------------------------------------------------------------------------
+
+DEFAULT_TIMEOUT_SEC = 120.0
+
+
+class RagServiceClient:
+    """service.py のエンドポイントを呼ぶ同期クライアント。
+
+    サービスが 4xx を返した場合は ValueError（本文の error を含む）、それ以外の HTTP エラーは
+    urllib.error.HTTPError をそのまま送出する。
+    """
+
+    def __init__(self, base_url: str, *, timeout: float = DEFAULT_TIMEOUT_SEC):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, path: str, body: dict | None = None):
+        data = None if body is None else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(
+            self.base_url + path, data=data, method="GET" if body is None else "POST",
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500:
+                try:
+                    message = json.loads(e.read().decode("utf-8")).get("error", e.reason)
+                except (ValueError, AttributeError):
+                    message = e.reason
+                raise ValueError(message) from e
+            raise
+
+    def _call(self, path: str, body: dict | None = None) -> dict:
+        with self._open(path, body) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    @staticmethod
+    def _request(query: str, k, source_files, pages) -> dict:
+        body = {"query": query}
+        if k is not None:
+            body["k"] = k
+        if source_files:
+            body["source_files"] = list(source_files)
+        if pages is not None:
+            body["pages"] = list(pages)
+        return body
+
+    def health(self) -> dict:
+        return self._call("/healthz")
+
+    def sources(self) -> dict[str, int]:
+        return self._call("/sources")["sources"]
+
+    def refresh(self) -> dict:
+        return self._call("/refresh", {})
+
+    def search(self, query: str, *, k=None, source_files=None, pages=None) -> list[dict]:
+        return self._call("/search", self._request(query, k, source_files, pages))["results"]
+
+    def answer(self, query: str, *, k=None, source_files=None, pages=None) -> dict:
+        return self._call("/answer", self._request(query, k, source_files, pages))
+
+    def answer_stream(self, query: str, *, k=None, source_files=None, pages=None):
+        """NDJSON のイベント（sources / delta / done）を届いた順に yield する。
+
+        ストリーミング中にサービス側で起きたエラー（error イベント）は ValueError として送出する。
+        """
+        body = {**self._request(query, k, source_files, pages), "stream": True}
+        with self._open("/answer", body) as resp:
+            for line in resp:
+                if line.strip():
+                    event = json.loads(line.decode("utf-8"))
+                    if "error" in event:
+                        raise ValueError(event["error"])
+                    yield event
@@ -0,0 +1,226 @@
+import multiprocessing
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    from .vector_index import DEFAULT_TOP_K, normalize_query, resolve_top_k, select_top_k
+except ImportError:  # "streamlit run app.py" でスクリプトとして実行された場合
+    from vector_index import DEFAULT_TOP_K, normalize_query, resolve_top_k, select_top_k
+
+# -----------------------------------------------------------------------------
+# シャード分割した並列の厳密検索
+#   - 正規化済み行列を行方向に n_shards 個の区間へ分け、区間ごとに「行列×ベクトル + 上位 k 件」を
+#     ワーカーで並列に計算し、各シャードの上位 k 件をマージする（結果は VectorIndex.search と同じ）。
+#   - backend="thread": シャードは同じ行列のビュー。numpy の行列演算は GIL を解放するので
+#     スレッドでも複数コアを使える（行列のコピーなし）。
+#   - backend="process": 構築時に 1 度だけ行列を multiprocessing.shared_memory に置き、
+#     各ワーカープロセスは名前で接続して自分の区間を読む。インデックスが共有ファイルを
+#     メモリマップしている（VectorIndex.map_file）場合はコピーせず、ワーカーも同じファイルをマップする。
+#     クエリごとに受け渡すのはクエリベクトルとシャードごとの上位 k 件だけ。
+# -----------------------------------------------------------------------------
+
+DEFAULT_SHARDS = int(os.environ.get("SEARCH_SHARDS", "1"))
+DEFAULT_SHARD_BACKEND = os.environ.get("SEARCH_SHARD_BACKEND", "thread")
+
+# ワーカープロセス側で接続済みの共有メモリ / メモリマップ（名前 -> (SharedMemory or None, ndarray)）
+_ATTACHED: dict[str, tuple] = {}
+
+
+def shard_bounds(n: int, n_shards: int) -> np.ndarray:
+    """n 行を n_shards 個のほぼ等しい区間に分ける境界（長さ n_shards + 1）。"""
+    return np.linspace(0, n, max(1, n_shards) + 1).astype(np.int64)
+
+
+def score_shard(E: np.ndarray, live, start: int, stop: int, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """行 [start, stop) を採点し、生存行の上位 k 件を (全体の行番号, スコア) で返す。"""
+    if stop <= start:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    sims = E[start:stop] @ q
+    if live is not None:
+        sims[~live[start:stop]] = -np.inf
+    pos, scores = select_top_k(sims, k)
+    keep = np.isfinite(scores)
+    return pos[keep] + start, scores[keep]
+
+
+def merge_top_k(parts, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """シャードごとの (行, スコア) を連結し、全体の上位 k 件にする。"""
+    rows = np.concatenate([p[0] for p in parts])
+    scores = np.concatenate([p[1] for p in parts])
+    pos, top = select_top_k(scores, k)
+    return rows[pos], top
+
+
+def _attach(name: str, shape, dtype) -> np.ndarray:
+    entry = _ATTACHED.get(name)
+    if entry is None:
+        if name.endswith(".npy"):
+            entry = (None, np.load(name, mmap_mode="r", allow_pickle=False)[: shape[0]])
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            entry = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        _ATTACHED[name] = entry
+    return entry[1]
+
+
+def _score_shared_shard(matrix_name: str, live_name: str | None, shape, start: int, stop: int, q, k: int):
+    """ワーカープロセスで実行される: 共有メモリ（または .npy のメモリマップ）上の行列の 1 シャードを採点する。"""
+    E = _attach(matrix_name, shape, np.float32)
+    live = _attach(live_name, (shape[0],), np.bool_) if live_name else None
+    return score_shard(E, live, start, stop, q, k)
+
+
+def _release(executor, segments) -> None:
+    executor.shutdown(wait=False, cancel_futures=True)
+    for shm in segments:
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ShardedIndex:
+    """VectorIndex を行方向のシャードに分け、ワーカープールで並列に厳密検索する。
+
+    仕様:
+      - search の検証規則・戻り値は VectorIndex.search と同じ（rows 指定時は base にそのまま委ねる）
+      - backend="process" では構築時点の行列を共有メモリへ置く。構築後に追加された行は
+        呼び出し元のプロセスで採点してマージし、削除は生存マスクの共有メモリへ反映する
+      - 使い終わったら close()（参照が無くなったときにも自動で後始末する）
+    """
+
+    def __init__(self, index, n_shards: int = DEFAULT_SHARDS, *, backend: str = DEFAULT_SHARD_BACKEND):
+        if backend not in ("thread", "process"):
+            raise ValueError(f"unknown shard backend: {backend}")
+        self.base = index
+        self.n_shards = max(1, int(n_shards))
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._segments: list[shared_memory.SharedMemory] = []
+        if backend == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.n_shards, thread_name_prefix="shard")
+        else:
+            # Streamlit はマルチスレッドなので fork ではなく spawn でワーカーを起動する。
+            # 行列への接続は起動時に済ませる（共有ファイルが後で差し替えられても、マップ済みの領域は残る）
+            self._share(index)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.n_shards,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_attach,
+                initargs=(self._matrix_name, (self._shared_rows, index.dim), np.float32),
+            )
+        self._finalizer = weakref.finalize(self, _release, self._executor, self._segments)
+
+    @classmethod
+    def build(cls, index, n_shards: int = DEFAULT_SHARDS, *, backend: str = DEFAULT_SHARD_BACKEND) -> "ShardedIndex":
+        sharded = cls(index, n_shards, backend=backend)
+        if backend == "process" and len(index):
+            sharded.search(index.matrix[0], 1)  # ワーカーの起動と共有メモリへの接続を先に済ませる
+        return sharded
+
+    def _share(self, index) -> None:
+        E, live = index.snapshot()
+        self._shared_rows = E.shape[0]
+        if index.mapped_path is not None:
+            self._matrix_name = index.mapped_path
+        else:
+            matrix = shared_memory.SharedMemory(create=True, size=max(1, E.nbytes))
+            np.ndarray(E.shape, dtype=np.float32, buffer=matrix.buf)[:] = E
+            self._segments.append(matrix)
+            self._matrix_name = matrix.name
+        mask = shared_memory.SharedMemory(create=True, size=max(1, E.shape[0]))
+        self._live_shared = np.ndarray((E.shape[0],), dtype=np.bool_, buffer=mask.buf)
+        self._live_shared[:] = True if live is None else live
+        self._n_deleted_shared = 0 if live is None else int(E.shape[0] - live.sum())
+        self._segments.append(mask)
+        self._live_name = mask.name
+
+    @property
+    def dim(self) -> int:
+        return self.base.dim
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def _sync_live(self, live) -> None:
+        """共有範囲の削除状況が変わっていれば、生存マスクを共有メモリへ書き写す。"""
+        n = self._shared_rows
+        n_deleted = 0 if live is None else int(n - live[:n].sum())
+        if n_deleted == self._n_deleted_shared:
+            return
+        with self._lock:
+            self._live_shared[:] = live[:n]
+            self._n_deleted_shared = n_deleted
+
+    def search(self, query_embedding, k: int = DEFAULT_TOP_K, *, rows=None) -> tuple[np.ndarray, np.ndarray]:
+        if rows is not None:
+            return self.base.search(query_embedding, k, rows=rows)
+        q = normalize_query(query_embedding, self.dim)
+        E, live = self.base.snapshot()
+        n = E.shape[0] if live is None else int(live.sum())
+        if n == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        k = resolve_top_k(k, n)
+
+        if self.backend == "thread":
+            bounds = shard_bounds(E.shape[0], self.n_shards)
+            if self.n_shards == 1:
+                return merge_top_k([score_shard(E, live, 0, E.shape[0], q, k)], k)
+            futures = [self._executor.submit(score_shard, E, live, a, b, q, k) for a, b in zip(bounds[:-1], bounds[1:])]
+        else:
+            self._sync_live(live)
+            shape = (self._shared_rows, self.dim)
+            live_name = self._live_name if self._n_deleted_shared else None
+            bounds = shard_bounds(self._shared_rows, self.n_shards)
+            futures = [
+                self._executor.submit(_score_shared_shard, self._matrix_name, live_name, shape, int(a), int(b), q, k)
+                for a, b in zip(bounds[:-1], bounds[1:])
+            ]
+            # 共有後に追加された行はこのプロセスで採点する
+            tail = score_shard(E, live, self._shared_rows, E.shape[0], q, k)
+            return merge_top_k([tail, *(f.result() for f in futures)], k)
+        return merge_top_k([f.result() for f in futures], k)
+
+    def search_batch(self, query_embeddings, k: int = DEFAULT_TOP_K, **kwargs):
+        # バッチ検索はタイル化した GEMM で既にコアを使い切れるので base に委ねる
+        return self.base.search_batch(query_embeddings, k, **kwargs)
+
+    def get_texts(self, indices) -> list[str]:
+        return self.base.get_texts(indices)
+
+    def get_metadata(self, indices) -> list[dict]:
+        return self.base.get_metadata(indices)
+
+
+def scaling_report(index, queries, shard_counts=(1, 2, 4), *, k: int = DEFAULT_TOP_K, backend: str = DEFAULT_SHARD_BACKEND) -> list[dict]:
+    """シャード数ごとの 1 クエリあたりの平均レイテンシと、1 シャードに対する高速化率・並列化効率。
+
+    効率 = 高速化率 / シャード数（1.0 なら理想的にスケールしている）。
+    """
+    rows = []
+    base_ms = None
+    for n_shards in shard_counts:
+        sharded = ShardedIndex.build(index, n_shards, backend=backend)
+        try:
+            sharded.search(queries[0], k)  # ウォームアップ
+            t0 = time.perf_counter()
+            for q in queries:
+                sharded.search(q, k)
+            ms = (time.perf_counter() - t0) * 1000.0 / len(queries)
+        finally:
+            sharded.close()
+        base_ms = ms if base_ms is None else base_ms
+        speedup = base_ms / ms if ms else 0.0
+        rows.append({"shards": n_shards, "mean_ms": round(ms, 4), "speedup": round(speedup, 3),
+                     "efficiency": round(speedup / n_shards * shard_counts[0], 3)})
+    return rows
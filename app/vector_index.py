@@ -0,0 +1,441 @@
+import threading
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# 事前正規化済みベクトルインデックス
+#   - ロード時に 1 度だけ NaN/Inf 除去・L2 正規化・float32 化を済ませておき、
+#     クエリごとの処理は「行列×ベクトル + 上位 k 件の選択」だけにする。
+# -----------------------------------------------------------------------------
+
+DEFAULT_TOP_K = 3
+
+# バッチ検索で 1 タイルあたりに確保するスコア行列の要素数上限（float32 で約 64MB）
+SCORE_TILE_ELEMENTS = 1 << 24
+
+# 行メタデータのうち int32 の列として持つもの（チャンク番号と出所のページ範囲 / 行範囲）。値の無い行は MISSING
+INT_METADATA_COLUMNS = ("chunk_id", "page_start", "page_end", "row_start", "row_end")
+MISSING = -1
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+def resolve_top_k(top_k, n: int) -> int:
+    """top_k 指定を検証し、実際に返す件数（コーパス件数が上限）を決める。
+
+    仕様:
+      - None は DEFAULT_TOP_K 件
+      - 整数に変換できない値は ValueError
+      - 0 以下は ValueError
+    """
+    if top_k is None:
+        return min(DEFAULT_TOP_K, n)
+    try:
+        k = int(top_k)
+    except (TypeError, ValueError):
+        raise ValueError("top_k must be an integer")
+    if k <= 0:
+        raise ValueError("top_k must be >= 1")
+    return min(k, n)
+
+
+def resolve_rows(rows, n: int) -> np.ndarray:
+    """検索対象の行番号（メタデータ絞り込みの結果など）を検証し、int64 の配列にする。
+
+    仕様:
+      - 1 次元の整数配列でなければ ValueError
+      - 負、または n 以上の行番号を含めば ValueError
+    """
+    rows = np.asarray(rows)
+    if rows.ndim != 1 or (rows.size and not np.issubdtype(rows.dtype, np.integer)):
+        raise ValueError("rows must be a 1-D array of row indices")
+    rows = rows.astype(np.int64, copy=False)
+    if rows.size and (rows.min() < 0 or rows.max() >= n):
+        raise ValueError(f"rows must be in [0, {n})")
+    return rows
+
+
+def normalize_query(query_embedding, dim: int) -> np.ndarray:
+    """クエリを検証し、NaN/Inf 除去・L2 正規化済みの float32 ベクトルにする（入力は非破壊）。"""
+    q = np.array(query_embedding, dtype=np.float32, copy=True)
+    if q.ndim != 1 or q.shape[0] != dim:
+        raise ValueError("invalid shapes")
+    q = np.nan_to_num(q, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    qnorm = float(np.linalg.norm(q))
+    if qnorm == 0.0:
+        raise ValueError("query embedding has zero norm")
+    q /= qnorm
+    return q
+
+
+def normalize_rows(E: np.ndarray) -> np.ndarray:
+    """float32 の 2 次元配列をその場で NaN/Inf 除去・行ごとに L2 正規化して C 連続で返す。
+
+    ゼロベクトル行はゼロのまま（= どのクエリとも類似度 0）。
+    """
+    E = np.nan_to_num(E, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    norms = np.linalg.norm(E, axis=1, keepdims=True)
+    np.divide(E, norms, out=E, where=norms != 0.0)
+    return np.ascontiguousarray(E)
+
+
+def normalize_queries(query_embeddings, dim: int) -> np.ndarray:
+    """(Q, d) のクエリ行列を normalize_query と同じ規則で正規化する（入力は非破壊）。"""
+    Q = np.array(query_embeddings, dtype=np.float32, copy=True)
+    if Q.ndim != 2 or Q.shape[1] != dim:
+        raise ValueError("invalid shapes")
+    Q = np.nan_to_num(Q, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    norms = np.linalg.norm(Q, axis=1, keepdims=True)
+    if np.any(norms == 0.0):
+        raise ValueError("query embedding has zero norm")
+    Q /= norms
+    return Q
+
+
+def select_top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """最終軸について上位 k 件を (インデックス, スコア) の降順で返す。
+
+    argpartition で k 件まで絞り込み、並べ替えは生き残った k 件だけに対して行う
+    （全件 argsort の O(n log n) ではなく O(n + k log k)）。1次元/2次元どちらも可。
+    """
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape)
+    part_scores = np.take_along_axis(scores, part, axis=-1)
+    order = np.argsort(-part_scores, axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1), np.take_along_axis(part_scores, order, axis=-1)
+
+
+class MetadataColumns:
+    """行メタデータを、フィールドごとの numpy 配列として 1 度だけ保持する列ストア。
+
+    仕様:
+      - source_file はソース表（sources）への int32 の番号（無い行は -1）
+      - INT_METADATA_COLUMNS は int32 の列（無い行は MISSING）。それ以外のキーや範囲外の値は行ごとの dict に残す
+      - row(i) / rows(indices) は要求された行だけを dict に組み立てる
+      - extend は倍々で拡張するバッファに追記する（ならしコストは追加行数に比例）
+    """
+
+    def __init__(self, metadata=()):
+        self.sources: list[str] = []
+        self._source_code: dict[str, int] = {}
+        self._size = 0
+        self._source_ids = np.empty(0, dtype=np.int32)
+        self._ints = {name: np.empty(0, dtype=np.int32) for name in INT_METADATA_COLUMNS}
+        self._extras: dict[int, dict] = {}
+        self.extend(metadata)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, i: int) -> dict:
+        return self.row(i)
+
+    def __iter__(self):
+        return (self.row(i) for i in range(self._size))
+
+    @property
+    def source_ids(self) -> np.ndarray:
+        return self._source_ids[: self._size]
+
+    def source_code(self, source: str) -> int | None:
+        """ソースファイル名の番号（一度も現れていなければ None）。"""
+        return self._source_code.get(source)
+
+    def column(self, name: str) -> np.ndarray:
+        """INT_METADATA_COLUMNS の列（先頭 len 行のビュー）。"""
+        return self._ints[name][: self._size]
+
+    def _grow(self, capacity: int) -> None:
+        n = self._size
+        ids = np.full(capacity, -1, dtype=np.int32)
+        ids[:n] = self._source_ids[:n]
+        self._source_ids = ids
+        for name, values in self._ints.items():
+            grown = np.full(capacity, MISSING, dtype=np.int32)
+            grown[:n] = values[:n]
+            self._ints[name] = grown
+
+    def extend(self, metadata) -> None:
+        rows = list(metadata)
+        n, m = self._size, len(rows)
+        if n + m > self._source_ids.shape[0]:
+            self._grow(max(n + m, 2 * n, 16))
+        for i, meta in enumerate(rows, start=n):
+            extra = {}
+            for key, value in meta.items():
+                if key == "source_file" and isinstance(value, str):
+                    code = self._source_code.get(value)
+                    if code is None:
+                        code = self._source_code[value] = len(self.sources)
+                        self.sources.append(value)
+                    self._source_ids[i] = code
+                elif (
+                    key in self._ints and isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+                    and 0 <= value <= _INT32_MAX
+                ):
+                    self._ints[key][i] = value
+                else:
+                    extra[key] = value
+            if extra:
+                self._extras[i] = extra
+        # 配列への書き込みが済んでから行数を進める（読み手は _size 未満の行だけを見る）
+        self._size = n + m
+
+    def row(self, i: int) -> dict:
+        i = int(i)
+        if not 0 <= i < self._size:
+            raise IndexError("metadata row out of range")
+        meta = {}
+        code = self._source_ids[i]
+        if code >= 0:
+            meta["source_file"] = self.sources[code]
+        for name, values in self._ints.items():
+            if values[i] != MISSING:
+                meta[name] = int(values[i])
+        meta.update(self._extras.get(i, ()))
+        return meta
+
+    def rows(self, indices) -> list[dict]:
+        return [self.row(i) for i in indices]
+
+    def take(self, keep) -> "MetadataColumns":
+        """keep（行番号の配列）の行だけを、この順に並べた新しい列ストア（ソース表は引き継ぐ）。"""
+        keep = np.asarray(keep, dtype=np.int64)
+        out = MetadataColumns()
+        out.sources = list(self.sources)
+        out._source_code = dict(self._source_code)
+        out._source_ids = self._source_ids[keep]
+        out._ints = {name: values[keep] for name, values in self._ints.items()}
+        out._extras = {j: self._extras[int(i)] for j, i in enumerate(keep) if int(i) in self._extras}
+        out._size = len(keep)
+        return out
+
+
+class VectorIndex:
+    """L2 正規化済み float32 行列とテキスト/メタデータを保持する検索インデックス。
+
+    構築時に入力をコピーして以下を済ませる（入力は非破壊）:
+      - NaN/Inf は 0 に置換
+      - 各行を L2 正規化（ゼロベクトル行はゼロのまま = 類似度 0）
+      - C 連続な float32 行列として読み取り専用で保持
+    行メタデータは MetadataColumns（列ごとの配列）として持ち、get_metadata で返す行だけを dict にする。
+    """
+
+    def __init__(self, embeddings, texts, metadata=None):
+        E = np.array(embeddings, dtype=np.float32, copy=True)
+        if E.ndim != 2:
+            raise ValueError("invalid shapes")
+        self._init(normalize_rows(E), texts, metadata)
+
+    @classmethod
+    def from_normalized(cls, matrix, texts, metadata=None) -> "VectorIndex":
+        """正規化済み float32 行列（セグメントの memmap など）をコピーせずに包む。
+
+        C 連続な float32 であればそのまま参照する（それ以外の場合のみ変換コピー）。
+        """
+        index = cls.__new__(cls)
+        E = np.ascontiguousarray(matrix, dtype=np.float32)
+        if E.ndim != 2:
+            raise ValueError("invalid shapes")
+        index._init(E, texts, metadata)
+        return index
+
+    def _init(self, E: np.ndarray, texts, metadata) -> None:
+        T = list(texts)
+        if E.shape[0] != len(T):
+            raise ValueError("invalid shapes")
+        if isinstance(metadata, MetadataColumns):
+            M = metadata
+        else:
+            M = MetadataColumns(metadata if metadata is not None else [{} for _ in T])
+        if len(M) != len(T):
+            raise ValueError("metadata length must match texts")
+
+        # _buffer は容量付きの行バッファ（先頭 _size 行が有効）。memmap など書き込み不可の
+        # 配列はそのまま参照し、append で初めて書き込み可能なバッファへ移す。
+        self._buffer = E
+        self._live = np.ones(E.shape[0], dtype=bool)
+        self._size = E.shape[0]
+        self._n_deleted = 0
+        self._lock = threading.Lock()
+        self.texts = T
+        self.metadata = M
+        # 行列が map_file で差し替えたファイルのメモリマップなら、そのパス（append で外れる）
+        self.mapped_path: str | None = None
+
+    def __len__(self) -> int:
+        """削除済みを除いた行数。"""
+        return self._size - self._n_deleted
+
+    @property
+    def dim(self) -> int:
+        return self._buffer.shape[1]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """正規化済み行列（読み取り専用ビュー。行番号は削除済み行も含めて安定）。"""
+        return self.snapshot()[0]
+
+    def snapshot(self) -> tuple[np.ndarray, np.ndarray | None]:
+        """検索用に (行列ビュー, 生存マスク or None) を一貫した状態で取り出す。
+
+        append はバッファ差し替え → _size 更新の順で書くため、_size を先に読めば
+        読み出した行数は必ずバッファ内に収まる。
+        """
+        n = self._size
+        E = self._buffer[:n]
+        if E.flags.writeable:
+            E = E.view()
+            E.setflags(write=False)
+        live = self._live[:n] if self._n_deleted else None
+        return E, live
+
+    def append(self, matrix, texts, metadata=None) -> np.ndarray:
+        """正規化済み行列の行を末尾に追加し、割り当てた行番号を返す（既存行は再構築しない）。
+
+        バッファは倍々で拡張するので、追加のならしコストは追加行数に比例する。
+        """
+        E = np.ascontiguousarray(matrix, dtype=np.float32)
+        T = list(texts)
+        M = list(metadata) if metadata is not None else [{} for _ in T]
+        if E.ndim != 2 or E.shape[0] != len(T) or len(M) != len(T) or (len(T) and E.shape[1] != self.dim):
+            raise ValueError("invalid shapes")
+
+        with self._lock:
+            n, m = self._size, E.shape[0]
+            if n + m > self._buffer.shape[0] or not self._buffer.flags.writeable:
+                capacity = max(n + m, 2 * n, 16)
+                buffer = np.empty((capacity, self.dim), dtype=np.float32)
+                buffer[:n] = self._buffer[:n]
+                live = np.zeros(capacity, dtype=bool)
+                live[:n] = self._live[:n]
+                self._buffer, self._live = buffer, live
+                self.mapped_path = None
+            self._buffer[n : n + m] = E
+            self._live[n : n + m] = True
+            self.texts.extend(T)
+            self.metadata.extend(M)
+            self._size = n + m
+        return np.arange(n, n + m)
+
+    def map_file(self, path: str) -> None:
+        """行列を、同じ内容を書き出した .npy ファイルの読み取り専用メモリマップに差し替える。
+
+        複数のプロセスが同じファイルをマップすればページキャッシュを共有できる
+        （プロセスごとにヒープへ行列を持たない）。内容の一致は呼び出し元が保証し、ここでは形状だけ確認する。
+        """
+        matrix = np.load(path, mmap_mode="r", allow_pickle=False)
+        with self._lock:
+            if matrix.dtype != np.float32 or matrix.shape != (self._size, self.dim):
+                raise ValueError("mapped matrix does not match the index")
+            self._buffer = matrix
+            self.mapped_path = path
+
+    def remove(self, rows) -> None:
+        """行を削除済み（tombstone）にする。行番号は変わらず、以降の検索結果に出なくなる。"""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        with self._lock:
+            rows = rows[self._live[rows]]
+            self._live[rows] = False
+            self._n_deleted += len(rows)
+
+    @property
+    def deleted_ratio(self) -> float:
+        return self._n_deleted / self._size if self._size else 0.0
+
+    def compacted(self) -> tuple["VectorIndex", np.ndarray]:
+        """削除済み行を詰めた新しいインデックスと、旧行番号 -> 新行番号（削除は -1）の対応を返す。
+
+        自身は変更しないので、検索中の呼び出し元は古いインデックスをそのまま使い続けられる。
+        """
+        with self._lock:
+            n = self._size
+            keep = np.flatnonzero(self._live[:n])
+            mapping = np.full(n, -1, dtype=np.int64)
+            mapping[keep] = np.arange(len(keep))
+            index = VectorIndex.from_normalized(
+                self._buffer[keep],
+                [self.texts[i] for i in keep],
+                self.metadata.take(keep),
+            )
+        return index, mapping
+
+    def search(self, query_embedding, k: int = DEFAULT_TOP_K, *, rows=None) -> tuple[np.ndarray, np.ndarray]:
+        """クエリに近い順に (行インデックス, コサイン類似度) を最大 k 件返す。
+
+        仕様:
+          - クエリ次元が不一致なら ValueError
+          - クエリがゼロベクトル（NaN/Inf 除去後を含む）なら ValueError
+          - k は resolve_top_k と同じ規則で検証し、（削除済みを除く）コーパス件数を上限とする
+          - rows（行番号の配列。メタデータ絞り込みの結果など）を渡すと、その行だけを採点する
+            （範囲外の行番号は resolve_rows と同じ規則で ValueError）
+        """
+        q = normalize_query(query_embedding, self.dim)
+        E, live = self.snapshot()
+        if rows is not None:
+            rows = np.sort(resolve_rows(rows, E.shape[0]))  # 行順に読む（memmap でも順方向アクセスになる）
+            if live is not None:
+                rows = rows[live[rows]]
+            if rows.size == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            pos, scores = select_top_k(np.asarray(E[rows]) @ q, resolve_top_k(k, rows.size))
+            return rows[pos], scores
+
+        n = E.shape[0] if live is None else int(live.sum())
+        if n == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        k = resolve_top_k(k, n)
+
+        sims = E @ q
+        if live is not None:
+            sims[~live] = -np.inf
+        return select_top_k(sims, k)
+
+    def search_batch(
+        self, query_embeddings, k: int = DEFAULT_TOP_K, *, block_rows: int | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """(Q, d) のクエリ行列をまとめて検索し、(Q, k) のインデックスと類似度を返す。
+
+        仕様:
+          - スコア計算はコーパスをブロックに分けた GEMM（Q × block_rows のタイルのみ確保）
+          - 各ブロックで argpartition により k 件に絞り、それまでの上位 k 件とマージ
+          - クエリの検証規則は search と同じ（いずれかの行がゼロベクトルなら ValueError）
+          - block_rows 未指定時は SCORE_TILE_ELEMENTS からタイルサイズを決める
+        """
+        Q = normalize_queries(query_embeddings, self.dim)
+        E, live = self.snapshot()
+        n = E.shape[0] if live is None else int(live.sum())
+        nq = Q.shape[0]
+        if n == 0 or nq == 0:
+            return np.empty((nq, 0), dtype=np.int64), np.empty((nq, 0), dtype=np.float32)
+        k = resolve_top_k(k, n)
+
+        if block_rows is None:
+            block_rows = max(k, SCORE_TILE_ELEMENTS // max(nq, 1))
+        block_rows = max(int(block_rows), 1)
+
+        best_idx = np.empty((nq, 0), dtype=np.int64)
+        best_scores = np.empty((nq, 0), dtype=np.float32)
+        for start in range(0, E.shape[0], block_rows):
+            block = E[start : start + block_rows]
+            tile = Q @ block.T
+            if live is not None:
+                tile[:, ~live[start : start + block_rows]] = -np.inf
+            idx, scores = select_top_k(tile, k)
+            # 既存の上位 k 件と、このブロックの上位 k 件をマージ
+            cand_idx = np.concatenate([best_idx, idx + start], axis=1)
+            cand_scores = np.concatenate([best_scores, scores], axis=1)
+            pos, best_scores = select_top_k(cand_scores, k)
+            best_idx = np.take_along_axis(cand_idx, pos, axis=1)
+        return best_idx, best_scores
+
+    def get_texts(self, indices) -> list[str]:
+        """行インデックス列に対応するテキストを返す。"""
+        return [self.texts[i] for i in indices]
+
+    def get_metadata(self, indices) -> list[dict]:
+        """行インデックス列に対応するメタデータ（source_file など。出典の表示用）を返す。"""
+        return self.metadata.rows(indices)
@@ -0,0 +1,458 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+try:
+    from .segment import (
+        CURRENT_NAME, JSONL_SUFFIX, META_SUFFIX, TOMBSTONE_SUFFIX, VECTORS_SUFFIX, load_segment, parse_segment_manifest,
+    )
+    from .vector_index import VectorIndex, normalize_rows
+except ImportError:  # "streamlit run app.py" でスクリプトとして実行された場合
+    from segment import (
+        CURRENT_NAME, JSONL_SUFFIX, META_SUFFIX, TOMBSTONE_SUFFIX, VECTORS_SUFFIX, load_segment, parse_segment_manifest,
+    )
+    from vector_index import VectorIndex, normalize_rows
+
+# -----------------------------------------------------------------------------
+# GCS ベクトルストアの読み込み
+#   - ドキュメントごとにセグメント（<name>.seg.npy / <name>.seg.meta）があればそれを
+#     ローカルへ落としてメモリマップし、無ければ従来の <name>.jsonl を解析する。
+#   - コンパクション済みのドキュメントは _segments/CURRENT が指す manifest の行範囲から読む。
+#     同じ名前のドキュメント単位のオブジェクト（または tombstone）があればそちらを優先する。
+#     ただし manifest の superseded にある版（取り込み済みで、猶予の後に消されるもの）は読まない。
+# -----------------------------------------------------------------------------
+
+DEFAULT_SEGMENT_CACHE_DIR = os.environ.get("SEGMENT_CACHE_DIR", "/tmp/rag-segments")
+DEFAULT_LOAD_WORKERS = int(os.environ.get("VECTOR_LOAD_WORKERS", "8"))
+# 設定すると、refresh のたびに全行列をこのディレクトリの .npy に書き出してメモリマップで開き直す。
+# 同じインスタンス上の複数プロセス（Streamlit / HTTP サービスのワーカー）が同じページを共有する
+DEFAULT_SHARED_DIR = os.environ.get("VECTOR_SHARED_DIR") or None
+SHARED_PREFIX = "index-"
+# JSONL の各行から埋め込み・本文以外に残す、チャンクの出所を表す列（PDF のページ範囲 / CSV の行範囲）
+LOCATION_COLUMNS = ("page_start", "page_end", "row_start", "row_end")
+
+# 読み込みに失敗しても refresh 全体は止めず、そのドキュメントだけ前の版のまま次回に再試行する例外。
+# 一覧を取ってからダウンロードするまでに上書き・削除（コンパクションによる削除を含む）されると NotFound になる
+try:
+    from google.api_core.exceptions import NotFound as _NotFound
+
+    LOAD_ERRORS: tuple = (ValueError, OSError, _NotFound)
+except ImportError:
+    LOAD_ERRORS = (ValueError, OSError)
+
+
+class CompactedSlice(NamedTuple):
+    """コンパクション済みセグメント内の、1 ドキュメント分の行範囲。"""
+    segment: str
+    start: int
+    stop: int
+
+
+class LoadedDocument(NamedTuple):
+    """1 ドキュメント分の読み込み結果と、その計測値。"""
+    matrix: np.ndarray
+    texts: list[str]
+    metadata: list[dict]
+    files: list[str]
+    nbytes: int
+    seconds: float
+
+
+def parse_jsonl_stream(lines) -> tuple[np.ndarray, list[str], list[dict], int]:
+    """JSONL の行を逐次解析し、(正規化済み float32 行列, テキスト, 行メタデータ, 読んだバイト数) を返す。
+
+    埋め込みは Python のリストに溜めず、倍々で拡張する float32 バッファへ 1 行ずつ直接書き込む。
+    行は str / bytes どちらでもよい。
+    """
+    buf = None
+    n = nbytes = 0
+    texts: list[str] = []
+    metadata: list[dict] = []
+    for line in lines:
+        nbytes += len(line)
+        if not line.strip():
+            continue
+        r = json.loads(line)
+        emb = r["embedding"]
+        if buf is None:
+            buf = np.empty((64, len(emb)), dtype=np.float32)
+        elif n == buf.shape[0]:
+            grown = np.empty((2 * n, buf.shape[1]), dtype=np.float32)
+            grown[:n] = buf
+            buf = grown
+        buf[n] = emb
+        texts.append(r["text_content"])
+        meta = {"source_file": r.get("source_file", ""), "chunk_id": r.get("chunk_id", n)}
+        for name in LOCATION_COLUMNS:
+            if name in r:
+                meta[name] = r[name]
+        metadata.append(meta)
+        n += 1
+
+    if buf is None:
+        return np.empty((0, 0), dtype=np.float32), texts, metadata, nbytes
+    # 余った容量を手放してから正規化（以降インデックスが保持し続けるため）
+    matrix = buf[:n].copy() if n < buf.shape[0] else buf
+    return normalize_rows(matrix), texts, metadata, nbytes
+
+
+def parse_jsonl_document(content: str) -> tuple[np.ndarray, list[str], list[dict]]:
+    """1 ドキュメント分の JSONL を (正規化済み float32 行列, テキスト, 行メタデータ) にする。"""
+    matrix, texts, metadata, _ = parse_jsonl_stream(content.splitlines())
+    return matrix, texts, metadata
+
+
+def group_document_blobs(blobs) -> dict[str, dict]:
+    """Blob をドキュメント単位にまとめる: base_name -> {"jsonl"/"vectors"/"meta"/"tombstone": Blob}。
+
+    "_" で始まる名前（_segments/ や _ann/ などの内部オブジェクト）は対象外。
+    """
+    documents: dict[str, dict] = {}
+    for blob in blobs:
+        if blob.name.startswith("_"):
+            continue
+        for kind, suffix in (
+            ("jsonl", JSONL_SUFFIX), ("vectors", VECTORS_SUFFIX), ("meta", META_SUFFIX), ("tombstone", TOMBSTONE_SUFFIX),
+        ):
+            if blob.name.endswith(suffix):
+                documents.setdefault(blob.name[: -len(suffix)], {})[kind] = blob
+                break
+    return documents
+
+
+def is_deleted(parts: dict) -> bool:
+    """tombstone があり、それがデータのどのオブジェクトより新しい（版が比較できない場合も含む）なら削除済み。"""
+    tombstone = parts.get("tombstone")
+    if tombstone is None:
+        return False
+    data = [getattr(b, "generation", None) for kind, b in parts.items() if kind != "tombstone"]
+    if getattr(tombstone, "generation", None) is None or any(g is None for g in data):
+        return True
+    return all(tombstone.generation >= g for g in data)
+
+
+def blob_version(blob):
+    """オブジェクトの版を表す値（generation → etag → (size, updated) の順で利用可能なもの）。"""
+    generation = getattr(blob, "generation", None)
+    if generation is not None:
+        return generation
+    etag = getattr(blob, "etag", None)
+    if etag is not None:
+        return etag
+    return (getattr(blob, "size", None), str(getattr(blob, "updated", None)))
+
+
+def document_signature(parts: dict) -> tuple:
+    """ドキュメントを構成する全オブジェクトの (名前, 版) の組。どれかが変われば再読み込み対象。
+
+    コンパクション済みのドキュメントはセグメント名と行範囲（セグメントは書き換えられない）。
+    """
+    if "compacted" in parts:
+        return ("compacted", *parts["compacted"])
+    return tuple(sorted((blob.name, blob_version(blob)) for blob in parts.values()))
+
+
+def _cache_path(cache_dir: str, blob) -> str:
+    # 版ごとに別ファイルにする（更新時に、旧版をメモリマップしたまま上書きしないため）
+    return os.path.join(cache_dir, f"{blob.name.replace('/', '__')}.{blob_version(blob)}")
+
+
+def load_document(parts: dict, cache_dir: str, segments: "CompactedSegments | None" = None) -> LoadedDocument | None:
+    """1 ドキュメントを読み込む。セグメントが揃っていればメモリマップ、無ければ JSONL をストリーム解析。
+
+    コンパクション済みのドキュメントは segments から該当する行範囲を切り出す（ファイルは segments が管理する）。
+    対象となるオブジェクトが無ければ None。
+    """
+    start = time.perf_counter()
+    if "compacted" in parts:
+        segment, a, b = parts["compacted"]
+        matrix, texts, metadata = segments.load(segment)
+        matrix = matrix[a:b]
+        return LoadedDocument(matrix, texts[a:b], metadata[a:b], [], matrix.nbytes, time.perf_counter() - start)
+    if "vectors" in parts and "meta" in parts:
+        os.makedirs(cache_dir, exist_ok=True)
+        paths = []
+        for kind in ("vectors", "meta"):
+            path = _cache_path(cache_dir, parts[kind])
+            # 同じパスを（このプロセスや別のワーカーが）メモリマップしていることがあるので、
+            # 一時ファイルに落としてから置き換える（上書きで切り詰めると、マップ中のプロセスが SIGBUS で落ちる）
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                parts[kind].download_to_filename(tmp)
+            except Exception:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp)
+                raise
+            os.replace(tmp, path)
+            paths.append(path)
+        matrix, texts, metadata = load_segment(*paths)
+        nbytes = sum(os.path.getsize(p) for p in paths)
+        return LoadedDocument(matrix, texts, metadata, paths, nbytes, time.perf_counter() - start)
+    if "jsonl" in parts:
+        with parts["jsonl"].open("rb") as f:
+            matrix, texts, metadata, nbytes = parse_jsonl_stream(f)
+        return LoadedDocument(matrix, texts, metadata, [], nbytes, time.perf_counter() - start)
+    return None
+
+
+def _load_or_error(base: str, parts: dict, cache_dir: str, segments=None):
+    try:
+        return base, load_document(parts, cache_dir, segments), None
+    except LOAD_ERRORS as e:
+        return base, None, e
+
+
+class CompactedSegments:
+    """_segments/CURRENT が指す manifest と、ダウンロード済みのコンパクション済みセグメント。
+
+    セグメントは書き換えられないので、名前ごとに 1 度だけダウンロードしてメモリマップし、
+    manifest から外れたものはキャッシュから消す。
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.manifest: dict | None = None
+        self._current_version = None
+        self._bucket = None
+        self._loaded: dict[str, tuple] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, bucket, current_blob) -> dict[str, CompactedSlice]:
+        """CURRENT（一覧に無ければ None）を読み、ドキュメント名 -> 行範囲を返す。"""
+        self._bucket = bucket
+        if current_blob is None:
+            self.manifest, self._current_version = None, None
+        elif self.manifest is None or blob_version(current_blob) != self._current_version:
+            try:
+                name = current_blob.download_as_bytes().decode("utf-8").strip()
+                self.manifest = parse_segment_manifest(bucket.blob(name).download_as_bytes())
+                self._current_version = blob_version(current_blob)
+            except Exception as e:  # 切り替え直後に旧 manifest が消えたなど。前回の manifest のまま次回に再試行する
+                print(f"[WARN] コンパクションの manifest を読み込めませんでした: {e}")
+        slices = {}
+        for entry in (self.manifest or {}).get("segments", []):
+            for doc in entry["documents"]:
+                slices[doc["document"]] = CompactedSlice(entry["name"], doc["start"], doc["stop"])
+        self._evict({s.segment for s in slices.values()})
+        return slices
+
+    @property
+    def superseded(self) -> set[tuple]:
+        """manifest が削除待ちとして記録しているオブジェクトの (名前, generation)。"""
+        return {(o["name"], o.get("generation")) for o in (self.manifest or {}).get("superseded", [])}
+
+    def load(self, segment: str) -> tuple[np.ndarray, list[str], list[dict]]:
+        """セグメントを (メモリマップ行列, テキスト, 行メタデータ) として返す（初回だけダウンロード）。"""
+        with self._lock:
+            lock = self._locks.setdefault(segment, threading.Lock())
+        with lock:
+            if segment not in self._loaded:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                paths = []
+                for suffix in (VECTORS_SUFFIX, META_SUFFIX):
+                    path = os.path.join(self.cache_dir, f"{segment}{suffix}".replace("/", "__"))
+                    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    try:
+                        self._bucket.blob(f"{segment}{suffix}").download_to_filename(tmp)
+                    except Exception as e:  # 新しい manifest への切り替え後に消された（NotFound）など
+                        with contextlib.suppress(OSError):
+                            os.remove(tmp)
+                        raise ValueError(f"compacted segment {segment} is not available: {e}") from e
+                    os.replace(tmp, path)
+                    paths.append(path)
+                matrix, texts, metadata = load_segment(*paths)
+                # 併合で埋めた欠損（None）と、manifest と重複する document 列は行メタデータに残さない
+                metadata = [{k: v for k, v in m.items() if v is not None and k != "document"} for m in metadata]
+                self._loaded[segment] = (matrix, texts, metadata, paths)
+            return self._loaded[segment][:3]
+
+    def _evict(self, keep: set[str]) -> None:
+        with self._lock:
+            for segment in [s for s in self._loaded if s not in keep]:
+                for path in self._loaded.pop(segment)[3]:
+                    with contextlib.suppress(OSError):
+                        os.remove(path)
+                self._locks.pop(segment, None)
+
+
+class VectorStore:
+    """GCS ベクトルストアをメモリ上の VectorIndex として保持し、差分だけを取り込み直す。
+
+    manifest にドキュメントごとの「オブジェクト名 -> generation」を記録しておき、refresh では
+      - 新規/版が変わったドキュメントだけをダウンロードして index.append
+      - 消えた（または差し替えられた）ドキュメントの行は index.remove で tombstone 化
+    を行う。tombstone が compact_ratio を超えたら、詰めた新しいインデックスに差し替える。
+    """
+
+    def __init__(
+        self,
+        storage_client,
+        bucket_name: str,
+        *,
+        cache_dir: str = DEFAULT_SEGMENT_CACHE_DIR,
+        compact_ratio: float = 0.25,
+        max_workers: int = DEFAULT_LOAD_WORKERS,
+        shared_dir: str | None = DEFAULT_SHARED_DIR,
+    ):
+        self.storage_client = storage_client
+        self.bucket_name = bucket_name
+        self.cache_dir = cache_dir
+        self.compact_ratio = compact_ratio
+        self.max_workers = max_workers
+        self.shared_dir = shared_dir
+        self.index: VectorIndex | None = None
+        self.manifest: dict[str, tuple] = {}
+        self.last_refresh: float | None = None
+        # 内容が変わる refresh のたびに増える版番号（回答キャッシュなどの無効化に使う）
+        self.version = 0
+        # 直近の refresh で読み込んだドキュメントごとの計測値（document / rows / bytes / seconds）
+        self.last_load_report: list[dict] = []
+        self._rows: dict[str, np.ndarray] = {}
+        self._files: dict[str, list[str]] = {}
+        self._segments = CompactedSegments(cache_dir)
+        self._lock = threading.Lock()
+
+    def refresh(self) -> dict[str, int]:
+        """バケットの一覧と manifest を突き合わせ、差分だけをインデックスへ反映する。"""
+        with self._lock:
+            bucket = self.storage_client.bucket(self.bucket_name)
+            blobs = list(bucket.list_blobs())
+            compacted = self._segments.refresh(bucket, next((b for b in blobs if b.name == CURRENT_NAME), None))
+            superseded = self._segments.superseded
+            documents = group_document_blobs(b for b in blobs if (b.name, getattr(b, "generation", None)) not in superseded)
+            for base, parts in documents.items():
+                if is_deleted(parts):
+                    documents[base] = {"tombstone": parts["tombstone"]}
+            for base, rows in compacted.items():
+                documents.setdefault(base, {"compacted": rows})
+            current = {base: document_signature(parts) for base, parts in documents.items()}
+
+            removed = [b for b in self.manifest if b not in current]
+            changed = sorted(b for b in current if self.manifest.get(b) != current[b])
+            stats = {
+                "added": sum(1 for b in changed if b not in self.manifest),
+                "updated": sum(1 for b in changed if b in self.manifest),
+                "removed": len(removed),
+                "unchanged": len(current) - len(changed),
+            }
+
+            for base in removed:
+                self._drop(base)
+
+            # ダウンロードと解析は上限付きスレッドプールで並列に行い、インデックスへの反映は
+            # 名前順に 1 件ずつ（反映したドキュメントの一時配列はすぐに解放される）。
+            # 旧版の行は新しい版を読み込めてから差し替える（失敗したら旧版のまま検索対象に残す）
+            self.last_load_report = []
+            applied = 0
+            with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as pool:
+                results = pool.map(lambda b: _load_or_error(b, documents[b], self.cache_dir, self._segments), changed)
+                for base, loaded, error in results:
+                    if error is not None:
+                        # 書き込み途中・一覧後に消えたなど。manifest は旧版のままにして次回 refresh で再試行する
+                        print(f"[WARN] {base} の読み込みをスキップしました（前の版を使い続けます）: {error}")
+                        continue
+                    self._drop(base, keep=loaded.files if loaded is not None else ())
+                    self.manifest[base] = current[base]
+                    applied += 1
+                    if loaded is None or not loaded.texts:
+                        continue
+                    self._add(base, loaded)
+
+            if self.index is not None and self.index.deleted_ratio > self.compact_ratio:
+                self._compact()
+            if self.shared_dir and self.index is not None and self.index.mapped_path is None:
+                self._share()
+            if removed or applied:
+                self.version += 1
+            self.last_refresh = time.monotonic()
+            return stats
+
+    def maybe_refresh(self, interval_sec: float) -> dict[str, int] | None:
+        """前回の refresh から interval_sec 以上経っていれば refresh する（0 以下は無効）。"""
+        if interval_sec <= 0 or self.last_refresh is None:
+            return None
+        if time.monotonic() - self.last_refresh < interval_sec:
+            return None
+        return self.refresh()
+
+    def layout_fingerprint(self) -> str:
+        """現在のインデックスの行の並び（どのドキュメントのどの版が何行目か）を表すハッシュ。
+
+        IVF など行番号に依存する派生インデックスを保存・再利用する際の照合に使う。
+        """
+        h = hashlib.sha1()
+        for base in sorted(self._rows):
+            h.update(repr((base, self.manifest.get(base))).encode("utf-8"))
+            h.update(np.ascontiguousarray(self._rows[base], dtype=np.int64).tobytes())
+        return h.hexdigest()
+
+    def _add(self, base: str, loaded: LoadedDocument) -> None:
+        if self.index is None:
+            self.index = VectorIndex.from_normalized(loaded.matrix, loaded.texts, loaded.metadata)
+            rows = np.arange(len(loaded.texts))
+        else:
+            rows = self.index.append(loaded.matrix, loaded.texts, loaded.metadata)
+        self._rows[base] = rows
+        self._files[base] = loaded.files
+        report = {"document": base, "rows": len(rows), "bytes": loaded.nbytes, "seconds": round(loaded.seconds, 4)}
+        self.last_load_report.append(report)
+        print(f"[LOAD] {base}: {report['rows']} rows, {report['bytes']} bytes, {report['seconds']:.3f}s")
+
+    def _drop(self, base: str, keep=()) -> None:
+        """base の行を tombstone 化し、キャッシュファイルを消す（keep は新しい版でも使うファイル）。"""
+        self.manifest.pop(base, None)
+        rows = self._rows.pop(base, None)
+        if rows is not None and self.index is not None:
+            self.index.remove(rows)
+        for path in self._files.pop(base, []):
+            if path in keep:
+                continue
+            # メモリマップ中でも unlink は安全（マップが外れた時点で領域が解放される）
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+    def _compact(self) -> None:
+        index, mapping = self.index.compacted()
+        self._rows = {base: mapping[rows] for base, rows in self._rows.items()}
+        self.index = index
+
+    def _share(self) -> None:
+        """行列を shared_dir/index-<行の並びのハッシュ>.npy に書き出し（既にあれば再利用）、メモリマップに差し替える。
+
+        行の並びのハッシュが同じなら内容も同じなので、別プロセスが書いたファイルをそのまま開く。
+        他の版のファイルは削除する（マップ中のプロセスがあっても、マップが外れるまで領域は残る）。
+        """
+        E, _ = self.index.snapshot()
+        path = os.path.join(self.shared_dir, f"{SHARED_PREFIX}{self.layout_fingerprint()}.npy")
+        try:
+            os.makedirs(self.shared_dir, exist_ok=True)
+            if not os.path.exists(path):
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    np.save(f, E, allow_pickle=False)
+                os.replace(tmp, path)
+            self.index.map_file(path)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] 共有メモリマップへの切り替えをスキップしました: {e}")
+            return
+        for name in os.listdir(self.shared_dir):
+            if name.startswith(SHARED_PREFIX) and name.endswith(".npy") and os.path.join(self.shared_dir, name) != path:
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self.shared_dir, name))
+
+
+def load_vector_store(storage_client, bucket_name: str, *, cache_dir: str = DEFAULT_SEGMENT_CACHE_DIR):
+    """バケット内の全ドキュメントを読み込み VectorIndex を返す（データが無ければ None）。"""
+    store = VectorStore(storage_client, bucket_name, cache_dir=cache_dir)
+    store.refresh()
+    if store.index is None or len(store.index) == 0:
+        return None
+    return store.index
@@ -0,0 +1,101 @@
+"""ベンチマーク用の合成データとフェイク依存（ネットワーク・GCP 資格情報なしで動かすため）。"""
+
+import hashlib
+
+import fitz
+import numpy as np
+
+from document_processor.local_storage import LocalStorageClient  # noqa: F401 (ベンチマークから使う)
+
+EMBEDDING_DIM = 768
+
+# 合成テキストに使う語彙（日本語の文書に近い文字種の混在にする）
+_WORDS = [
+    "申請", "手続き", "期限", "対象者", "補助金", "提出", "書類", "窓口", "確認", "変更",
+    "令和", "年度", "市区町村", "支給", "条件", "住民票", "所得", "証明書", "オンライン", "郵送",
+    "2024", "第3条", "別表", "様式", "注意事項",
+]
+
+
+def synthetic_vectors(n: int, dim: int = EMBEDDING_DIM, *, n_clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """クラスタ構造を持つ L2 正規化済み float32 行列（実際の埋め込みに近い分布で ANN も評価できるように）。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    out = np.empty((n, dim), dtype=np.float32)
+    step = 65536
+    for start in range(0, n, step):
+        m = min(step, n - start)
+        out[start : start + m] = centers[rng.integers(0, n_clusters, m)] + 0.5 * rng.standard_normal((m, dim), dtype=np.float32)
+    out /= np.linalg.norm(out, axis=1, keepdims=True)
+    return out
+
+
+def synthetic_text(n_chars: int, *, seed: int = 0) -> str:
+    """語彙をランダムに並べた約 n_chars 文字の文章（句点と改行で段落を作る）。"""
+    rng = np.random.default_rng(seed)
+    parts: list[str] = []
+    total = 0
+    while total < n_chars:
+        sentence = "".join(_WORDS[i] for i in rng.integers(0, len(_WORDS), 12)) + "。"
+        if rng.random() < 0.2:
+            sentence += "\n\n"
+        parts.append(sentence)
+        total += len(sentence)
+    return "".join(parts)[:n_chars]
+
+
+def write_pdf(path: str, n_pages: int, *, chars_per_page: int = 1500, seed: int = 0) -> None:
+    """n_pages ページのテキスト PDF を PyMuPDF で生成する（reportlab が無い環境でも動くように）。"""
+    doc = fitz.open()
+    for i in range(n_pages):
+        page = doc.new_page()
+        text = synthetic_text(chars_per_page, seed=seed + i)
+        page.insert_textbox(fitz.Rect(36, 36, 559, 806), text, fontsize=7, fontname="japan")
+    doc.save(path)
+    doc.close()
+
+
+def write_csv(path: str, n_rows: int, *, seed: int = 0) -> None:
+    """id / 区分 / 金額 / 説明 の 4 列を持つ n_rows 行の CSV を書く。"""
+    rng = np.random.default_rng(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("id,category,amount,description\n")
+        for i in range(n_rows):
+            desc = "".join(_WORDS[j] for j in rng.integers(0, len(_WORDS), 6))
+            f.write(f"{i},{_WORDS[i % len(_WORDS)]},{int(rng.integers(0, 100000))},{desc}\n")
+
+
+class FakeEmbeddingModel:
+    """本文のハッシュから決まる擬似ベクトルを返す埋め込みモデル（同じ本文なら同じベクトル）。"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.calls = 0
+
+    def get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        out = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+            out.append(np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32).tolist())
+        return out
+
+
+class FakeGenerativeModel:
+    """質問とコンテキストの長さだけを返す生成モデル（stream=True なら数文字ずつ返す）。"""
+
+    def __init__(self, *, chunk_chars: int = 8):
+        self.chunk_chars = chunk_chars
+        self.calls = 0
+
+    def generate_content(self, contents, stream: bool = False):
+        self.calls += 1
+        text = f"回答（プロンプト {len(contents[0])} 文字）"
+        if not stream:
+            return _Response(text)
+        return [_Response(text[i : i + self.chunk_chars]) for i in range(0, len(text), self.chunk_chars)]
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
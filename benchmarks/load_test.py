@@ -0,0 +1,129 @@
+"""検索・回答 HTTP サービス（app/service.py）の負荷試験。
+
+GCS はローカルディレクトリ（LocalStorageClient）、Vertex AI はフェイクモデルで置き換え、
+ASGI アプリへ httpx でプロセス内から同時リクエストを送る（ネットワーク・資格情報は不要）。
+結果は benchmarks.run と同じ形の JSON で、--compare で比較できる。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.load_test --docs 20 --rows 5000 --requests 500 --concurrency 16
+    python -m benchmarks.load_test --shards 4 --endpoints search --out load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+
+from app.service import RagService, create_app
+from app.vector_store import VectorStore
+from benchmarks.fakes import EMBEDDING_DIM, FakeEmbeddingModel, FakeGenerativeModel, LocalStorageClient, synthetic_text, synthetic_vectors
+from benchmarks.run import environment, percentiles
+
+
+def build_corpus(storage: LocalStorageClient, bucket: str, n_docs: int, rows_per_doc: int, *, dim: int = EMBEDDING_DIM) -> None:
+    """n_docs 個のセグメント（各 rows_per_doc 行）をローカルバケットへ書く。"""
+    import document_processor.segment as writer
+
+    for d in range(n_docs):
+        E = synthetic_vectors(rows_per_doc, dim, seed=100 + d)
+        texts = [synthetic_text(200, seed=d * rows_per_doc + i) for i in range(rows_per_doc)]
+        vectors, meta = writer.encode_segment(
+            f"doc{d}.pdf", texts, E,
+            columns={"chunk_id": list(range(rows_per_doc)), "page_start": [i // 4 + 1 for i in range(rows_per_doc)],
+                     "page_end": [i // 4 + 1 for i in range(rows_per_doc)]},
+        )
+        storage.bucket(bucket).blob(f"doc{d}.pdf.seg.npy").upload_from_string(vectors)
+        storage.bucket(bucket).blob(f"doc{d}.pdf.seg.meta").upload_from_string(meta)
+
+
+async def _fire(app, requests: list[tuple[str, dict]], concurrency: int) -> tuple[list[float], int, float]:
+    """最大 concurrency 並列で requests を送り、(各レイテンシ秒, エラー数, 全体の秒数) を返す。"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    samples: list[float] = []
+    errors = 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://service", timeout=None) as client:
+        async def one(path: str, body: dict):
+            nonlocal errors
+            async with semaphore:
+                t0 = time.perf_counter()
+                resp = await client.post(path, json=body)
+                samples.append(time.perf_counter() - t0)
+                if resp.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(path, body) for path, body in requests))
+        return samples, errors, time.perf_counter() - start
+
+
+def run_load_test(
+    *,
+    n_docs: int = 20,
+    rows_per_doc: int = 5000,
+    n_requests: int = 500,
+    concurrency: int = 16,
+    endpoints=("search", "answer"),
+    shards: int = 1,
+    distinct_queries: int = 100,
+    workdir: str | None = None,
+) -> list[dict]:
+    with tempfile.TemporaryDirectory(prefix="rag-load-") as tmp:
+        root = workdir or tmp
+        storage = LocalStorageClient(os.path.join(root, "gcs"))
+        build_corpus(storage, "vectors", n_docs, rows_per_doc)
+        store = VectorStore(storage, "vectors", cache_dir=os.path.join(root, "segments"))
+        store.refresh()
+
+        results = []
+        for endpoint in endpoints:
+            # 回答キャッシュ・クエリキャッシュの効き方を揃えるため、エンドポイントごとに作り直す
+            service = RagService(store, FakeEmbeddingModel(), FakeGenerativeModel(), shards=shards)
+            app = create_app(service)
+            queries = [synthetic_text(30, seed=10_000 + i % max(1, distinct_queries)) for i in range(n_requests)]
+            requests = [(f"/{endpoint}", {"query": q}) for q in queries]
+            try:
+                asyncio.run(_fire(app, requests[: min(4, len(requests))], 1))  # ウォームアップ（索引の構築など）
+                samples, errors, seconds = asyncio.run(_fire(app, requests, concurrency))
+            finally:
+                service.close()
+            results.append(
+                {
+                    "name": f"service.{endpoint}",
+                    "params": {"rows": n_docs * rows_per_doc, "concurrency": concurrency, "shards": shards},
+                    "requests_per_sec": round(len(samples) / seconds, 2),
+                    "errors": errors,
+                    **percentiles(samples),
+                }
+            )
+        return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="RAG HTTP サービスの負荷試験（ローカルストレージ + フェイクモデル）")
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=5000, help="1 ドキュメントあたりの行数")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--endpoints", nargs="+", default=["search", "answer"], choices=["search", "answer"])
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--out", help="結果 JSON の出力先（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    results = run_load_test(n_docs=args.docs, rows_per_doc=args.rows, n_requests=args.requests,
+                            concurrency=args.concurrency, endpoints=args.endpoints, shards=args.shards)
+    payload = json.dumps({"environment": environment(), "results": results}, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
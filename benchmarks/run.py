@@ -0,0 +1,425 @@
+"""検索・読み込み・取り込みのホットパスを合成データで計測するベンチマーク。
+
+ネットワークや GCP の資格情報は使わない（ストレージはローカルディレクトリ、埋め込みはフェイク）。
+結果は JSON で書き出し、別のコミットで取った結果と --compare で比較できる。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.run --out bench.json                       # 既定: 10k / 100k ベクトル
+    python -m benchmarks.run --sizes 10000 100000 1000000 --out bench.json
+    python -m benchmarks.run --shards 1 2 4 8 --shard-backend process --skip load chunking e2e
+    python -m benchmarks.run --skip search load chunking e2e       # 取り込み処理のコールドスタートだけ
+    python -m benchmarks.run --compare before.json after.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.segment import load_segment
+from app.vector_index import VectorIndex
+from app.vector_store import parse_jsonl_stream
+from benchmarks.fakes import EMBEDDING_DIM, FakeEmbeddingModel, LocalStorageClient, synthetic_text, synthetic_vectors, write_csv, write_pdf
+
+DEFAULT_SIZES = (10_000, 100_000)
+# 比較時に「悪化」とみなす変化率（ノイズを拾わないよう 10%）
+REGRESSION_THRESHOLD = 0.10
+# 比較する指標の接尾辞。"*_per_sec"（スループット）は大きいほど良く、それ以外は小さいほど良い。
+# チャンク数などの件数は性能指標ではないので比較しない
+COMPARED_SUFFIXES = ("_ms", "_sec", "_mb")
+
+
+def percentiles(samples_sec: list[float]) -> dict:
+    """秒単位のサンプルから p50 / p95 / p99 / 平均をミリ秒で返す。"""
+    a = np.asarray(samples_sec) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(a, 50)), 4),
+        "p95_ms": round(float(np.percentile(a, 95)), 4),
+        "p99_ms": round(float(np.percentile(a, 99)), 4),
+        "mean_ms": round(float(a.mean()), 4),
+    }
+
+
+def measure(fn):
+    """fn() の (戻り値, 経過秒, Python ヒープのピーク MB) を返す。
+
+    tracemalloc は割り当てごとに記録して処理を遅くするので、時間は追跡なしの 1 回目で測り、
+    ピークメモリは追跡ありの 2 回目で測る。
+    """
+    t0 = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - t0
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, round(peak / 2**20, 2)
+
+
+# --- 各ベンチマーク ------------------------------------------------------------
+
+
+def bench_search(n: int, *, dim: int = EMBEDDING_DIM, n_queries: int = 200, k: int = 5, modes=("exact",)) -> list[dict]:
+    """n 行の索引に対する 1 クエリあたりの検索レイテンシ（モードごと）。"""
+    E = synthetic_vectors(n, dim, seed=1)
+    Q = synthetic_vectors(n_queries, dim, seed=2)
+    index = VectorIndex.from_normalized(E, [""] * n)
+    searchers = {"exact": index}
+    if "ivf" in modes:
+        from app.ann import IVFIndex
+
+        searchers["ivf"] = IVFIndex.train(index, nlist=max(1, min(1024, int(np.sqrt(n)))))
+    for mode in ("sq", "pq"):
+        if mode in modes:
+            from app.quantization import QuantizedIndex
+
+            searchers[mode] = QuantizedIndex.build(index, mode)
+
+    results = []
+    for mode, searcher in searchers.items():
+        searcher.search(Q[0], k)  # ウォームアップ
+        samples = []
+        for q in Q:
+            t0 = time.perf_counter()
+            searcher.search(q, k)
+            samples.append(time.perf_counter() - t0)
+        results.append({"name": f"search.{mode}", "params": {"n": n, "dim": dim, "k": k}, **percentiles(samples)})
+
+    t0 = time.perf_counter()
+    index.search_batch(Q, k)
+    batch_sec = time.perf_counter() - t0
+    results.append(
+        {
+            "name": "search.batch",
+            "params": {"n": n, "dim": dim, "k": k, "queries": n_queries},
+            "per_query_ms": round(batch_sec * 1000.0 / n_queries, 4),
+        }
+    )
+    return results
+
+
+def bench_sharded_search(
+    n: int, *, dim: int = EMBEDDING_DIM, n_queries: int = 200, k: int = 5, shard_counts=(1, 2, 4), backend: str = "thread"
+) -> list[dict]:
+    """シャード数ごとの検索レイテンシと、1 シャードに対する高速化率・並列化効率。"""
+    from app.sharded import scaling_report
+
+    E = synthetic_vectors(n, dim, seed=1)
+    Q = synthetic_vectors(n_queries, dim, seed=2)
+    index = VectorIndex.from_normalized(E, [""] * n)
+    return [
+        {"name": "search.sharded", "params": {"n": n, "dim": dim, "k": k, "shards": row.pop("shards"), "backend": backend}, **row}
+        for row in scaling_report(index, Q, shard_counts, k=k, backend=backend)
+    ]
+
+
+def bench_load(n: int, workdir: str, *, dim: int = EMBEDDING_DIM) -> list[dict]:
+    """n 行のドキュメントを JSONL から解析する時間と、セグメントを開く時間。"""
+    import document_processor.segment as writer
+
+    E = synthetic_vectors(n, dim, seed=3)
+    texts = [f"chunk {i}" for i in range(n)]
+    jsonl_path = os.path.join(workdir, f"load_{n}.jsonl")
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            f.write(json.dumps({"source_file": "doc", "chunk_id": i, "text_content": texts[i], "embedding": E[i].tolist()}) + "\n")
+    vectors, meta = writer.encode_segment("doc", texts, E, columns={"chunk_id": list(range(n))})
+    vec_path, meta_path = os.path.join(workdir, f"load_{n}.seg.npy"), os.path.join(workdir, f"load_{n}.seg.meta")
+    with open(vec_path, "wb") as f:
+        f.write(vectors)
+    with open(meta_path, "wb") as f:
+        f.write(meta)
+    jsonl_mb = os.path.getsize(jsonl_path) / 2**20
+
+    def parse_jsonl():
+        with open(jsonl_path, "rb") as f:
+            return parse_jsonl_stream(f)
+
+    _, jsonl_sec, jsonl_peak = measure(parse_jsonl)
+    _, seg_sec, seg_peak = measure(lambda: load_segment(vec_path, meta_path))
+    return [
+        {
+            "name": "load.jsonl",
+            "params": {"n": n, "dim": dim},
+            "load_sec": round(jsonl_sec, 4),
+            "mb_per_sec": round(jsonl_mb / jsonl_sec, 2),
+            "peak_alloc_mb": jsonl_peak,
+        },
+        {"name": "load.segment", "params": {"n": n, "dim": dim}, "load_sec": round(seg_sec, 4), "peak_alloc_mb": seg_peak},
+    ]
+
+
+def bench_chunking(workdir: str, *, n_chars: int = 2_000_000, n_pages: int = 200, n_rows: int = 50_000) -> list[dict]:
+    """テキスト分割・PDF ページ抽出 + 分割・CSV 行チャンク化のスループット。"""
+    from document_processor.chunking import iter_chunks, iter_csv_chunks, iter_pdf_pages
+    from document_processor.main import build_text_splitter
+
+    splitter = build_text_splitter()
+    text = synthetic_text(n_chars)
+    chunks, sec, peak = measure(lambda: splitter.split_text(text))
+    results = [
+        {
+            "name": "chunking.split_text",
+            "params": {"chars": n_chars},
+            "chars_per_sec": round(n_chars / sec),
+            "chunks": len(chunks),
+            "peak_alloc_mb": peak,
+        }
+    ]
+
+    pdf_path = os.path.join(workdir, f"bench_{n_pages}.pdf")
+    write_pdf(pdf_path, n_pages)
+    chunks, sec, peak = measure(lambda: list(iter_chunks(iter_pdf_pages(pdf_path), splitter)))
+    results.append(
+        {
+            "name": "chunking.pdf",
+            "params": {"pages": n_pages},
+            "pages_per_sec": round(n_pages / sec, 2),
+            "chunks": len(chunks),
+            "peak_alloc_mb": peak,
+        }
+    )
+
+    csv_path = os.path.join(workdir, f"bench_{n_rows}.csv")
+    write_csv(csv_path, n_rows)
+    chunks, sec, peak = measure(lambda: list(iter_csv_chunks(csv_path)))
+    results.append(
+        {
+            "name": "chunking.csv",
+            "params": {"rows": n_rows},
+            "rows_per_sec": round(n_rows / sec),
+            "chunks": len(chunks),
+            "peak_alloc_mb": peak,
+        }
+    )
+    return results
+
+
+def bench_process_document(workdir: str, *, n_pages: int = 100, n_rows: int = 20_000) -> list[dict]:
+    """ローカルストレージ + フェイク埋め込みで process_document を端から端まで実行する。"""
+    import document_processor.main as processor
+
+    storage = LocalStorageClient(os.path.join(workdir, "gcs"))
+    src = storage.bucket("src")
+    pdf_path = os.path.join(workdir, "e2e.pdf")
+    csv_path = os.path.join(workdir, "e2e.csv")
+    write_pdf(pdf_path, n_pages)
+    write_csv(csv_path, n_rows)
+
+    results = []
+    for name, path, unit, count in (("e2e.pdf", pdf_path, "pages", n_pages), ("e2e.csv", csv_path, "rows", n_rows)):
+        with open(path, "rb") as f:
+            src.blob(name).upload_from_string(f.read())
+        model = FakeEmbeddingModel()
+        _, sec, peak = measure(
+            lambda: processor.process_document(
+                {"bucket": "src", "name": name},
+                None,
+                storage_client=storage,
+                embedding_model=model,
+                output_bucket="out",
+                reuse_embeddings=False,
+            )
+        )
+        with open(os.path.join(storage.root, "out", f"{name}.jsonl"), encoding="utf-8") as f:
+            n_chunks = sum(1 for _ in f)
+        results.append(
+            {
+                "name": f"process_document.{name.split('.')[-1]}",
+                "params": {unit: count},
+                "total_sec": round(sec, 4),
+                "chunks_per_sec": round(n_chunks / sec, 2),
+                "chunks": n_chunks,
+                "embedding_calls": model.calls,
+                "peak_alloc_mb": peak,
+            }
+        )
+    return results
+
+
+# 新しいプロセスで document_processor.main を読み込み、1 ファイル目・2 ファイル目を処理する。
+# 呼び出し元で読み込み済みのモジュールの影響を受けないよう、サブプロセスで実行する
+_COLD_START_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import document_processor.main as processor
+import_ms = (time.perf_counter() - t0) * 1000.0
+loaded = [m for m in sys.argv[3:] if m in sys.modules]
+from document_processor.local_storage import LocalStorageClient
+
+class Embedder:
+    def get_embeddings(self, texts):
+        return [[1.0, float(len(t))] for t in texts]
+
+storage = LocalStorageClient(sys.argv[1])
+model = Embedder()
+samples = []
+for _ in range(2):
+    t0 = time.perf_counter()
+    processor.process_document({"bucket": "src", "name": sys.argv[2]}, None, storage_client=storage,
+                               embedding_model=model, output_bucket="out", reuse_embeddings=False)
+    samples.append((time.perf_counter() - t0) * 1000.0)
+print(json.dumps({"import_ms": import_ms, "requests_ms": samples, "loaded_at_import": loaded,
+                  "startup": processor.STARTUP.report()}))
+"""
+# 読み込み時には import されていないはずの重い依存（形式ごとのライブラリと GCP クライアント）
+HEAVY_MODULES = ("fitz", "pandas", "langchain_text_splitters", "google.cloud.storage", "google.cloud.aiplatform", "vertexai")
+
+
+def bench_cold_start(workdir: str, *, n_pages: int = 5, n_rows: int = 200) -> list[dict]:
+    """取り込み処理のコールドスタート（モジュールの読み込みと初回リクエスト）をファイル形式ごとに計測する。"""
+    storage = LocalStorageClient(os.path.join(workdir, "cold"))
+    pdf_path = os.path.join(workdir, "cold.pdf")
+    csv_path = os.path.join(workdir, "cold.csv")
+    write_pdf(pdf_path, n_pages)
+    write_csv(csv_path, n_rows)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for name, path in (("cold.pdf", pdf_path), ("cold.csv", csv_path)):
+        with open(path, "rb") as f:
+            storage.bucket("src").blob(name).upload_from_string(f.read())
+        proc = subprocess.run(
+            [sys.executable, "-c", _COLD_START_SCRIPT, storage.root, name, *HEAVY_MODULES],
+            capture_output=True, text=True, check=True, cwd=root, env={**os.environ, "TELEMETRY_LOG": "0"},
+        )
+        out = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(
+            {
+                "name": f"cold_start.{name.split('.')[-1]}",
+                "params": {},
+                "import_ms": round(out["import_ms"], 3),
+                "first_request_ms": round(out["requests_ms"][0], 3),
+                "warm_request_ms": round(out["requests_ms"][1], 3),
+                "loaded_at_import": out["loaded_at_import"],
+                "lazy_import": out["startup"]["lazy_import_ms"],
+            }
+        )
+    return results
+
+
+# --- 実行と比較 ---------------------------------------------------------------
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run_suite(
+    sizes=DEFAULT_SIZES,
+    *,
+    load_sizes=(10_000,),
+    search_modes=("exact",),
+    shard_counts=(),
+    shard_backend: str = "thread",
+    n_queries: int = 200,
+    chunk_chars: int = 2_000_000,
+    pdf_pages: int = 200,
+    csv_rows: int = 50_000,
+    skip=(),
+) -> dict:
+    results: list[dict] = []
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as workdir:
+        if "search" not in skip:
+            for n in sizes:
+                print(f"[BENCH] search n={n}")
+                results += bench_search(n, n_queries=n_queries, modes=search_modes)
+                if shard_counts:
+                    results += bench_sharded_search(n, n_queries=n_queries, shard_counts=shard_counts, backend=shard_backend)
+        if "load" not in skip:
+            for n in load_sizes:
+                print(f"[BENCH] load n={n}")
+                results += bench_load(n, workdir)
+        if "chunking" not in skip:
+            print("[BENCH] chunking")
+            results += bench_chunking(workdir, n_chars=chunk_chars, n_pages=pdf_pages, n_rows=csv_rows)
+        if "e2e" not in skip:
+            print("[BENCH] process_document")
+            results += bench_process_document(workdir, n_pages=max(1, pdf_pages // 2), n_rows=max(1, csv_rows // 2))
+        if "startup" not in skip:
+            print("[BENCH] cold start")
+            results += bench_cold_start(workdir)
+    return {"environment": environment(), "results": results}
+
+
+def _key(result: dict) -> str:
+    return result["name"] + json.dumps(result.get("params", {}), sort_keys=True)
+
+
+def compare(before: dict, after: dict, *, threshold: float = REGRESSION_THRESHOLD) -> list[dict]:
+    """同じ名前・パラメータの結果どうしで数値指標の変化率を求め、threshold を超えて悪化したものに印を付ける。"""
+    old = {_key(r): r for r in before["results"]}
+    rows = []
+    for r in after["results"]:
+        prev = old.get(_key(r))
+        if prev is None:
+            continue
+        for metric, value in r.items():
+            if not metric.endswith(COMPARED_SUFFIXES) or not isinstance(value, (int, float)) or not prev.get(metric):
+                continue
+            change = (value - prev[metric]) / prev[metric]
+            worse = change < -threshold if metric.endswith("_per_sec") else change > threshold
+            rows.append({"name": r["name"], "params": r.get("params", {}), "metric": metric,
+                         "before": prev[metric], "after": value, "change": round(change, 4), "regression": worse})
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="RAG のホットパスを合成データで計測する")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="検索ベンチの行数")
+    parser.add_argument("--load-sizes", type=int, nargs="+", default=[10_000], help="読み込みベンチの行数")
+    parser.add_argument("--search-modes", nargs="+", default=["exact"], choices=["exact", "ivf", "sq", "pq"])
+    parser.add_argument("--shards", type=int, nargs="*", default=[1, 2, 4], help="並列検索のシャード数（空なら計測しない）")
+    parser.add_argument("--shard-backend", default="thread", choices=["thread", "process"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--skip", nargs="*", default=[], choices=["search", "load", "chunking", "e2e", "startup"])
+    parser.add_argument("--out", help="結果 JSON の出力先（省略時は標準出力）")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="2 つの結果 JSON を比較する")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            before = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            after = json.load(f)
+        rows = compare(before, after)
+        for row in rows:
+            mark = "REGRESSION" if row["regression"] else ""
+            print(f"{row['name']:<28} {json.dumps(row['params'], sort_keys=True):<32} {row['metric']:<16} "
+                  f"{row['before']:>12} -> {row['after']:>12} ({row['change']:+.1%}) {mark}")
+        return 1 if any(r["regression"] for r in rows) else 0
+
+    report = run_suite(args.sizes, load_sizes=args.load_sizes, search_modes=args.search_modes,
+                       shard_counts=args.shards, shard_backend=args.shard_backend, n_queries=args.queries, skip=args.skip)
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(payload)
+        print(f"結果を書き出しました: {args.out}")
+    else:
+        print(payload)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
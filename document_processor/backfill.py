@@ -0,0 +1,320 @@
+"""ソースバケット（またはローカルディレクトリ）全体の一括取り込み・再インデックス。
+
+process_document はアップロード 1 件ごとのイベントで動くので、チャンクサイズや埋め込みモデルを
+変えた後に全ファイルを取り込み直すには、イベントを再送するしかなかった。このコマンドは次のように動く:
+
+  - ソースを列挙し、抽出・チャンク化（CPU を使う段）をプロセスプールで並列に行う
+  - 埋め込みは 1 つのモデルを共有し、複数ドキュメントを並行して送る（同時呼び出し数は全体で上限付き）
+  - 完了したファイルをチェックポイント（JSONL）に追記するので、中断しても続きから再開できる
+    （設定が変わった・ソースが更新されたファイルはやり直す）
+  - 完了時にファイル/秒・チャンク/秒を報告する
+
+出力は process_document と同じ <name>.jsonl と <name>.seg.*。
+
+使い方:
+    python -m document_processor.backfill --bucket <SOURCE_BUCKET> --output-bucket <OUTPUT_BUCKET> --checkpoint backfill.jsonl
+    python -m document_processor.backfill --local-root ./gcs --bucket src --output-bucket out --fake-embeddings
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+
+try:
+    from .chunking import DEFAULT_CSV_CHUNK_CHARS, iter_chunks, iter_csv_chunks, iter_pdf_pages
+    from .embedding import DEFAULT_MAX_BATCH_CHARS, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_IN_FLIGHT, EmbeddingScheduler, SharedEmbeddingModel
+    from .embedding_cache import ChunkEmbeddingCache, load_previous_embeddings
+    from .local_storage import LocalStorageClient
+    from .main import (
+        CSV_STREAMING, EMBEDDING_MODEL_NAME, PROJECT_ID, REGION, REUSE_EMBEDDINGS,
+        build_text_splitter, get_embedding_model, get_storage_client, process_csv, write_outputs,
+    )
+    from .source_io import open_source
+    from .telemetry import Telemetry
+except ImportError:  # functions-framework がトップレベルモジュールとして読み込んだ場合
+    from chunking import DEFAULT_CSV_CHUNK_CHARS, iter_chunks, iter_csv_chunks, iter_pdf_pages
+    from embedding import DEFAULT_MAX_BATCH_CHARS, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_IN_FLIGHT, EmbeddingScheduler, SharedEmbeddingModel
+    from embedding_cache import ChunkEmbeddingCache, load_previous_embeddings
+    from local_storage import LocalStorageClient
+    from main import (
+        CSV_STREAMING, EMBEDDING_MODEL_NAME, PROJECT_ID, REGION, REUSE_EMBEDDINGS,
+        build_text_splitter, get_embedding_model, get_storage_client, process_csv, write_outputs,
+    )
+    from source_io import open_source
+    from telemetry import Telemetry
+
+# 抽出・チャンク化のプロセス数（0 なら呼び出し元のプロセスで順に行う）
+DEFAULT_WORKERS = int(os.environ.get("BACKFILL_WORKERS", str(os.cpu_count() or 1)))
+# 埋め込み・保存を並行して進めるドキュメント数（API の同時呼び出し数は EMBEDDING_MAX_IN_FLIGHT で別に抑える）
+DEFAULT_EMBED_DOCUMENTS = int(os.environ.get("BACKFILL_EMBED_DOCUMENTS", "4"))
+SUPPORTED_SUFFIXES = (".pdf", ".csv")
+
+
+class HashingEmbeddingModel:
+    """本文のハッシュから決まる擬似ベクトルを返す埋め込みモデル（ネットワーク・資格情報なしで試すため）。
+
+    model_name は本物のモデル名と重ならない名前にする（出力ヘッダとチェックポイントの設定に記録されるので、
+    後で本物のモデルで取り込むときに擬似ベクトルを完了済み・再利用可能と誤認しないため）。
+    """
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+        self.model_name = f"fake-hash-{dim}"
+
+    def get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        out = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+            out.append(np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32).tolist())
+        return out
+
+
+class Checkpoint:
+    """完了したファイルを JSONL に 1 行ずつ追記して記録する（path が None なら記録しない）。
+
+    各行は {"name", "generation", "chunks", "config"}。config（チャンク化・埋め込みの設定のハッシュ）が
+    今回と異なる行や、ソースの generation が変わったファイルは未完了として扱う。
+    途中で書き込みが切れた最終行は読み飛ばす。
+    """
+
+    def __init__(self, path: str | None, config: str):
+        self.path = path
+        self.config = config
+        self.done: dict[str, dict] = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("config") == config:
+                        self.done[record["name"]] = record
+
+    def is_done(self, name: str, generation) -> bool:
+        record = self.done.get(name)
+        return record is not None and record.get("generation") == generation
+
+    def record(self, name: str, generation, chunks: int) -> None:
+        record = {"name": name, "generation": generation, "chunks": chunks, "config": self.config}
+        self.done[name] = record
+        if not self.path:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def config_key(**settings) -> str:
+    """出力を左右する設定から決まるキー（変われば全ファイルをやり直す）。"""
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_document(
+    source, file_name: str, splitter, *, csv_streaming: bool = True, csv_chunk_chars: int = DEFAULT_CSV_CHUNK_CHARS
+) -> tuple[list[str], list[dict]]:
+    """1 ドキュメントを (チャンク, チャンクごとの出所) にする（process_document と同じ分け方）。"""
+    if file_name.lower().endswith(".pdf"):
+        items = list(iter_chunks(iter_pdf_pages(source), splitter))
+        return [c for c, _, _ in items], [{"page_start": a, "page_end": b} for _, a, b in items]
+    if csv_streaming:
+        items = list(iter_csv_chunks(source, max_chars=csv_chunk_chars))
+        return [c for c, _, _ in items], [{"row_start": a, "row_end": b} for _, a, b in items]
+    text = process_csv(source)
+    return (splitter.split_text(text) if text else []), []
+
+
+def _storage_client(local_root: str | None, project_id: str | None):
+    return LocalStorageClient(local_root) if local_root else get_storage_client(project_id)
+
+
+# 抽出プロセスごとの状態（_init_worker で設定する）
+_worker: dict = {}
+
+
+def _init_worker(local_root, project_id, bucket_name, chunk_size, chunk_overlap, csv_streaming) -> None:
+    _worker["bucket"] = _storage_client(local_root, project_id).bucket(bucket_name)
+    _worker["splitter"] = build_text_splitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    _worker["csv_streaming"] = csv_streaming
+    # CSV の行単位チャンクもスプリッタと同じ chunk_size を目安にする
+    _worker["csv_chunk_chars"] = chunk_size
+
+
+def _extract(name: str) -> tuple[str, list[str], list[dict]]:
+    with open_source(_worker["bucket"].blob(name), name) as source:
+        chunks, meta = chunk_document(
+            source, name, _worker["splitter"], csv_streaming=_worker["csv_streaming"], csv_chunk_chars=_worker["csv_chunk_chars"]
+        )
+    return name, chunks, meta
+
+
+def run_backfill(
+    bucket_name: str,
+    output_bucket: str,
+    embedding_model,
+    *,
+    local_root: str | None = None,
+    project_id: str | None = None,
+    prefix: str = "",
+    checkpoint_path: str | None = None,
+    workers: int = DEFAULT_WORKERS,
+    embed_documents: int = DEFAULT_EMBED_DOCUMENTS,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 100,
+    csv_streaming: bool = CSV_STREAMING,
+    embedding_model_name: str = EMBEDDING_MODEL_NAME,
+    reuse_embeddings: bool = REUSE_EMBEDDINGS,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    max_batch_chars: int = DEFAULT_MAX_BATCH_CHARS,
+    limit: int | None = None,
+    telemetry=None,
+) -> dict:
+    """bucket_name の PDF / CSV をすべて取り込み、出力と処理量の報告（dict）を返す。
+
+    local_root を渡すと GCS の代わりに <local_root>/<bucket>/ のファイルを使う（抽出プロセスでも同じ）。
+    抽出待ち・埋め込み待ちのドキュメント数に上限を設けるので、メモリはファイル数に比例しない。
+    """
+    telemetry = telemetry or Telemetry(emit=None)
+    storage_client = _storage_client(local_root, project_id)
+    output_bucket_ref = storage_client.bucket(output_bucket)
+    checkpoint = Checkpoint(
+        checkpoint_path,
+        config_key(chunk_size=chunk_size, chunk_overlap=chunk_overlap, csv_streaming=csv_streaming,
+                   embedding_model=embedding_model_name, output_bucket=output_bucket),
+    )
+    model = SharedEmbeddingModel(embedding_model, max_in_flight=max_in_flight)
+
+    generations = {
+        blob.name: getattr(blob, "generation", None)
+        for blob in storage_client.bucket(bucket_name).list_blobs(prefix=prefix)
+        if blob.name.lower().endswith(SUPPORTED_SUFFIXES)
+    }
+    names = sorted(generations)
+    todo = [n for n in names if not checkpoint.is_done(n, generations[n])]
+    skipped = len(names) - len(todo)
+    if limit is not None:
+        todo = todo[: max(0, int(limit))]
+    print(f"[INFO] {len(names)} 件中 {len(todo)} 件を処理します（完了済み {skipped} 件）。")
+
+    def embed_and_write(name: str, chunks: list[str], meta: list[dict]) -> tuple[str, int]:
+        if chunks:
+            if reuse_embeddings:
+                cache = load_previous_embeddings(output_bucket_ref, name, embedding_model_name)
+            else:
+                cache = ChunkEmbeddingCache(embedding_model_name)
+            scheduler = EmbeddingScheduler(
+                model, max_in_flight=max_in_flight, max_batch_size=batch_size, max_batch_chars=max_batch_chars, telemetry=telemetry
+            )
+            chunks, embeddings = cache.embed_stream(scheduler, iter(chunks))
+            write_outputs(output_bucket_ref, name, chunks, embeddings, meta, telemetry=telemetry,
+                          embedding_model_name=embedding_model_name)
+        return name, len(chunks)
+
+    report = {"files": 0, "chunks": 0, "skipped": skipped, "failed": []}
+    initargs = (local_root, project_id, bucket_name, chunk_size, chunk_overlap, csv_streaming)
+    if workers > 0:
+        extract_pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker, initargs=initargs
+        )
+    else:
+        extract_pool = ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs)
+
+    start = time.perf_counter()
+    pending_names = iter(todo)
+    extracting: dict = {}
+    embedding: dict = {}
+    with extract_pool, ThreadPoolExecutor(max_workers=max(1, embed_documents)) as embed_pool:
+        while True:
+            # 抽出済みで埋め込み待ちのドキュメントが溜まりすぎないよう、両方の件数を見て投入する
+            while len(extracting) < max(1, workers) and len(embedding) < 2 * max(1, embed_documents):
+                name = next(pending_names, None)
+                if name is None:
+                    break
+                extracting[extract_pool.submit(_extract, name)] = name
+            if not extracting and not embedding:
+                break
+
+            done, _ = wait([*extracting, *embedding], return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in extracting:
+                    name = extracting.pop(future)
+                    try:
+                        _, chunks, meta = future.result()
+                    except Exception as e:
+                        print(f"[WARN] {name} の抽出に失敗しました: {e}")
+                        report["failed"].append(name)
+                        continue
+                    embedding[embed_pool.submit(embed_and_write, name, chunks, meta)] = name
+                    continue
+                name = embedding.pop(future)
+                try:
+                    _, n_chunks = future.result()
+                except Exception as e:
+                    print(f"[WARN] {name} の埋め込み・保存に失敗しました: {e}")
+                    report["failed"].append(name)
+                    continue
+                checkpoint.record(name, generations[name], n_chunks)
+                report["files"] += 1
+                report["chunks"] += n_chunks
+                elapsed = time.perf_counter() - start
+                print(f"[INFO] {report['files']}/{len(todo)} 件完了: {name}（{n_chunks} チャンク, "
+                      f"{report['files'] / elapsed:.2f} files/s, {report['chunks'] / elapsed:.1f} chunks/s）")
+
+    seconds = time.perf_counter() - start
+    report.update(
+        seconds=round(seconds, 3),
+        files_per_sec=round(report["files"] / seconds, 3) if seconds > 0 else 0.0,
+        chunks_per_sec=round(report["chunks"] / seconds, 2) if seconds > 0 else 0.0,
+        embedding_calls=model.calls,
+        embedded_chunks=model.texts,
+    )
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ソースバケット全体を一括で取り込み直す（中断しても再開できる）")
+    parser.add_argument("--bucket", required=True, help="ソースバケット名")
+    parser.add_argument("--output-bucket", required=True, help="出力バケット名")
+    parser.add_argument("--local-root", help="GCS の代わりに <local-root>/<bucket>/ のファイルを使う")
+    parser.add_argument("--prefix", default="", help="この接頭辞で始まるオブジェクトだけを対象にする")
+    parser.add_argument("--checkpoint", help="完了したファイルを記録する JSONL（同じファイルを渡すと続きから再開する）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="抽出・チャンク化のプロセス数")
+    parser.add_argument("--embed-documents", type=int, default=DEFAULT_EMBED_DOCUMENTS, help="並行して埋め込むドキュメント数")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="埋め込み API の同時呼び出し数（全体）")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--no-csv-streaming", action="store_true", help="CSV を全文にしてからスプリッタで分割する")
+    parser.add_argument("--embedding-model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--no-reuse", action="store_true", help="前回の出力の埋め込みを再利用しない")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Vertex AI の代わりにハッシュから作る擬似ベクトルを使う")
+    parser.add_argument("--dim", type=int, default=768, help="--fake-embeddings の次元数")
+    parser.add_argument("--limit", type=int, help="今回処理するファイル数の上限")
+    args = parser.parse_args(argv)
+
+    if args.fake_embeddings:
+        model = HashingEmbeddingModel(args.dim)
+        model_name = model.model_name
+    else:
+        model = get_embedding_model(PROJECT_ID, REGION, args.embedding_model)
+        model_name = args.embedding_model
+    report = run_backfill(
+        args.bucket, args.output_bucket, model,
+        local_root=args.local_root, project_id=PROJECT_ID, prefix=args.prefix, checkpoint_path=args.checkpoint,
+        workers=args.workers, embed_documents=args.embed_documents, max_in_flight=args.max_in_flight,
+        chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, csv_streaming=not args.no_csv_streaming,
+        embedding_model_name=model_name, reuse_embeddings=not args.no_reuse, limit=args.limit,
+    )
+    print(json.dumps(report, ensure_ascii=False))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
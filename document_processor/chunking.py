@@ -0,0 +1,177 @@
+"""ページ単位のストリーミング抽出とインクリメンタルなチャンク化。
+
+- iter_pdf_pages はページを 1 枚ずつ取り出す（文書全体の文字列を作らない）
+- 大きな PDF はページ範囲ごとにプロセスプールで抽出できる（結果はページ順のまま）
+- CSV は chunksize 単位で読み、行をヘッダ付きの CSV 行として行境界でチャンクにまとめる
+- iter_chunks は (ラベル, テキスト) の列を窓単位でスプリッタに通し、確定したチャンクから順に返す。
+  最後のチャンクは次の入力と繋がる可能性があるため持ち越すので、オーバーラップはページ境界を跨いでも保たれる
+- 入力はファイルパスのほか、PDF はメモリ上のバイト列、CSV はバイナリストリームでもよい（source_io.py）
+- PyMuPDF / pandas は初めて PDF / CSV を扱う時点で読み込む（コールドスタートを短くするため。startup.py）
+"""
+
+import bisect
+import contextlib
+import csv
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from .source_io import temporary_path
+    from .startup import STARTUP
+except ImportError:  # functions-framework がトップレベルモジュールとして読み込んだ場合
+    from source_io import temporary_path
+    from startup import STARTUP
+
+DEFAULT_PDF_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", "0"))
+DEFAULT_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "64"))
+# これ未満のページ数ならプロセスを起動するコストの方が大きいので、プールを使わない
+POOL_MIN_PAGES = int(os.environ.get("PDF_POOL_MIN_PAGES", "256"))
+# スプリッタに一度に渡す文字数の目安（chunk_size の数倍あれば分割結果は一括分割とほぼ同じになる）
+DEFAULT_WINDOW_CHARS = int(os.environ.get("CHUNK_WINDOW_CHARS", "8000"))
+DEFAULT_CSV_READ_ROWS = int(os.environ.get("CSV_READ_ROWS", "10000"))
+DEFAULT_CSV_CHUNK_CHARS = int(os.environ.get("CSV_CHUNK_CHARS", "1000"))
+
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> list[tuple[int, str]]:
+    """[start, stop) のページ（0 始まり）を抽出し、(1 始まりのページ番号, テキスト) を返す。"""
+    with STARTUP.load("fitz").open(file_path) as doc:
+        return [(i + 1, doc[i].get_text()) for i in range(start, min(stop, doc.page_count))]
+
+
+def _open_pdf(source):
+    fitz = STARTUP.load("fitz")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def iter_pdf_pages(source, *, workers: int = DEFAULT_PDF_WORKERS, pages_per_task: int = DEFAULT_PAGES_PER_TASK):
+    """(1 始まりのページ番号, テキスト) をページ順に yield する。source はファイルパスか PDF のバイト列。
+
+    workers > 1 かつ POOL_MIN_PAGES 以上のページがあるときは、pages_per_task ページずつ
+    プロセスプールで抽出する（各ワーカーが自分でファイルを開く。バイト列は一時ファイルに書き出して渡す）。
+    """
+    with _open_pdf(source) as doc:
+        page_count = doc.page_count
+        if workers <= 1 or page_count < POOL_MIN_PAGES:
+            for i, page in enumerate(doc):
+                yield i + 1, page.get_text()
+            return
+
+    step = max(1, int(pages_per_task))
+    starts = range(0, page_count, step)
+    with contextlib.ExitStack() as stack:
+        if not isinstance(source, str):
+            source = stack.enter_context(temporary_path(source, suffix=".pdf"))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for pages in pool.map(_extract_page_range, [source] * len(starts), starts, [s + step for s in starts]):
+                yield from pages
+
+
+def iter_chunks(units, splitter, *, window_chars: int = DEFAULT_WINDOW_CHARS):
+    """(ラベル, テキスト) の列をチャンク化し、(チャンク, 先頭のラベル, 末尾のラベル) を順に yield する。
+
+    窓（未確定のテキスト）が window_chars を超えるたびに split_text し、最後のチャンク以外を確定させる。
+    最後のチャンクの開始位置から先を次の窓へ持ち越すので、保持するテキストは窓 1 つ分 + 1 ユニット分に収まる。
+    ラベルは各チャンクが元テキストのどこから来たか（ページ番号など）を表す。
+    """
+    buf = ""
+    offsets: list[int] = []  # 窓内で各ユニットが始まる位置
+    labels: list = []
+
+    # 次のチャンクは「前のチャンクの末尾 - オーバーラップ」より後ろから始まる（繰り返しの多い
+    # テキストで手前の同じ文字列に誤って一致しないよう、探索開始位置をそこまで進める）
+    overlap = getattr(splitter, "_chunk_overlap", None)
+
+    def locate(chunks: list[str]):
+        pos = 0
+        for chunk in chunks:
+            found = buf.find(chunk, pos)
+            start = found if found >= 0 else pos
+            first = labels[max(0, bisect.bisect_right(offsets, start) - 1)]
+            last = labels[max(0, bisect.bisect_right(offsets, start + max(len(chunk), 1) - 1) - 1)]
+            yield chunk, start, first, last
+            pos = start + 1 if overlap is None else max(start + 1, start + len(chunk) - overlap)
+
+    for label, text in units:
+        if not text:
+            continue
+        offsets.append(len(buf))
+        labels.append(label)
+        buf += text
+        if len(buf) < window_chars:
+            continue
+        chunks = splitter.split_text(buf)
+        if len(chunks) < 2:
+            continue
+        located = list(locate(chunks))
+        for chunk, _, first, last in located[:-1]:
+            yield chunk, first, last
+
+        # 最後のチャンクの開始位置から先を持ち越す
+        keep_from = located[-1][1]
+        keep = max(0, bisect.bisect_right(offsets, keep_from) - 1)
+        buf = buf[keep_from:]
+        offsets = [0] + [o - keep_from for o in offsets[keep + 1 :]]
+        labels = labels[keep:]
+
+    if buf:
+        for chunk, _, first, last in locate(splitter.split_text(buf)):
+            yield chunk, first, last
+
+
+def _csv_line(values) -> str:
+    """1 行を CSV として直列化する（区切り文字や改行を含む値は引用符で囲む）。"""
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerow(values)
+    return buf.getvalue()
+
+
+def iter_csv_rows(source, *, read_rows: int = DEFAULT_CSV_READ_ROWS):
+    """ヘッダ行と、(1 始まりのデータ行番号, 直列化した行) を順に返すジェネレータの組を返す。
+
+    source はファイルパスかバイナリストリーム（GCS の BlobReader など）。
+    pd.read_csv(chunksize=read_rows) で読むので、保持するのは read_rows 行分だけ。
+    値は文字列のまま読み（型推論や NaN 変換で元の表記が変わらないように）、空欄は空文字にする。
+    """
+    pd = STARTUP.load("pandas")  # CSV を扱うまで読み込まない
+    try:
+        reader = pd.read_csv(source, chunksize=max(1, int(read_rows)), dtype=str, keep_default_na=False)
+    except pd.errors.EmptyDataError:
+        return "", iter(())
+    first = next(reader, None)
+    if first is None:
+        return "", iter(())
+
+    def rows():
+        row_number = 0
+        for frame in ([first], reader):
+            for df in frame:
+                for values in df.itertuples(index=False, name=None):
+                    row_number += 1
+                    yield row_number, _csv_line(values)
+
+    return _csv_line(first.columns), rows()
+
+
+def iter_csv_chunks(source, *, max_chars: int = DEFAULT_CSV_CHUNK_CHARS, read_rows: int = DEFAULT_CSV_READ_ROWS):
+    """CSV を行境界で区切ったチャンクにし、(チャンク, 先頭の行番号, 末尾の行番号) を順に yield する。
+
+    各チャンクはヘッダ行 + 連続する行で、ヘッダを除く長さが max_chars を超えない範囲で行を詰める
+    （1 行だけで超える場合はその行だけのチャンクにする）。行番号はヘッダを除いた 1 始まり。
+    """
+    header, rows = iter_csv_rows(source, read_rows=read_rows)
+    lines: list[str] = []
+    chars = 0
+    row_start = 0
+    for row_number, line in rows:
+        if lines and chars + len(line) > max_chars:
+            yield (header + "".join(lines)).rstrip("\n"), row_start, row_number - 1
+            lines, chars = [], 0
+        if not lines:
+            row_start = row_number
+        lines.append(line)
+        chars += len(line)
+    if lines:
+        yield (header + "".join(lines)).rstrip("\n"), row_start, row_start + len(lines) - 1
@@ -0,0 +1,314 @@
+"""出力バケットのドキュメント単位の出力を、少数の大きなセグメントへまとめるコンパクション（LSM 風）。
+
+レベル 0: process_document がドキュメントごとに書く <name>.jsonl / <name>.seg.npy / <name>.seg.meta と、
+          削除を表す <name>.tombstone（delete_document が書く）
+レベル 1: _segments/ 以下の不変なセグメント（複数ドキュメントの行をまとめたもの）と manifest
+
+  _segments/<seq>-<n>.seg.npy / .seg.meta : 行ごとの列に source_file と document（ドキュメント名）を持つセグメント
+  _segments/manifest-<seq>.json            : セグメントの一覧と、各ドキュメントの行範囲
+  _segments/CURRENT                        : 現在の manifest のオブジェクト名（これの上書きで切り替える）
+
+読み手（app/vector_store.py）は CURRENT → manifest → セグメントの順に読む。セグメントと manifest は
+書き換えないので、CURRENT を 1 回読めば一貫したスナップショットになる。レベル 0 に同じ名前の
+ドキュメント（またはそれより新しい tombstone）があれば、そちらが manifest 上の行より優先される。
+ただし manifest の superseded に記録された版（取り込み済みで削除待ちのレベル 0）は読み手もコンパクションも無視する。
+
+コンパクションの手順:
+  1. レベル 0 の全ドキュメントと、死んだ行を含むセグメント・小さいセグメントを入力にする
+  2. 入力をドキュメント単位で target_rows 行までのセグメントへ詰め直して書き出す
+  3. 新しい manifest を書き、CURRENT を差し替える（ここで読み手に見える）
+  4. 前回までに superseded に記録したオブジェクトのうち猶予（grace_seconds）を過ぎたものを削除する。
+     今回取り込んだレベル 0（読んだ版）・書き直したセグメント・旧 manifest はすぐには消さず、新しい manifest の
+     superseded に記録して次回以降のコンパクションで消す（切り替え前の CURRENT を読んだ読み手が読み終えるまで残す）
+
+使い方:
+    python -m document_processor.compaction --bucket <OUTPUT_BUCKET_NAME>
+    python -m document_processor.compaction --local-root ./gcs --bucket out      # ローカルディレクトリで試す
+    python -m document_processor.compaction --bucket <OUTPUT_BUCKET_NAME> --delete a.pdf
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+try:
+    from .segment import JSONL_SUFFIX, META_SUFFIX, VECTORS_SUFFIX, decode_segment, encode_segment
+except ImportError:  # functions-framework がトップレベルモジュールとして読み込んだ場合
+    from segment import JSONL_SUFFIX, META_SUFFIX, VECTORS_SUFFIX, decode_segment, encode_segment
+
+COMPACTED_PREFIX = "_segments/"
+CURRENT_NAME = COMPACTED_PREFIX + "CURRENT"
+TOMBSTONE_SUFFIX = ".tombstone"
+MANIFEST_FORMAT = "rag-segment-manifest"
+MANIFEST_VERSION = 1
+# 1 セグメントあたりの行数の目安（768 次元で 50,000 行 ≒ 150MB）。これの半分未満のセグメントは小さいとみなして併合する
+DEFAULT_TARGET_ROWS = int(os.environ.get("COMPACTION_TARGET_ROWS", "50000"))
+
+# superseded に記録したオブジェクトを消すまでの最短の猶予（秒）
+DEFAULT_GRACE_SECONDS = float(os.environ.get("COMPACTION_GRACE_SECONDS", "3600"))
+
+_LEVEL0_KINDS = (("jsonl", JSONL_SUFFIX), ("vectors", VECTORS_SUFFIX), ("meta", META_SUFFIX), ("tombstone", TOMBSTONE_SUFFIX))
+
+
+def superseded_objects(manifest: dict | None) -> set[tuple]:
+    """manifest が削除待ちとして記録しているオブジェクトの (名前, generation)。"""
+    return {(o["name"], o.get("generation")) for o in (manifest or {}).get("superseded", [])}
+
+
+def list_level0(bucket, superseded=()) -> dict[str, dict]:
+    """レベル 0 のオブジェクトをドキュメント単位にまとめる: name -> {"jsonl"/"vectors"/"meta"/"tombstone": Blob}。
+
+    "_" で始まる名前（_segments/ や _ann/ などの内部オブジェクト）と、superseded に含まれる
+    (名前, generation) の版（取り込み済みで削除待ちのもの）は対象外。
+    """
+    documents: dict[str, dict] = {}
+    for blob in bucket.list_blobs():
+        if blob.name.startswith("_") or (blob.name, getattr(blob, "generation", None)) in superseded:
+            continue
+        for kind, suffix in _LEVEL0_KINDS:
+            if blob.name.endswith(suffix):
+                documents.setdefault(blob.name[: -len(suffix)], {})[kind] = blob
+                break
+    return documents
+
+
+def is_deleted(parts: dict) -> bool:
+    """tombstone があり、それがデータのどのオブジェクトより新しい（版が大きいか比較できない）なら削除済み。"""
+    tombstone = parts.get("tombstone")
+    if tombstone is None:
+        return False
+    data = [getattr(b, "generation", None) for kind, b in parts.items() if kind != "tombstone"]
+    if tombstone.generation is None or any(g is None for g in data):
+        return True
+    return all(tombstone.generation >= g for g in data)
+
+
+def read_manifest(bucket) -> dict | None:
+    """CURRENT が指す manifest を読む（まだコンパクションしていなければ None）。"""
+    current = bucket.blob(CURRENT_NAME)
+    try:
+        name = current.download_as_bytes().decode("utf-8").strip()
+    except Exception:  # NotFound（ローカルでは FileNotFoundError）
+        return None
+    manifest = json.loads(bucket.blob(name).download_as_bytes().decode("utf-8"))
+    if manifest.get("format") != MANIFEST_FORMAT or manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("unsupported segment manifest format")
+    manifest["name"] = name
+    return manifest
+
+
+def _read_jsonl(data: bytes) -> tuple[list[str], np.ndarray, dict[str, list]]:
+    """process_document の JSONL を (テキスト, 行列, 列) にする。text_content / embedding 以外のキーは列になる。"""
+    records = [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+    texts = [r.pop("text_content") for r in records]
+    matrix = np.array([r.pop("embedding") for r in records], dtype=np.float32).reshape(len(records), -1)
+    keys = sorted({k for r in records for k in r})
+    return texts, matrix, {k: [r.get(k) for r in records] for k in keys}
+
+
+def read_document(parts: dict) -> tuple[list[str], np.ndarray, dict[str, list], str | None]:
+    """レベル 0 の 1 ドキュメントを (テキスト, 行列, 列, 埋め込みモデル名) にする（セグメント優先）。"""
+    if "vectors" in parts and "meta" in parts:
+        header, texts, matrix = decode_segment(parts["vectors"].download_as_bytes(), parts["meta"].download_as_bytes())
+        columns = {"source_file": [header.get("source_file", "")] * len(texts), **header.get("columns", {})}
+        return texts, matrix, columns, header.get("embedding_model")
+    texts, matrix, columns = _read_jsonl(parts["jsonl"].download_as_bytes())
+    return texts, matrix, columns, None
+
+
+def _segment_names(name: str) -> tuple[str, str]:
+    return f"{name}{VECTORS_SUFFIX}", f"{name}{META_SUFFIX}"
+
+
+class _SegmentWriter:
+    """ドキュメント単位の行を受け取り、target_rows 行を超える前にセグメントとして書き出す。"""
+
+    def __init__(self, bucket, seq: int, target_rows: int):
+        self.bucket = bucket
+        self.seq = seq
+        self.target_rows = max(1, int(target_rows))
+        self.written: list[dict] = []
+        self._reset()
+
+    def _reset(self) -> None:
+        self._texts: list[str] = []
+        self._matrices: list[np.ndarray] = []
+        self._columns: list[dict[str, list]] = []
+        self._documents: list[dict] = []
+        self._models: set = set()
+
+    def add(self, document: str, texts: list[str], matrix: np.ndarray, columns: dict[str, list], model) -> None:
+        if self._texts and len(self._texts) + len(texts) > self.target_rows:
+            self.flush()
+        start = len(self._texts)
+        self._texts.extend(texts)
+        self._matrices.append(np.asarray(matrix, dtype=np.float32))
+        self._columns.append({**columns, "document": [document] * len(texts)})
+        self._documents.append({"document": document, "start": start, "stop": len(self._texts)})
+        self._models.add(model)
+
+    def flush(self) -> None:
+        if not self._documents:
+            return
+        n = len(self._texts)
+        keys = sorted({k for c in self._columns for k in c})
+        columns = {k: [v for c, d in zip(self._columns, self._documents) for v in c.get(k, [None] * (d["stop"] - d["start"]))] for k in keys}
+        dims = {m.shape[1] for m in self._matrices if m.size}
+        if len(dims) > 1:
+            raise ValueError("documents with different embedding dimensions cannot share a segment")
+        matrix = np.concatenate(self._matrices) if dims else np.empty((n, 0), dtype=np.float32)
+        model = next(iter(self._models)) if len(self._models) == 1 else None
+        vectors, meta = encode_segment("", self._texts, matrix, columns=columns, embedding_model=model)
+
+        name = f"{COMPACTED_PREFIX}{self.seq:06d}-{len(self.written):03d}.seg"
+        vectors_name, meta_name = _segment_names(name)
+        self.bucket.blob(vectors_name).upload_from_string(vectors, content_type="application/octet-stream")
+        self.bucket.blob(meta_name).upload_from_string(meta, content_type="application/octet-stream")
+        self.written.append({"name": name, "rows": n, "documents": self._documents})
+        self._reset()
+
+
+def compact(
+    bucket,
+    *,
+    target_rows: int = DEFAULT_TARGET_ROWS,
+    delete_sources: bool = True,
+    grace_seconds: float = DEFAULT_GRACE_SECONDS,
+) -> dict:
+    """レベル 0 と小さい/死んだ行を含むセグメントを併合し、新しい manifest に切り替える。
+
+    併合するものが無ければ何も書かずに {"changed": False, ...} を返す（削除待ちのオブジェクトも次に
+    manifest を切り替えるときまで残る）。
+    """
+    manifest = read_manifest(bucket) or {"seq": 0, "segments": []}
+    level0 = list_level0(bucket, superseded_objects(manifest))
+    target_rows = max(1, int(target_rows))
+
+    live_level0 = {base: parts for base, parts in level0.items() if not is_deleted(parts) and ("jsonl" in parts or "vectors" in parts)}
+    segments = manifest["segments"]
+    small = [s for s in segments if s["rows"] < target_rows // 2]
+    rewrite = [
+        s for s in segments
+        if any(d["document"] in level0 for d in s["documents"]) or (s in small and (len(small) >= 2 or live_level0))
+    ]
+    stats = {"changed": False, "seq": manifest["seq"], "merged_documents": 0, "tombstones": 0,
+             "rewritten_segments": len(rewrite), "new_segments": 0, "deleted_objects": 0, "pending_objects": 0}
+    if not level0 and not rewrite:
+        return stats
+
+    seq = manifest["seq"] + 1
+    writer = _SegmentWriter(bucket, seq, target_rows)
+    # 書き直すセグメントの生きているドキュメント（レベル 0 に新しい版・tombstone が無いもの）
+    for entry in rewrite:
+        vectors_name, meta_name = _segment_names(entry["name"])
+        header, texts, matrix = decode_segment(bucket.blob(vectors_name).download_as_bytes(), bucket.blob(meta_name).download_as_bytes())
+        columns = {k: v for k, v in header.get("columns", {}).items() if k != "document"}
+        for doc in entry["documents"]:
+            if doc["document"] in level0:
+                continue
+            a, b = doc["start"], doc["stop"]
+            writer.add(doc["document"], texts[a:b], matrix[a:b], {k: v[a:b] for k, v in columns.items()}, header.get("embedding_model"))
+    # レベル 0 のドキュメント（名前順）
+    merged: dict[str, dict] = {}
+    for base in sorted(live_level0):
+        try:
+            texts, matrix, columns, model = read_document(live_level0[base])
+        except (ValueError, KeyError) as e:
+            # 書き込み途中など。取り込まず、レベル 0 に残して次回に回す
+            print(f"[WARN] {base} を読み込めないためコンパクションから外しました: {e}")
+            continue
+        writer.add(base, texts, matrix, columns, model)
+        merged[base] = live_level0[base]
+    writer.flush()
+
+    kept = [s for s in segments if s not in rewrite]
+    now = time.time()
+    pending = list(manifest.get("superseded", []))
+    expired = []
+    if delete_sources:
+        expired = [o for o in pending if now - o["since"] >= grace_seconds]
+        pending = [o for o in pending if now - o["since"] < grace_seconds]
+        # 今回不要になるもの: 取り込んだ版のレベル 0・tombstone で消えたドキュメント・書き直したセグメント・旧 manifest
+        retired = [(b.name, b.generation) for parts in merged.values() for b in parts.values()]
+        retired += [(b.name, b.generation) for parts in level0.values() if is_deleted(parts) for b in parts.values()]
+        retired += [(name, None) for entry in rewrite for name in _segment_names(entry["name"])]
+        if "name" in manifest:
+            retired.append((manifest["name"], None))
+        pending += [{"name": name, "generation": generation, "since": now} for name, generation in retired]
+    new_manifest = {
+        "format": MANIFEST_FORMAT,
+        "version": MANIFEST_VERSION,
+        "seq": seq,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "segments": kept + writer.written,
+        "superseded": pending,
+    }
+    manifest_name = f"{COMPACTED_PREFIX}manifest-{seq:06d}.json"
+    bucket.blob(manifest_name).upload_from_string(json.dumps(new_manifest, ensure_ascii=False), content_type="application/json")
+    # 切り替え: CURRENT の上書きは 1 オブジェクトの置き換えなので、読み手は旧版か新版のどちらかだけを見る
+    bucket.blob(CURRENT_NAME).upload_from_string(manifest_name, content_type="text/plain")
+
+    stats.update(changed=True, seq=seq, merged_documents=len(merged), new_segments=len(writer.written),
+                 tombstones=sum(1 for parts in level0.values() if is_deleted(parts)), pending_objects=len(pending))
+    # 猶予を過ぎたものを消す。レベル 0 は記録した版のままのものだけ（その後に上書きされたものは新しい入力として残る）
+    for o in expired:
+        stats["deleted_objects"] += _delete(bucket.blob(o["name"]), o.get("generation"))
+    return stats
+
+
+def _delete(blob, generation=None) -> int:
+    try:
+        if generation is not None:
+            blob.delete(if_generation_match=generation)
+        else:
+            blob.delete()
+        return 1
+    except Exception as e:  # PreconditionFailed / NotFound など。記録からは外れる（レベル 0 なら次回の入力に戻る）
+        print(f"[WARN] {blob.name} を削除できませんでした: {e}")
+        return 0
+
+
+def delete_document(bucket, base_name: str) -> None:
+    """ドキュメントを削除する: tombstone を書き、レベル 0 のデータを消す（コンパクション済みの行は tombstone で隠れる）。"""
+    bucket.blob(f"{base_name}{TOMBSTONE_SUFFIX}").upload_from_string(b"", content_type="application/octet-stream")
+    for suffix in (JSONL_SUFFIX, VECTORS_SUFFIX, META_SUFFIX):
+        blob = bucket.blob(f"{base_name}{suffix}")
+        try:
+            blob.delete()
+        except Exception:  # NotFound
+            pass
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="出力バケットのドキュメント単位の出力を大きなセグメントへまとめる")
+    parser.add_argument("--bucket", required=True, help="出力バケット名")
+    parser.add_argument("--local-root", help="GCS の代わりに <local-root>/<bucket>/ のファイルを使う")
+    parser.add_argument("--target-rows", type=int, default=DEFAULT_TARGET_ROWS)
+    parser.add_argument("--keep-sources", action="store_true", help="取り込んだレベル 0 のオブジェクトを消さない")
+    parser.add_argument("--grace-seconds", type=float, default=DEFAULT_GRACE_SECONDS,
+                        help="不要になったオブジェクトを消すまでの最短の猶予（秒）")
+    parser.add_argument("--delete", nargs="*", default=[], metavar="NAME", help="コンパクションの前に削除するドキュメント名")
+    args = parser.parse_args(argv)
+
+    if args.local_root:
+        try:
+            from .local_storage import LocalStorageClient
+        except ImportError:
+            from local_storage import LocalStorageClient
+        client = LocalStorageClient(args.local_root)
+    else:
+        from google.cloud import storage
+
+        client = storage.Client()
+    bucket = client.bucket(args.bucket)
+    for name in args.delete:
+        delete_document(bucket, name)
+    stats = compact(bucket, target_rows=args.target_rows, delete_sources=not args.keep_sources, grace_seconds=args.grace_seconds)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
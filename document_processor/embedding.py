@@ -0,0 +1,162 @@
+"""埋め込み API 呼び出しのスケジューラ。
+
+- チャンクを「件数上限 + 文字数予算」でバッチにまとめる（固定件数より 1 リクエストを大きくできる）
+- バッチは上限付きのスレッドプールで並列に送る（同時実行数 = max_in_flight）
+- クォータ超過（429 / ResourceExhausted 等）は指数バックオフ + ジッタで再試行する
+- 戻り値はバッチの完了順に関係なく入力と同じ順序
+- 複数ドキュメントを並行して処理するときは SharedEmbeddingModel で同時呼び出し数を全体で抑える
+"""
+
+import contextvars
+import os
+import random
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get("EMBEDDING_MAX_IN_FLIGHT", "4"))
+DEFAULT_MAX_BATCH_SIZE = int(os.environ.get("EMBEDDING_MAX_BATCH_SIZE", "250"))
+DEFAULT_MAX_BATCH_CHARS = int(os.environ.get("EMBEDDING_MAX_BATCH_CHARS", "15000"))
+DEFAULT_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "6"))
+
+# 再試行の対象とする HTTP ステータス（クォータ超過 / 一時的な過負荷）
+RETRYABLE_STATUS_CODES = (429, 503)
+
+
+def is_retryable_error(exc: Exception) -> bool:
+    """クォータ超過・一時的な過負荷を表す例外か（google.api_core が無くても判定できるよう code も見る）。"""
+    try:
+        from google.api_core import exceptions as gexc
+
+        if isinstance(exc, (gexc.ResourceExhausted, gexc.TooManyRequests, gexc.ServiceUnavailable)):
+            return True
+    except ImportError:
+        pass
+    return getattr(exc, "code", None) in RETRYABLE_STATUS_CODES
+
+
+def iter_batches(texts, collected: list[str], *, max_batch_size: int, max_batch_chars: int):
+    """テキストを 1 件ずつ collected に積みながら、閉じたバッチの (開始, 終了) を順に yield する。
+
+    各区間は件数 <= max_batch_size かつ文字数 <= max_batch_chars。1 件で予算を超えるテキストは
+    単独のバッチにする（切り詰めは API 側に任せる）。texts はジェネレータでもよい。
+    """
+    start = chars = 0
+    for text in texts:
+        i = len(collected)
+        if i > start and (i - start >= max_batch_size or chars + len(text) > max_batch_chars):
+            yield start, i
+            start, chars = i, 0
+        collected.append(text)
+        chars += len(text)
+    if start < len(collected):
+        yield start, len(collected)
+
+
+def plan_batches(texts: list[str], *, max_batch_size: int, max_batch_chars: int) -> list[tuple[int, int]]:
+    """テキスト列を (開始, 終了) の区間に分ける（規則は iter_batches と同じ）。"""
+    return list(iter_batches(texts, [], max_batch_size=max_batch_size, max_batch_chars=max_batch_chars))
+
+
+class EmbeddingScheduler:
+    """embedding_model.get_embeddings をバッチ化・並列化・再試行付きで呼ぶ。"""
+
+    def __init__(
+        self,
+        embedding_model,
+        *,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_batch_chars: int = DEFAULT_MAX_BATCH_CHARS,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = 1.0,
+        max_delay: float = 32.0,
+        sleep=time.sleep,
+        telemetry=None,
+    ):
+        self.embedding_model = embedding_model
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_batch_chars = max(1, int(max_batch_chars))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.retries = 0
+        self.telemetry = telemetry
+
+    def _call_with_retry(self, batch: list[str]) -> list:
+        attempt = 0
+        while True:
+            try:
+                return list(self.embedding_model.get_embeddings(batch))
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                delay = min(self.max_delay, self.base_delay * (2**attempt))
+                self.retries += 1
+                attempt += 1
+                self.sleep(delay * (0.5 + random.random() / 2))
+
+    def _call_batch(self, batch: list[str]) -> list:
+        if self.telemetry is None:
+            return self._call_with_retry(batch)
+        with self.telemetry.span("embed_batch", size=len(batch), chars=sum(map(len, batch))):
+            return self._call_with_retry(batch)
+
+    def embed(self, texts: list[str]) -> list:
+        """全テキストの埋め込みを入力と同じ順序で返す。"""
+        return self.embed_stream(texts)[1]
+
+    def embed_stream(self, texts) -> tuple[list[str], list]:
+        """テキストのイテラブル（抽出中のジェネレータなど）を消費しながらバッチを送り出す。
+
+        抽出とネットワーク待ちを重ねるための入口。未完了のバッチが max_in_flight の 2 倍に
+        達したら、完了するまで texts の消費を止める（抽出側が先行しすぎてメモリを使わないように）。
+        戻り値は (消費したテキスト, 埋め込み) で、どちらも入力と同じ順序。
+        """
+        collected: list[str] = []
+        pending: list[tuple[int, int, object]] = []
+        slots = threading.BoundedSemaphore(self.max_in_flight * 2)
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            for s, e in iter_batches(
+                texts, collected, max_batch_size=self.max_batch_size, max_batch_chars=self.max_batch_chars
+            ):
+                slots.acquire()
+                # ワーカースレッドでも呼び出し元のトレースにスパンが入るよう、コンテキストを引き継ぐ
+                future = pool.submit(contextvars.copy_context().run, self._call_batch, collected[s:e])
+                future.add_done_callback(lambda _: slots.release())
+                pending.append((s, e, future))
+
+            results: list = [None] * len(collected)
+            for s, e, future in pending:
+                embeddings = future.result()
+                if len(embeddings) != e - s:
+                    raise ValueError("embedding count does not match the batch size")
+                results[s:e] = embeddings
+                print(f"{e} / {len(collected)} 個のチャンクを処理しました...")
+        return collected, results
+
+
+class SharedEmbeddingModel:
+    """1 つの埋め込みモデルを複数のスケジューラ（並行して処理する複数ドキュメント）で共有する。
+
+    get_embeddings の同時呼び出し数をプロセス全体で max_in_flight に抑えるので、ドキュメントを並行して
+    処理してもクォータに対する同時リクエスト数は増えない。呼び出し回数と送ったテキスト数を数える。
+    """
+
+    def __init__(self, embedding_model, *, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.embedding_model = embedding_model
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.calls = 0
+        self.texts = 0
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+
+    def get_embeddings(self, texts: list[str]) -> list:
+        with self._slots:
+            embeddings = self.embedding_model.get_embeddings(texts)
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        return embeddings
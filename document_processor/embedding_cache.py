@@ -0,0 +1,92 @@
+"""チャンク本文のハッシュをキーにした埋め込みの再利用。
+
+再アップロードされたドキュメントは大半のチャンクが前回と同じなので、前回出力したセグメント
+（<name>.seg.*）をキャッシュとして読み、本文 + モデル名のハッシュが一致するチャンクは埋め込み API を
+呼ばずに前回のベクトルを使う。送るのはキャッシュに無いチャンクだけ。
+
+前回のベクトルはセグメントに保存された L2 正規化済みの値になる（コサイン類似度には影響しない）。
+"""
+
+import hashlib
+
+try:
+    from .segment import decode_segment, segment_blob_names
+except ImportError:  # functions-framework がトップレベルモジュールとして読み込んだ場合
+    from segment import decode_segment, segment_blob_names
+
+
+def content_hash(text: str, model_name: str) -> str:
+    """チャンク本文とモデル名から決まるキャッシュキー（モデルが変われば別キーになる）。"""
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class ChunkEmbeddingCache:
+    """content_hash -> 埋め込みベクトル の辞書と、hits / misses の集計。"""
+
+    def __init__(self, model_name: str, entries: dict | None = None):
+        self.model_name = model_name
+        self.entries = dict(entries or {})
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_segment(cls, model_name: str, vectors: bytes, meta: bytes) -> "ChunkEmbeddingCache":
+        """前回のセグメントから作る。別モデル（または記録なし）で作られたセグメントなら空のキャッシュ。"""
+        header, texts, matrix = decode_segment(vectors, meta)
+        if header.get("embedding_model") != model_name:
+            return cls(model_name)
+        return cls(model_name, {content_hash(t, model_name): matrix[i].tolist() for i, t in enumerate(texts)})
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, text: str):
+        return self.entries.get(content_hash(text, self.model_name))
+
+    def embed_stream(self, scheduler, texts) -> tuple[list[str], list]:
+        """EmbeddingScheduler.embed_stream と同じ形で、キャッシュに無いチャンクだけを scheduler に流す。
+
+        同じ本文のチャンクが 1 ドキュメント内に複数あっても、API に送るのは最初の 1 件だけ。
+        """
+        collected: list[str] = []
+        results: list = []
+        pending: dict[str, list[int]] = {}  # 送信したチャンクのハッシュ -> 結果を入れる位置
+
+        def misses():
+            for text in texts:
+                i = len(collected)
+                collected.append(text)
+                key = content_hash(text, self.model_name)
+                vector = self.entries.get(key)
+                results.append(vector)
+                if vector is not None:
+                    self.hits += 1
+                elif key in pending:
+                    self.hits += 1
+                    pending[key].append(i)
+                else:
+                    self.misses += 1
+                    pending[key] = [i]
+                    yield text
+
+        sent, embedded = scheduler.embed_stream(misses())
+        for text, emb in zip(sent, embedded):
+            key = content_hash(text, self.model_name)
+            for i in pending[key]:
+                results[i] = emb
+        print(f"[INFO] 埋め込みキャッシュ: hit={self.hits} miss={self.misses}")
+        return collected, results
+
+
+def load_previous_embeddings(bucket, base_name: str, model_name: str) -> ChunkEmbeddingCache:
+    """出力バケットにある前回のセグメントを読み込む。無い・読めない場合は空のキャッシュを返す。"""
+    vectors_name, meta_name = segment_blob_names(base_name)
+    try:
+        meta = bucket.blob(meta_name).download_as_bytes()
+        vectors = bucket.blob(vectors_name).download_as_bytes()
+        cache = ChunkEmbeddingCache.from_segment(model_name, vectors, meta)
+    except Exception as e:  # 初回アップロード（未作成）/ 形式違いなど
+        print(f"[INFO] 前回の埋め込みを再利用しません: {e}")
+        return ChunkEmbeddingCache(model_name)
+    print(f"[INFO] 前回の埋め込み {len(cache)} 件を再利用候補として読み込みました。")
+    return cache
@@ -0,0 +1,114 @@
+"""ローカルディレクトリを GCS バケットとして扱う最小限のストレージクライアント。
+
+<root>/<bucket>/<name> のファイルを 1 オブジェクトとみなす。コンパクションやバックフィルを
+ネットワーク・資格情報なしで動かすため、および各種ベンチマークで使う。
+google.cloud.storage.Client のうち、このリポジトリが使うメソッドだけを実装している。
+
+  - upload_from_string は一時ファイルに書いてから os.replace するので、読み手は常に完全な内容を見る
+  - generation はファイルの更新時刻（ナノ秒、書き込みごとに単調増加）。delete(if_generation_match=...) で書き換え済みなら消さない
+"""
+
+import os
+import shutil
+import threading
+import time
+
+
+class LocalBlob:
+    def __init__(self, root: str, bucket: str, name: str, generation=None):
+        self.name = name
+        self.path = os.path.join(root, bucket, name)
+        # list_blobs で得たものは GCS と同様、一覧を取った時点の版を保持する
+        self._generation = generation
+
+    @property
+    def generation(self):
+        """ファイルの更新時刻をオブジェクトの版として使う（存在しなければ None）。"""
+        if self._generation is not None:
+            return self._generation
+        return self._stat_generation()
+
+    def _stat_generation(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @property
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return None
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def open(self, mode: str = "rb", **kwargs):
+        return open(self.path, mode)  # chunk_size など GCS 固有の引数は無視する
+
+    def download_to_filename(self, dst: str) -> None:
+        shutil.copyfile(self.path, dst)
+
+    def download_as_bytes(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def download_as_text(self, encoding: str = "utf-8") -> str:
+        return self.download_as_bytes().decode(encoding)
+
+    def upload_from_string(self, data, content_type: str = "application/octet-stream") -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        # ファイルシステムの時刻の粒度は粗いことがあるので、同じ名前への書き込みごとに版が必ず増えるようにする
+        previous = self._stat_generation()
+        now = time.time_ns()
+        generation = now if previous is None else max(now, previous + 1)
+        os.utime(tmp, ns=(now, generation))
+        os.replace(tmp, self.path)
+        self._generation = generation
+
+    def upload_from_filename(self, src: str, content_type: str = "application/octet-stream") -> None:
+        with open(src, "rb") as f:
+            self.upload_from_string(f.read(), content_type=content_type)
+
+    def delete(self, if_generation_match=None) -> None:
+        if if_generation_match is not None and self._stat_generation() != if_generation_match:
+            raise FileExistsError(f"{self.name} was modified (generation mismatch)")
+        os.remove(self.path)
+
+
+class LocalBucket:
+    def __init__(self, root: str, name: str):
+        self.root = root
+        self.name = name
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(self.root, self.name, name)
+
+    def list_blobs(self, prefix: str = ""):
+        top = os.path.join(self.root, self.name)
+        for dirpath, _, filenames in os.walk(top):
+            for filename in sorted(filenames):
+                if filename.endswith(".tmp"):
+                    continue
+                name = os.path.relpath(os.path.join(dirpath, filename), top).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    blob = self.blob(name)
+                    blob._generation = blob._stat_generation()
+                    yield blob
+
+
+class LocalStorageClient:
+    """<root>/<bucket>/<name> のファイルを GCS オブジェクトとして扱うクライアント。"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def bucket(self, name: str) -> LocalBucket:
+        return LocalBucket(self.root, name)
+
+    def list_blobs(self, bucket_name: str, prefix: str = ""):
+        return self.bucket(bucket_name).list_blobs(prefix)
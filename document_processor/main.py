@@ -1,21 +1,73 @@
+import contextlib
 import os
 import json
-import fitz
-import pandas as pd
-from google.cloud import storage
-from google.cloud import aiplatform
-from vertexai.language_models import TextEmbeddingModel
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import threading
+import time
+
+try:
+    from .startup import STARTUP  # 最初に読み込む（ここからの時間を main の読み込み時間として記録する）
+    from .source_io import open_source
+    from .chunking import DEFAULT_CSV_CHUNK_CHARS, iter_csv_chunks, iter_csv_rows, iter_chunks, iter_pdf_pages
+    from .embedding_cache import ChunkEmbeddingCache, load_previous_embeddings
+    from .telemetry import TELEMETRY
+    from .embedding import DEFAULT_MAX_BATCH_CHARS, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_IN_FLIGHT, EmbeddingScheduler
+    from .segment import encode_segment, upload_segment
+except ImportError:  # functions-framework がトップレベルモジュールとして読み込んだ場合
+    from startup import STARTUP
+    from source_io import open_source
+    from chunking import DEFAULT_CSV_CHUNK_CHARS, iter_csv_chunks, iter_csv_rows, iter_chunks, iter_pdf_pages
+    from embedding_cache import ChunkEmbeddingCache, load_previous_embeddings
+    from telemetry import TELEMETRY
+    from embedding import DEFAULT_MAX_BATCH_CHARS, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_IN_FLIGHT, EmbeddingScheduler
+    from segment import encode_segment, upload_segment
 
 # --- 定数（環境変数から取得。未設定時は安全なデフォルトを採用） ---
 PROJECT_ID = os.environ.get("GCP_PROJECT") or os.environ.get("GOOGLE_CLOUD_PROJECT")
 REGION = os.environ.get("REGION", "us-central1")
 OUTPUT_BUCKET = os.environ.get("OUTPUT_BUCKET_NAME")
 EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME", "text-embedding-004")
+# CSV を行境界のチャンクとしてストリーミング処理するか（0 なら全文を文字列化してスプリッタで分割）
+CSV_STREAMING = os.environ.get("CSV_STREAMING", "1") != "0"
+# 再アップロード時、前回のセグメントと本文が同じチャンクの埋め込みを再利用するか
+REUSE_EMBEDDINGS = os.environ.get("REUSE_EMBEDDINGS", "1") != "0"
+# 1 なら形式ごとのライブラリ（PyMuPDF / pandas / langchain）を読み込み時に先に import する
+# （最小インスタンス数を 1 以上にして、起動時に払っておきたい場合）。既定は初めて使う時点で読み込む
+STARTUP_PRELOAD = os.environ.get("STARTUP_PRELOAD", "0") != "0"
+PRELOAD_MODULES = ("fitz", "pandas", "langchain_text_splitters")
+
+# リクエストをまたいで使い回すクライアント・モデル（key -> インスタンス）。
+# Storage クライアントや Vertex AI の初期化はインスタンスごとに 1 回だけ行う
+_RESOURCES: dict[tuple, object] = {}
+_RESOURCES_LOCK = threading.Lock()
+
+
+def _cached(key: tuple, factory):
+    """key のインスタンスが無ければ factory() で作って保持する（同時に来ても作るのは 1 回）。"""
+    with _RESOURCES_LOCK:
+        if key not in _RESOURCES:
+            with STARTUP.initializing(key[0]):
+                _RESOURCES[key] = factory()
+        return _RESOURCES[key]
+
+
+def get_storage_client(project_id: str | None):
+    def create():
+        return STARTUP.load("google.cloud.storage").Client(project=project_id)
+
+    return _cached(("storage_client", project_id), create)
+
+
+def get_embedding_model(project_id: str | None, region: str, model_name: str = EMBEDDING_MODEL_NAME):
+    def create():
+        STARTUP.load("google.cloud.aiplatform").init(project=project_id, location=region)
+        return STARTUP.load("vertexai.language_models").TextEmbeddingModel.from_pretrained(model_name)
+
+    return _cached(("embedding_model", project_id, region, model_name), create)
 
 
 def build_text_splitter(chunk_size: int = 1000, chunk_overlap: int = 100):
     """デフォルトのテキストスプリッタを生成（テストで差し替えやすいよう関数化）。"""
+    RecursiveCharacterTextSplitter = STARTUP.load("langchain_text_splitters").RecursiveCharacterTextSplitter
     return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
@@ -26,27 +78,33 @@ def process_document(
     event,
     context,
     *,
-    storage_client: storage.Client | None = None,
+    storage_client=None,
     splitter=None,
     embedding_model=None,
     project_id: str | None = None,
     region: str | None = None,
     output_bucket: str | None = None,
-    batch_size: int = 10,
+    batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    max_batch_chars: int = DEFAULT_MAX_BATCH_CHARS,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    csv_streaming: bool = CSV_STREAMING,
+    csv_chunk_chars: int = DEFAULT_CSV_CHUNK_CHARS,
+    reuse_embeddings: bool = REUSE_EMBEDDINGS,
+    telemetry=None,
 ):
     """
     GCS へのファイルアップロードをトリガーに実行されるメイン関数。
     依存（Storage クライアント、スプリッタ、埋め込みモデル）は引数で DI 可能にし、
     テストではモックを渡して I/O を避けられるようにしている。
-    実際の Cloud Run 実行では引数を省略すれば従来通り動作する。
+    実際の Cloud Run 実行では引数を省略すれば従来通り動作する（クライアントとモデルはリクエストをまたいで使い回す）。
+    段階ごとの所要時間は telemetry（既定: プロセス共有の TELEMETRY）に記録し、JSON ログに出す。
+    csv_chunk_chars は CSV を行単位でチャンク化するときの 1 チャンクの文字数の目安（既定: CSV_CHUNK_CHARS）。
     """
     # 実行時コンテキストの解決
     project_id = project_id or PROJECT_ID
     region = region or REGION
     output_bucket = output_bucket or OUTPUT_BUCKET
-
-    if storage_client is None:
-        storage_client = storage.Client(project=project_id)
+    telemetry = telemetry or TELEMETRY
 
     # event から GCS オブジェクト情報を取得
     bucket_name = event.get("bucket") if isinstance(event, dict) else None
@@ -56,86 +114,159 @@ def process_document(
         print("[WARN] event に bucket / name が含まれていません。処理を中止します。")
         return
 
-    # ソースを /tmp へダウンロード
-    source_bucket = storage_client.bucket(bucket_name)
-    source_blob = source_bucket.blob(file_name)
-    temp_file_path = f"/tmp/{os.path.basename(file_name)}"
-    source_blob.download_to_filename(temp_file_path)
-
-    # テキスト抽出（拡張子で分岐）
-    lower_name = file_name.lower()
-    if lower_name.endswith(".pdf"):
-        extracted_text = process_pdf(temp_file_path)
-    elif lower_name.endswith(".csv"):
-        extracted_text = process_csv(temp_file_path)
-    else:
-        print(f"サポート外のファイル形式です: {file_name}")
-        return
+    with (
+        telemetry.trace("process_document", source_file=file_name),
+        STARTUP.request(emit=telemetry.emit),
+        contextlib.ExitStack() as source_scope,
+    ):
+        lower_name = file_name.lower()
+        if not lower_name.endswith((".pdf", ".csv")):
+            print(f"サポート外のファイル形式です: {file_name}")
+            return
 
-    if not extracted_text:
-        print("[INFO] 抽出テキストが空のため処理をスキップします。")
-        return
+        if not output_bucket:
+            # 本番環境でも安全側に倒す（環境変数未設定時はアップロードしない）
+            print("[WARN] OUTPUT_BUCKET_NAME が未設定のため、出力をスキップします。")
+            return
 
-    if not output_bucket:
-        # 本番環境でも安全側に倒す（環境変数未設定時はアップロードしない）
-        print("[WARN] OUTPUT_BUCKET_NAME が未設定のため、出力をスキップします。")
-        return
+        if storage_client is None:
+            storage_client = get_storage_client(project_id)
+
+        # ソースは /tmp を経由せずに抽出処理へ渡す（CSV はストリームのまま、PDF はメモリ上のバイト列。
+        # 大きな PDF だけ一意な一時ファイルに書き出し、埋め込みが終わった時点で閉じて消す）
+        source_blob = storage_client.bucket(bucket_name).blob(file_name)
+        with telemetry.span("download"):
+            source = source_scope.enter_context(open_source(source_blob, file_name))
+
+        # スプリッタ（未指定ならデフォルトを使い回す）。CSV の行単位の経路は分割に使わないので作らない
+        if splitter is None and (lower_name.endswith(".pdf") or not csv_streaming):
+            splitter = _cached(("text_splitter",), build_text_splitter)
+
+        # テキスト抽出 + チャンク化（拡張子で分岐）。PDF はページ、CSV は行を順に読みながらチャンク化し、
+        # チャンクごとの出所（ページ範囲 / 行範囲）を chunk_meta に記録する。
+        # 抽出・チャンク化は埋め込みと交互に進むので、各段の next() に掛かった時間を積算して記録する
+        print("テキストのチャンク化を開始...")
+        chunk_meta: list[dict] = []
+        extract_timer = None
+        if lower_name.endswith(".pdf"):
+            extract_timer = telemetry.timed(iter_pdf_pages(source))
 
-    # スプリッタ生成（未指定ならデフォルト）
-    splitter = splitter or build_text_splitter()
-
-    print("テキストのチャンク化を開始...")
-    chunks = splitter.split_text(extracted_text)
-    print(f"{len(chunks)} 個のチャンクに分割しました。")
-
-    # 埋め込みモデル生成（未指定なら Vertex AI を初期化）
-    if embedding_model is None:
-        aiplatform.init(project=project_id, location=region)
-        embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
-
-    print("チャンクのベクトル化を開始...")
-    all_embeddings = []
-    for i in range(0, len(chunks), batch_size):
-        batch_chunks = chunks[i : i + batch_size]
-        embeddings_batch = embedding_model.get_embeddings(batch_chunks)
-        all_embeddings.extend(embeddings_batch)
-        print(f"{i + len(batch_chunks)} / {len(chunks)} 個のチャンクを処理しました...")
-
-    # JSONL を生成し、出力バケットへ保存
-    output_lines: list[str] = []
-    for idx, chunk in enumerate(chunks):
-        emb_obj = all_embeddings[idx]
-        # 本番では .values を持つが、テストでは list で代用できるようフォールバック
-        values = getattr(emb_obj, "values", emb_obj)
-        output_lines.append(
-            json.dumps(
-                {
-                    "source_file": file_name,
-                    "chunk_id": idx,
-                    "text_content": chunk,
-                    "embedding": values,
-                },
-                ensure_ascii=False,
-            )
+            def chunk_stream():
+                for chunk, page_start, page_end in iter_chunks(extract_timer, splitter):
+                    chunk_meta.append({"page_start": page_start, "page_end": page_end})
+                    yield chunk
+
+        elif csv_streaming:
+            # 行の途中では切らない。1 チャンクの大きさは csv_chunk_chars を目安にする
+            def chunk_stream():
+                for chunk, row_start, row_end in iter_csv_chunks(source, max_chars=csv_chunk_chars):
+                    chunk_meta.append({"row_start": row_start, "row_end": row_end})
+                    yield chunk
+
+        else:
+            with telemetry.span("extract"):
+                extracted_text = process_csv(source)
+
+            def chunk_stream():
+                yield from splitter.split_text(extracted_text) if extracted_text else []
+
+        # 埋め込みモデル（未指定ならインスタンスで 1 回だけ Vertex AI を初期化したものを使い回す）
+        if embedding_model is None:
+            embedding_model = get_embedding_model(project_id, region)
+
+        # バッチは件数上限(batch_size)と文字数予算で組み、上限付きで並列に送る（出力順は入力順のまま）。
+        # チャンクは生成されたそばから送るので、抽出・チャンク化と埋め込み API の待ち時間が重なる
+        print("チャンクのベクトル化を開始...")
+        scheduler = EmbeddingScheduler(
+            embedding_model,
+            max_in_flight=max_in_flight,
+            max_batch_size=batch_size,
+            max_batch_chars=max_batch_chars,
+            telemetry=telemetry,
+        )
+        # 前回の出力と本文が同じチャンクはキャッシュから埋め、残りだけを API に送る
+        output_bucket_ref = storage_client.bucket(output_bucket)
+        if reuse_embeddings:
+            with telemetry.span("embedding_cache_load"):
+                cache = load_previous_embeddings(output_bucket_ref, file_name, EMBEDDING_MODEL_NAME)
+        else:
+            cache = ChunkEmbeddingCache(EMBEDDING_MODEL_NAME)
+        chunk_timer = telemetry.timed(chunk_stream())
+        embed_start = time.perf_counter()
+        chunks, all_embeddings = cache.embed_stream(scheduler, chunk_timer)
+        source_scope.close()
+        # 「chunk」は抽出を除いた正味（CSV のストリーミングでは行の読み込みを含む）、
+        # 「embed」はチャンク生成を除いた埋め込み待ちの時間
+        extract_sec = extract_timer.seconds if extract_timer is not None else 0.0
+        if extract_timer is not None:
+            telemetry.record("extract", extract_sec, pages=extract_timer.count)
+        telemetry.record("chunk", chunk_timer.seconds - extract_sec, chunks=chunk_timer.count)
+        telemetry.record(
+            "embed", time.perf_counter() - embed_start - chunk_timer.seconds, cache_hits=cache.hits, cache_misses=cache.misses
+        )
+        print(f"{len(chunks)} 個のチャンクに分割しました。")
+
+        if not chunks:
+            print("[INFO] 抽出テキストが空のため処理をスキップします。")
+            return
+
+        write_outputs(output_bucket_ref, file_name, chunks, all_embeddings, chunk_meta, telemetry=telemetry)
+
+
+def write_outputs(
+    output_bucket_ref,
+    file_name: str,
+    chunks: list[str],
+    embeddings: list,
+    chunk_meta: list[dict],
+    *,
+    telemetry=None,
+    embedding_model_name: str = EMBEDDING_MODEL_NAME,
+) -> None:
+    """1 ドキュメント分のチャンクと埋め込みを JSONL とセグメントにして出力バケットへ保存する。"""
+    telemetry = telemetry or TELEMETRY
+    # 本番では .values を持つが、テストでは list で代用できるようフォールバック
+    vectors = [getattr(emb_obj, "values", emb_obj) for emb_obj in embeddings]
+
+    # JSONL と、アプリが JSON を解析せずにメモリマップできる列指向セグメントを生成
+    with telemetry.span("serialize"):
+        output_lines: list[str] = []
+        for idx, chunk in enumerate(chunks):
+            record = {"source_file": file_name, "chunk_id": idx, "text_content": chunk, "embedding": vectors[idx]}
+            if chunk_meta:
+                record.update(chunk_meta[idx])
+            output_lines.append(json.dumps(record, ensure_ascii=False))
+
+        columns = {"chunk_id": list(range(len(chunks)))}
+        for name in chunk_meta[0] if chunk_meta else ():
+            columns[name] = [meta[name] for meta in chunk_meta]
+        seg_vectors, seg_meta = encode_segment(
+            file_name, chunks, vectors, columns=columns, embedding_model=embedding_model_name
         )
 
-    output_blob_name = f"{file_name}.jsonl"
-    output_bucket_ref = storage_client.bucket(output_bucket)
-    output_blob = output_bucket_ref.blob(output_blob_name)
-    output_blob.upload_from_string("\n".join(output_lines), content_type="application/jsonl")
-    print(f"ベクトルデータ保存完了: gs://{output_bucket}/{output_blob_name}")
+    # 出力バケットへ保存
+    with telemetry.span("upload"):
+        output_blob_name = f"{file_name}.jsonl"
+        output_blob = output_bucket_ref.blob(output_blob_name)
+        output_blob.upload_from_string("\n".join(output_lines), content_type="application/jsonl")
+        print(f"ベクトルデータ保存完了: gs://{output_bucket_ref.name}/{output_blob_name}")
+        upload_segment(output_bucket_ref, file_name, seg_vectors, seg_meta)
+        print(f"セグメント保存完了: gs://{output_bucket_ref.name}/{file_name}.seg.*")
 
 
 # 純粋関数：ここはユニットテストしやすい
 
-def process_pdf(file_path: str) -> str:
-    text = ""
-    with fitz.open(file_path) as doc:
-        for page in doc:
-            text += page.get_text()
-    return text
+def process_pdf(source) -> str:
+    return "".join(text for _, text in iter_pdf_pages(source))
+
+
+def process_csv(source) -> str:
+    """CSV 全体をヘッダ + CSV 行の文字列にする（固定幅の to_string より短く、行単位で読む）。source はパスかストリーム。"""
+    header, rows = iter_csv_rows(source)
+    return (header + "".join(line for _, line in rows)).rstrip("\n")
 
 
-def process_csv(file_path: str) -> str:
-    df = pd.read_csv(file_path)
-    return df.to_string()
\ No newline at end of file
+if STARTUP_PRELOAD:
+    for _name in PRELOAD_MODULES:
+        STARTUP.load(_name)
+STARTUP.imported()
@@ -0,0 +1,169 @@
+"""列指向ベクトルセグメントの書き出しと、既存 JSONL からの変換ツール。
+
+1 ドキュメント分の出力を次の 2 オブジェクトで表す（アプリ側の読み込みは app/segment.py）:
+  - <name>.seg.npy  : L2 正規化済み float32 行列（.npy 形式。np.load(mmap_mode="r") で直接マップ可能）
+  - <name>.seg.meta : 1 行目が JSON ヘッダ、改行の後ろに UTF-8 テキストを連結したバイト列。
+                      i 番目のテキストは blob[text_offsets[i]:text_offsets[i+1]]。
+
+使い方（既存 JSONL の一括変換）:
+    python -m document_processor.segment --bucket <OUTPUT_BUCKET_NAME> [--force]
+"""
+
+import argparse
+import io
+import json
+
+import numpy as np
+
+SEGMENT_FORMAT = "rag-segment"
+SEGMENT_VERSION = 1
+JSONL_SUFFIX = ".jsonl"
+VECTORS_SUFFIX = ".seg.npy"
+META_SUFFIX = ".seg.meta"
+
+
+def segment_blob_names(base_name: str) -> tuple[str, str]:
+    """ドキュメント名（例: "a.pdf"）から (行列, メタ) のオブジェクト名を返す。"""
+    return f"{base_name}{VECTORS_SUFFIX}", f"{base_name}{META_SUFFIX}"
+
+
+def encode_segment(
+    source_file: str,
+    texts: list[str],
+    embeddings,
+    columns: dict[str, list] | None = None,
+    *,
+    embedding_model: str | None = None,
+) -> tuple[bytes, bytes]:
+    """テキストと埋め込みから (行列 .npy バイト列, メタバイト列) を作る純粋関数。
+
+    仕様:
+      - 埋め込みは NaN/Inf を 0 に置換し、行ごとに L2 正規化した float32 で保存
+      - 行数とテキスト数が一致しなければ ValueError
+      - columns はチャンク単位のメタデータ（列名 -> 行数と同じ長さのリスト）
+      - embedding_model を渡すとヘッダに記録する（再アップロード時の埋め込み再利用の判定に使う）
+    """
+    n = len(texts)
+    E = np.array(embeddings, dtype=np.float32)
+    if n == 0 and E.size == 0:
+        E = E.reshape(0, 0)
+    if E.ndim != 2 or E.shape[0] != n:
+        raise ValueError("embeddings must be a 2-D array with one row per text")
+    columns = dict(columns or {})
+    for name, values in columns.items():
+        if len(values) != n:
+            raise ValueError(f"column '{name}' length must match texts")
+
+    E = np.nan_to_num(E, nan=0.0, posinf=0.0, neginf=0.0)
+    norms = np.linalg.norm(E, axis=1, keepdims=True)
+    np.divide(E, norms, out=E, where=norms != 0.0)
+
+    buf = io.BytesIO()
+    np.save(buf, np.ascontiguousarray(E), allow_pickle=False)
+
+    encoded = [t.encode("utf-8") for t in texts]
+    offsets = [0]
+    for b in encoded:
+        offsets.append(offsets[-1] + len(b))
+
+    header = {
+        "format": SEGMENT_FORMAT,
+        "version": SEGMENT_VERSION,
+        "source_file": source_file,
+        "count": n,
+        "dim": int(E.shape[1]),
+        "normalized": True,
+        "text_offsets": offsets,
+        "columns": columns,
+    }
+    if embedding_model:
+        header["embedding_model"] = embedding_model
+    # json.dumps（indent なし）は改行を含まないので、最初の改行がヘッダの終端になる
+    meta = json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n" + b"".join(encoded)
+    return buf.getvalue(), meta
+
+
+def decode_segment(vectors: bytes, meta: bytes) -> tuple[dict, list[str], np.ndarray]:
+    """encode_segment の逆。(ヘッダ, テキスト, 行列) を返す。未知の形式/版や形の不一致は ValueError。"""
+    sep = meta.index(b"\n")
+    header = json.loads(meta[:sep].decode("utf-8"))
+    if header.get("format") != SEGMENT_FORMAT or header.get("version") != SEGMENT_VERSION:
+        raise ValueError("unsupported segment format")
+    blob = meta[sep + 1 :]
+    offsets = header["text_offsets"]
+    texts = [blob[offsets[i] : offsets[i + 1]].decode("utf-8") for i in range(header["count"])]
+
+    matrix = np.load(io.BytesIO(vectors), allow_pickle=False)
+    if matrix.shape != (header["count"], header["dim"]):
+        raise ValueError("segment matrix does not match its header")
+    return header, texts, matrix
+
+
+def jsonl_to_segment(content: str, *, embedding_model: str | None = None) -> tuple[bytes, bytes]:
+    """process_document が出力した 1 ドキュメント分の JSONL をセグメントに変換する。
+
+    text_content / embedding / source_file 以外のキー（chunk_id・ページ範囲・行範囲など）はすべて列になる
+    （一部の行にしか無いキーは None で埋める）。embedding_model はヘッダに記録する
+    （引数が無ければ、行に embedding_model キーがあればその値）。
+    """
+    records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    source_file = records[0].get("source_file", "") if records else ""
+    texts = [r.pop("text_content") for r in records]
+    embeddings = [r.pop("embedding") for r in records]
+    for r in records:
+        r.pop("source_file", None)
+        model = r.pop("embedding_model", None)
+        embedding_model = embedding_model or model
+    columns = {"chunk_id": [r.pop("chunk_id", i) for i, r in enumerate(records)]}
+    for key in sorted({k for r in records for k in r}):
+        columns[key] = [r.get(key) for r in records]
+    return encode_segment(source_file, texts, embeddings, columns=columns, embedding_model=embedding_model)
+
+
+def upload_segment(bucket, base_name: str, vectors: bytes, meta: bytes) -> None:
+    """セグメントの 2 オブジェクトをバケットへ保存する（メタを後に書き、読み手が片側だけを拾いにくくする）。"""
+    vectors_name, meta_name = segment_blob_names(base_name)
+    bucket.blob(vectors_name).upload_from_string(vectors, content_type="application/octet-stream")
+    bucket.blob(meta_name).upload_from_string(meta, content_type="application/octet-stream")
+
+
+def convert_bucket(
+    storage_client, bucket_name: str, *, force: bool = False, embedding_model: str | None = None
+) -> list[str]:
+    """バケット内の <name>.jsonl のうちセグメント未作成のものを変換し、変換した name の一覧を返す。
+
+    embedding_model を渡すと各セグメントのヘッダに記録する（再アップロード時の埋め込み再利用に必要）。
+    """
+    bucket = storage_client.bucket(bucket_name)
+    names = {b.name for b in bucket.list_blobs()}
+
+    converted = []
+    for name in sorted(names):
+        if not name.endswith(JSONL_SUFFIX):
+            continue
+        base_name = name[: -len(JSONL_SUFFIX)]
+        if not force and all(n in names for n in segment_blob_names(base_name)):
+            continue
+        content = bucket.blob(name).download_as_text()
+        vectors, meta = jsonl_to_segment(content, embedding_model=embedding_model)
+        upload_segment(bucket, base_name, vectors, meta)
+        converted.append(base_name)
+        print(f"セグメントに変換しました: gs://{bucket_name}/{base_name}")
+    return converted
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="既存の JSONL ベクトル出力を列指向セグメントに変換する")
+    parser.add_argument("--bucket", required=True, help="JSONL が置かれている出力バケット名")
+    parser.add_argument("--force", action="store_true", help="既存セグメントがあっても作り直す")
+    parser.add_argument("--embedding-model", help="JSONL を作った埋め込みモデル名（ヘッダに記録し、埋め込みの再利用に使う）")
+    args = parser.parse_args(argv)
+
+    from google.cloud import storage
+
+    converted = convert_bucket(storage.Client(), args.bucket, force=args.force, embedding_model=args.embedding_model)
+    print(f"{len(converted)} 件のドキュメントを変換しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""ソースオブジェクトを抽出処理へ渡す I/O 層（/tmp を経由しない）。
+
+Cloud Run の /tmp はメモリ上にあるので、ダウンロードしたファイルはメモリを 2 重に使い、消さなければ
+インスタンスが生きている間残り続ける。ここではオブジェクトを次の形で抽出処理に渡す:
+
+  - CSV: オブジェクトを順に読み進めるストリーム（pandas が chunksize 単位で読むので、全体を保持しない）
+  - PDF: バイト列（PyMuPDF はメモリ上のバイト列から開ける）。PDF_MAX_IN_MEMORY_BYTES を超えるものは
+         一意な名前の一時ファイルへストリームで書き出してパスを渡す
+  - open を持たないクライアント（ストリームで読めない場合）は一意な一時ファイルにダウンロードする
+
+一時ファイルは常に with を抜けた時点で削除する。
+"""
+
+import contextlib
+import os
+import shutil
+import tempfile
+
+# ストリームで読むときに 1 回の要求で取得するバイト数（リクエストあたりの読み込みバッファの上限）
+SOURCE_READ_CHUNK_BYTES = int(os.environ.get("SOURCE_READ_CHUNK_BYTES", str(8 * 2**20)))
+# これ以下の PDF はメモリ上のバイト列として開き、超えるものは一時ファイルへ書き出す
+PDF_MAX_IN_MEMORY_BYTES = int(os.environ.get("PDF_MAX_IN_MEMORY_BYTES", str(64 * 2**20)))
+TEMP_PREFIX = "rag-src-"
+
+
+@contextlib.contextmanager
+def temporary_path(data=None, *, suffix: str = ""):
+    """一意な名前の一時ファイルを作ってパスを返し、with を抜けたら削除する。
+
+    data にバイト列か読み取り可能なストリームを渡すと、その内容を書き込んでおく。
+    """
+    fd, path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                f.write(data)
+            elif data is not None:
+                shutil.copyfileobj(data, f, SOURCE_READ_CHUNK_BYTES)
+        yield path
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+
+def _open_stream(blob):
+    try:
+        return blob.open("rb", chunk_size=SOURCE_READ_CHUNK_BYTES)
+    except TypeError:  # chunk_size を取らない（GCS 以外の）実装
+        return blob.open("rb")
+
+
+@contextlib.contextmanager
+def open_source(blob, file_name: str, *, max_in_memory: int = PDF_MAX_IN_MEMORY_BYTES):
+    """拡張子に応じて、抽出処理（chunking.iter_pdf_pages / iter_csv_rows）にそのまま渡せる入力を返す。
+
+    戻り値はパス（str）・バイト列・バイナリストリームのいずれか。with を抜けるとストリームを閉じ、一時ファイルを消す。
+    """
+    suffix = os.path.splitext(file_name)[1].lower()
+    if not hasattr(blob, "open"):
+        with temporary_path(suffix=suffix) as path:
+            blob.download_to_filename(path)
+            yield path
+        return
+
+    with _open_stream(blob) as stream:
+        if suffix != ".pdf":
+            yield stream
+            return
+        # 上限 + 1 バイトまで読んで、収まればメモリ上で開く。超えたら残りも含めて一時ファイルへ書き出す
+        head = stream.read(max_in_memory + 1)
+        if len(head) <= max_in_memory:
+            yield head
+            return
+        # 先頭部分はここで書き込んで手放す（temporary_path に渡すと、その generator が最後まで参照を持ち続ける）
+        with temporary_path(suffix=suffix) as path:
+            with open(path, "wb") as f:
+                f.write(head)
+                del head
+                shutil.copyfileobj(stream, f, SOURCE_READ_CHUNK_BYTES)
+            yield path
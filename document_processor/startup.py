@@ -0,0 +1,89 @@
+"""コールドスタートの計測と、重い依存の遅延読み込み。
+
+- load("fitz") のように読み込むと、そのモジュールは初めて必要になった時点で import され、所要時間が記録される
+  （PDF を扱わないインスタンスは PyMuPDF を、CSV を扱わないインスタンスは pandas を読み込まない）
+- initializing("storage_client") で囲んだクライアント・モデルの初期化時間も記録する
+- main の読み込み時間（import_ms）と、初回リクエストの所要時間（first_request_ms）とその内訳を、
+  初回リクエストの終わりに 1 行の JSON ログ（event: "startup"）として出す
+
+このモジュールは main から最初に読み込まれるので、ここでの時刻が main の読み込み開始とみなせる。
+"""
+
+import contextlib
+import importlib
+import json
+import sys
+import threading
+import time
+
+_MODULE_STARTED = time.perf_counter()
+
+
+class StartupProfile:
+    """遅延 import・初期化・初回リクエストの所要時間をまとめる。
+
+    仕様:
+      - load は sys.modules にあればそれを返し、無ければ import して所要時間を lazy_imports に記録する
+      - request は初回の with ブロックだけ所要時間を記録し、report() を emit に渡す（2 回目以降は何もしない）
+    """
+
+    def __init__(self, *, started: float | None = None, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock() if started is None else started
+        self.import_sec: float | None = None
+        self.first_request_sec: float | None = None
+        self.lazy_imports: dict[str, float] = {}
+        self.initializations: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def imported(self) -> None:
+        """呼び出し元モジュールの読み込みが終わった時点を記録する。"""
+        self.import_sec = self.clock() - self.started
+
+    def load(self, module_name: str):
+        module = sys.modules.get(module_name)
+        if module is not None:
+            return module
+        start = self.clock()
+        module = importlib.import_module(module_name)
+        with self._lock:
+            self.lazy_imports.setdefault(module_name, self.clock() - start)
+        return module
+
+    @contextlib.contextmanager
+    def initializing(self, name: str):
+        start = self.clock()
+        yield
+        with self._lock:
+            self.initializations.setdefault(name, self.clock() - start)
+
+    @contextlib.contextmanager
+    def request(self, emit=None):
+        with self._lock:
+            first = self.first_request_sec is None
+            if first:
+                self.first_request_sec = 0.0  # 同時に来た 2 件目以降が初回として数えないよう先に印を付ける
+        start = self.clock()
+        try:
+            yield
+        finally:
+            if first:
+                self.first_request_sec = self.clock() - start
+                if emit is not None:
+                    emit(json.dumps({"event": "startup", **self.report()}, ensure_ascii=False))
+
+    def report(self) -> dict:
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000.0, 3)
+
+        with self._lock:
+            return {
+                "import_ms": ms(self.import_sec),
+                "first_request_ms": ms(self.first_request_sec),
+                "lazy_import_ms": {name: ms(sec) for name, sec in self.lazy_imports.items()},
+                "init_ms": {name: ms(sec) for name, sec in self.initializations.items()},
+            }
+
+
+# プロセス全体で共有する既定のインスタンス
+STARTUP = StartupProfile(started=_MODULE_STARTED)
@@ -0,0 +1,136 @@
+"""段階ごとのレイテンシ計測（軽量なスパン + ヒストグラム）。
+
+- span("download") で囲んだ区間の所要時間を、名前ごとの直近サンプルに記録する
+- trace("process_document") の中で記録したスパンは 1 回の処理の内訳として last_trace に残る
+- 各スパンとトレースの終わりに 1 行の JSON ログを出す（Cloud Logging が構造化ログとして取り込む）
+
+アプリ側（app/telemetry.py）にも同じ実装がある（Docker のビルドコンテキストが別のため）。
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+TELEMETRY_LOG = os.environ.get("TELEMETRY_LOG", "1") != "0"
+DEFAULT_MAX_SAMPLES = int(os.environ.get("TELEMETRY_MAX_SAMPLES", "2048"))
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("telemetry_trace", default=None)
+
+
+class Telemetry:
+    """名前付きスパンの所要時間を集計し、JSON ログとして出力する。
+
+    仕様:
+      - 名前ごとに直近 max_samples 件の所要時間を保持し、percentiles で p50 / p95 / p99 を返す
+      - trace の中（同じスレッド、または contextvars をコピーした先）で記録したスパンは、
+        trace 終了時に last_trace（名前・開始オフセット・所要時間の一覧）としてまとめる
+      - emit=None ならログを出さない（集計だけ行う）
+    """
+
+    def __init__(self, *, emit=print if TELEMETRY_LOG else None, max_samples: int = DEFAULT_MAX_SAMPLES, clock=time.perf_counter):
+        self.emit = emit
+        self.max_samples = max(1, int(max_samples))
+        self.clock = clock
+        self.last_trace: dict | None = None
+        self._samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def _log(self, record: dict) -> None:
+        if self.emit is not None:
+            self.emit(json.dumps(record, ensure_ascii=False, default=str))
+
+    def record(self, name: str, seconds: float, **attrs) -> None:
+        """計測済みの所要時間を記録する（span で囲めない区間用）。"""
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.max_samples)
+            samples.append(seconds)
+        trace = _current_trace.get()
+        entry = {"name": name, "duration_ms": round(seconds * 1000.0, 3), **attrs}
+        if trace is not None:
+            entry["offset_ms"] = round((self.clock() - seconds - trace["start"]) * 1000.0, 3)
+            with self._lock:
+                trace["spans"].append(entry)
+        self._log({"event": "span", "trace_id": trace["trace_id"] if trace else None, **entry})
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        """with ブロックの所要時間を name で記録する。例外が出た場合も記録し、error 属性を付ける。"""
+        start = self.clock()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, self.clock() - start, **attrs)
+
+    @contextlib.contextmanager
+    def trace(self, name: str, **attrs):
+        """1 リクエスト分のスパンをまとめる。終了時に合計と内訳を last_trace に保存してログに出す。"""
+        trace = {"trace_id": uuid.uuid4().hex, "name": name, "start": self.clock(), "spans": [], **attrs}
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            total = self.clock() - trace.pop("start")
+            trace["total_ms"] = round(total * 1000.0, 3)
+            self.last_trace = trace
+            self.record(name, total)
+            self._log({"event": "trace", **trace})
+
+    def timed(self, iterable) -> "TimedIterator":
+        return TimedIterator(iterable, self.clock)
+
+    def percentiles(self, name: str) -> dict:
+        with self._lock:
+            samples = np.array(self._samples.get(name, ()), dtype=np.float64) * 1000.0
+        if samples.size == 0:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {"count": int(samples.size), "p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3)}
+
+    def summary(self) -> dict[str, dict]:
+        """全スパン名のパーセンタイル。"""
+        with self._lock:
+            names = sorted(self._samples)
+        return {name: self.percentiles(name) for name in names}
+
+
+class TimedIterator:
+    """包んだイテレータの next() に掛かった時間の合計（seconds）を数える。
+
+    ジェネレータを連ねたパイプラインで、各段の正味の時間を測るために使う
+    （外側の段の時間は内側の段の時間を含むので、差を取ると外側だけの時間になる）。
+    """
+
+    def __init__(self, iterable, clock=time.perf_counter):
+        self._it = iter(iterable)
+        self._clock = clock
+        self.seconds = 0.0
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = self._clock()
+        try:
+            item = next(self._it)
+        finally:
+            self.seconds += self._clock() - start
+        self.count += 1
+        return item
+
+
+# プロセス全体で共有する既定のインスタンス
+TELEMETRY = Telemetry()
@@ -0,0 +1,132 @@
+# tests/unit/document_processor/test_backfill.py
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import document_processor.backfill as backfill
+import document_processor.main as main
+from document_processor.embedding import SharedEmbeddingModel
+from document_processor.local_storage import LocalStorageClient
+
+
+class RecordingEmbedder:
+    """送られたチャンクを記録し、fail_on を含むチャンクではエラーにする埋め込みフェイク。"""
+    def __init__(self, fail_on: str | None = None):
+        self.fail_on = fail_on
+        self.sent: list[str] = []
+        self._lock = threading.Lock()
+
+    def get_embeddings(self, texts):
+        if self.fail_on and any(self.fail_on in t for t in texts):
+            raise RuntimeError("boom")
+        with self._lock:
+            self.sent.extend(texts)
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def _seed(root, files: dict[str, str]) -> LocalStorageClient:
+    storage = LocalStorageClient(str(root))
+    for name, body in files.items():
+        storage.bucket("src").blob(name).upload_from_string(body)
+    return storage
+
+
+def _texts(storage, bucket: str, name: str) -> list[str]:
+    lines = storage.bucket(bucket).blob(f"{name}.jsonl").download_as_text().splitlines()
+    return [json.loads(line)["text_content"] for line in lines]
+
+
+def test_backfill_matches_process_document_output(tmp_path):
+    # GIVEN: 複数の CSV（1 つは行数が多くて複数チャンクになる）
+    rows = "".join(f"{i},品目{i}\n" for i in range(300))
+    storage = _seed(tmp_path / "gcs", {"a.csv": "id,name\n" + rows, "b.csv": "id,name\n1,x\n", "skip.txt": "対象外"})
+
+    # WHEN: プロセスプールで一括取り込みし、同じファイルを process_document でも処理
+    report = backfill.run_backfill(
+        "src", "out", RecordingEmbedder(), local_root=str(tmp_path / "gcs"), workers=1, reuse_embeddings=False
+    )
+    main.process_document(
+        {"bucket": "src", "name": "a.csv"}, None,
+        storage_client=storage, embedding_model=RecordingEmbedder(), output_bucket="single", reuse_embeddings=False,
+    )
+
+    # THEN: 対象の 2 件だけを処理し、チャンクはイベント駆動の処理と同じ
+    assert report["files"] == 2 and report["failed"] == [] and report["skipped"] == 0
+    assert report["chunks"] == len(_texts(storage, "out", "a.csv")) + 1
+    assert _texts(storage, "out", "a.csv") == _texts(storage, "single", "a.csv")
+    assert report["files_per_sec"] > 0 and report["chunks_per_sec"] > 0
+    assert storage.bucket("out").blob("a.csv.seg.npy").exists()
+
+
+def test_backfill_resumes_from_checkpoint(tmp_path):
+    # GIVEN: 3 ファイルのうち 1 つは埋め込みで失敗する
+    storage = _seed(tmp_path / "gcs", {"a.csv": "k\nok-a\n", "b.csv": "k\nNG\n", "c.csv": "k\nok-c\n"})
+    checkpoint = str(tmp_path / "backfill.jsonl")
+    kwargs = dict(local_root=str(tmp_path / "gcs"), workers=0, checkpoint_path=checkpoint, reuse_embeddings=False)
+
+    first = backfill.run_backfill("src", "out", RecordingEmbedder(fail_on="NG"), **kwargs)
+
+    # WHEN: 失敗の原因を取り除いて同じチェックポイントで再実行
+    retry = RecordingEmbedder()
+    second = backfill.run_backfill("src", "out", retry, **kwargs)
+
+    # THEN: 2 回目は失敗したファイルだけを処理する
+    assert first["files"] == 2 and first["failed"] == ["b.csv"]
+    assert second["files"] == 1 and second["skipped"] == 2
+    assert retry.sent == ["k\nNG"]
+
+    # WHEN: ソースを更新し、チャンクサイズは変えずに再実行 THEN: 更新したファイルだけをやり直す
+    storage.bucket("src").blob("c.csv").upload_from_string("k\nok-c2\n")
+    third = backfill.run_backfill("src", "out", RecordingEmbedder(), **kwargs)
+    assert third["files"] == 1 and _texts(storage, "out", "c.csv") == ["k\nok-c2"]
+
+    # WHEN: チャンクサイズを変えて再実行 THEN: 設定が変わったので全件やり直す
+    fourth = backfill.run_backfill("src", "out", RecordingEmbedder(), chunk_size=500, **kwargs)
+    assert fourth["files"] == 3 and fourth["skipped"] == 0
+
+
+def test_shared_embedding_model_caps_concurrent_calls():
+    # GIVEN: 同時呼び出し数を記録するモデル
+    active = peak = 0
+    lock = threading.Lock()
+
+    class SlowModel:
+        def get_embeddings(self, texts):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.01)
+            with lock:
+                active -= 1
+            return [[1.0] for _ in texts]
+
+    shared = SharedEmbeddingModel(SlowModel(), max_in_flight=2)
+
+    # WHEN: 8 スレッドから同時に呼ぶ
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: shared.get_embeddings([str(i)]), range(16)))
+
+    # THEN: 同時に走るのは 2 件まで
+    assert peak <= 2
+    assert shared.calls == 16 and shared.texts == 16
+
+
+def test_fake_embeddings_use_distinct_model_name(tmp_path):
+    # GIVEN: ローカルバケットの CSV
+    storage = _seed(tmp_path / "gcs", {"a.csv": "k\nv\n"})
+    checkpoint = tmp_path / "backfill.jsonl"
+
+    # WHEN: 擬似ベクトルで一括取り込み
+    code = backfill.main([
+        "--local-root", str(tmp_path / "gcs"), "--bucket", "src", "--output-bucket", "out",
+        "--checkpoint", str(checkpoint), "--workers", "0", "--fake-embeddings", "--dim", "4",
+    ])
+
+    # THEN: 出力もチェックポイントも本物のモデル名とは別の名前で記録され、本物の取り込みでは未完了扱い
+    assert code == 0
+    assert '"embedding_model": "fake-hash-4"' in storage.bucket("out").blob("a.csv.seg.meta").download_as_text()
+    real = backfill.config_key(chunk_size=1000, chunk_overlap=100, csv_streaming=main.CSV_STREAMING,
+                               embedding_model=main.EMBEDDING_MODEL_NAME, output_bucket="out")
+    assert not backfill.Checkpoint(str(checkpoint), real).done
@@ -0,0 +1,65 @@
+# tests/unit/document_processor/test_chunk_embedding_cache.py
+import document_processor.embedding_cache as embedding_cache
+import document_processor.segment as segment
+
+
+class FakeScheduler:
+    """embed_stream に渡されたテキストを記録し、[len(text), 1.0] を返すフェイク。"""
+    def __init__(self):
+        self.sent: list[str] = []
+
+    def embed_stream(self, texts):
+        texts = list(texts)
+        self.sent.extend(texts)
+        return texts, [[float(len(t)), 1.0] for t in texts]
+
+
+def test_content_hash_depends_on_text_and_model():
+    # GIVEN/WHEN/THEN: 本文かモデル名のどちらかが違えば別キー
+    h = embedding_cache.content_hash("本文", "model-a")
+    assert h == embedding_cache.content_hash("本文", "model-a")
+    assert h != embedding_cache.content_hash("本文", "model-b")
+    assert h != embedding_cache.content_hash("本文2", "model-a")
+
+
+def test_embed_stream_sends_only_misses_and_keeps_order():
+    # GIVEN: "a" だけを持つキャッシュ
+    cache = embedding_cache.ChunkEmbeddingCache("m", {embedding_cache.content_hash("a", "m"): [9.0, 9.0]})
+    scheduler = FakeScheduler()
+
+    # WHEN: "a", "bb", "a", "bb", "ccc" を流す
+    texts, vectors = cache.embed_stream(scheduler, iter(["a", "bb", "a", "bb", "ccc"]))
+
+    # THEN: API に送るのは未知かつ初出の本文だけで、結果は入力順
+    assert scheduler.sent == ["bb", "ccc"]
+    assert texts == ["a", "bb", "a", "bb", "ccc"]
+    assert vectors == [[9.0, 9.0], [2.0, 1.0], [9.0, 9.0], [2.0, 1.0], [3.0, 1.0]]
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_from_segment_requires_matching_model():
+    # GIVEN: model-a で作られたセグメント
+    vectors, meta = segment.encode_segment("doc", ["x", "y"], [[3.0, 4.0], [0.0, 2.0]], embedding_model="model-a")
+
+    # WHEN: 同じモデル / 別モデルで読み込む
+    same = embedding_cache.ChunkEmbeddingCache.from_segment("model-a", vectors, meta)
+    other = embedding_cache.ChunkEmbeddingCache.from_segment("model-b", vectors, meta)
+
+    # THEN: 同じモデルなら正規化済みベクトルが引け、別モデルなら空
+    assert same.get("x") == [0.6000000238418579, 0.800000011920929]
+    assert len(other) == 0
+
+
+def test_load_previous_embeddings_returns_empty_cache_when_missing():
+    # GIVEN: 何も無いバケット
+    class MissingBlob:
+        def download_as_bytes(self):
+            raise FileNotFoundError("not found")
+
+    class EmptyBucket:
+        def blob(self, name):
+            return MissingBlob()
+
+    # WHEN/THEN: 例外にならず空のキャッシュ
+    cache = embedding_cache.load_previous_embeddings(EmptyBucket(), "doc.pdf", "m")
+    assert len(cache) == 0
@@ -0,0 +1,96 @@
+# ページ単位のストリーミング抽出とインクリメンタルなチャンク化
+
+import tempfile
+
+from reportlab.pdfgen import canvas
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+import document_processor.chunking as chunking
+
+
+def _make_pdf(path, pages: list[str]) -> None:
+    c = canvas.Canvas(str(path))
+    for text in pages:
+        c.drawString(100, 750, text)
+        c.showPage()
+    c.save()
+
+
+def test_iter_pdf_pages_yields_numbered_pages_in_order(tmp_path):
+    """GIVEN: 3 ページの PDF / WHEN: iter_pdf_pages / THEN: 1 始まりのページ番号とそのページのテキストが順に返る"""
+    pdf = tmp_path / "three.pdf"
+    _make_pdf(pdf, ["Page one", "Page two", "Page three"])
+
+    pages = list(chunking.iter_pdf_pages(str(pdf)))
+
+    assert [n for n, _ in pages] == [1, 2, 3]
+    assert "Page two" in pages[1][1]
+
+
+def test_iter_pdf_pages_process_pool_keeps_page_order(tmp_path, monkeypatch):
+    """GIVEN: プールを使う閾値を下げる / WHEN: 2 ページずつワーカーで抽出 / THEN: 逐次抽出と同じ結果"""
+    pdf = tmp_path / "five.pdf"
+    _make_pdf(pdf, [f"Body {i}" for i in range(5)])
+    monkeypatch.setattr(chunking, "POOL_MIN_PAGES", 1)
+
+    pooled = list(chunking.iter_pdf_pages(str(pdf), workers=2, pages_per_task=2))
+
+    assert pooled == list(chunking.iter_pdf_pages(str(pdf), workers=0))
+
+
+def test_iter_pdf_pages_process_pool_accepts_bytes(tmp_path, monkeypatch):
+    """GIVEN: メモリ上の PDF / WHEN: ワーカーで抽出 / THEN: 一時ファイル経由で同じ結果になり、一時ファイルは残らない"""
+    pdf = tmp_path / "five.pdf"
+    _make_pdf(pdf, [f"Body {i}" for i in range(5)])
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    monkeypatch.setattr(chunking, "POOL_MIN_PAGES", 1)
+    monkeypatch.setattr(tempfile, "tempdir", str(scratch))
+
+    pooled = list(chunking.iter_pdf_pages(pdf.read_bytes(), workers=2, pages_per_task=2))
+
+    assert pooled == list(chunking.iter_pdf_pages(str(pdf), workers=0))
+    assert list(scratch.iterdir()) == []
+
+
+def test_iter_chunks_carries_overlap_across_page_boundaries():
+    """GIVEN: 小さな窓で多数のページを流す / WHEN: iter_chunks / THEN: 全単語を覆い、隣接チャンクが重なり、ページ番号が付く"""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=50, chunk_overlap=10)
+    pages = [(i + 1, " ".join(f"p{i}w{j}" for j in range(20)) + " ") for i in range(10)]
+
+    streamed = list(chunking.iter_chunks(pages, splitter, window_chars=200))
+    chunks = [c for c, _, _ in streamed]
+
+    assert all(len(c) <= 50 for c in chunks)
+    words = {w for c in chunks for w in c.split()}
+    assert words == {w for _, t in pages for w in t.split()}
+    # 窓の継ぎ目でもオーバーラップが保たれる（次のチャンクの先頭単語が前のチャンクに含まれる）
+    assert all(b.split()[0] in a.split() for a, b in zip(chunks, chunks[1:]))
+    # ページ境界を跨ぐチャンクは開始ページと終了ページが異なる
+    assert any(first != last for _, first, last in streamed)
+    for chunk, first, last in streamed:
+        assert chunk.split()[0].startswith(f"p{first - 1}w") and chunk.split()[-1].startswith(f"p{last - 1}w")
+
+
+def test_iter_chunks_keeps_window_bounded():
+    """GIVEN: 記録用スプリッタ / WHEN: 長い入力を流す / THEN: スプリッタに渡す窓は窓サイズ + 1 ページ分に収まる"""
+    seen: list[int] = []
+
+    class RecordingSplitter(RecursiveCharacterTextSplitter):
+        def split_text(self, text):
+            seen.append(len(text))
+            return super().split_text(text)
+
+    pages = [(i, "word " * 60) for i in range(200)]  # 1 ページ 300 文字、合計 60000 文字
+
+    chunks = list(chunking.iter_chunks(pages, RecordingSplitter(chunk_size=100, chunk_overlap=20), window_chars=1000))
+
+    assert len(chunks) > 100
+    assert max(seen) <= 1000 + 300 + 100
+
+
+def test_iter_chunks_skips_empty_pages_and_empty_input():
+    """GIVEN: 空ページのみ / WHEN: iter_chunks / THEN: 何も返さない"""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=50, chunk_overlap=10)
+
+    assert list(chunking.iter_chunks([(1, ""), (2, "")], splitter)) == []
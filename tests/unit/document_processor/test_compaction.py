@@ -0,0 +1,170 @@
+# tests/unit/document_processor/test_compaction.py
+import json
+
+import document_processor.compaction as compaction
+from document_processor.local_storage import LocalStorageClient
+from document_processor.segment import decode_segment, encode_segment, upload_segment
+
+
+def _put_document(bucket, name: str, texts: list[str], dim: int = 2) -> None:
+    embeddings = [[float(i + 1)] + [0.0] * (dim - 1) for i in range(len(texts))]
+    vectors, meta = encode_segment(name, texts, embeddings, columns={"chunk_id": list(range(len(texts)))})
+    upload_segment(bucket, name, vectors, meta)
+
+
+def _put_jsonl(bucket, name: str, texts: list[str]) -> None:
+    lines = [
+        json.dumps({"source_file": name, "chunk_id": i, "page_start": i + 1, "text_content": t, "embedding": [0.0, 1.0]})
+        for i, t in enumerate(texts)
+    ]
+    bucket.blob(f"{name}.jsonl").upload_from_string("\n".join(lines))
+
+
+def _compacted_rows(bucket) -> dict[str, list[str]]:
+    """CURRENT から辿れるドキュメント名 -> テキスト。"""
+    manifest = compaction.read_manifest(bucket)
+    rows = {}
+    for entry in manifest["segments"]:
+        _, texts, _ = decode_segment(
+            bucket.blob(entry["name"] + ".seg.npy").download_as_bytes(), bucket.blob(entry["name"] + ".seg.meta").download_as_bytes()
+        )
+        for doc in entry["documents"]:
+            rows[doc["document"]] = texts[doc["start"] : doc["stop"]]
+    return rows
+
+
+def _pending_level0(bucket) -> dict[str, dict]:
+    """manifest の superseded（削除待ち）を除いたレベル 0。"""
+    return compaction.list_level0(bucket, compaction.superseded_objects(compaction.read_manifest(bucket)))
+
+
+def test_compact_merges_level0_into_segment_and_retires_sources(tmp_path):
+    # GIVEN: セグメント形式と JSONL 形式のドキュメント
+    bucket = LocalStorageClient(str(tmp_path)).bucket("out")
+    _put_document(bucket, "a.pdf", ["A1", "A2"])
+    _put_jsonl(bucket, "b.csv", ["B1"])
+
+    # WHEN: コンパクション
+    stats = compaction.compact(bucket, target_rows=100)
+
+    # THEN: 1 セグメントにまとまり、CURRENT が新しい manifest を指す。レベル 0 は削除待ちとして記録され、すぐには消えない
+    assert stats["changed"] and stats["merged_documents"] == 2 and stats["new_segments"] == 1
+    assert _compacted_rows(bucket) == {"a.pdf": ["A1", "A2"], "b.csv": ["B1"]}
+    assert _pending_level0(bucket) == {}
+    assert bucket.blob("b.csv.jsonl").exists() and stats["deleted_objects"] == 0 and stats["pending_objects"] == 3
+    entry = compaction.read_manifest(bucket)["segments"][0]
+    header, _, matrix = decode_segment(
+        bucket.blob(entry["name"] + ".seg.npy").download_as_bytes(), bucket.blob(entry["name"] + ".seg.meta").download_as_bytes()
+    )
+    # 行ごとの列に出所が残り、片方にしか無い列は None で埋まる
+    assert header["columns"]["source_file"] == ["a.pdf", "a.pdf", "b.csv"]
+    assert header["columns"]["document"] == ["a.pdf", "a.pdf", "b.csv"]
+    assert header["columns"]["page_start"] == [None, None, 1]
+    assert matrix.shape == (3, 2)
+
+
+def test_compact_without_new_input_is_noop(tmp_path):
+    # GIVEN: コンパクション済みでレベル 0 が空
+    bucket = LocalStorageClient(str(tmp_path)).bucket("out")
+    _put_document(bucket, "a.pdf", ["A1"])
+    compaction.compact(bucket, target_rows=100)
+
+    # WHEN: もう一度実行
+    stats = compaction.compact(bucket, target_rows=100)
+
+    # THEN: 何も書き換えない（小さいセグメントが 1 つだけなら併合相手がいない）
+    assert not stats["changed"] and stats["seq"] == 1
+
+
+def test_tombstone_and_replacement_override_compacted_rows(tmp_path):
+    # GIVEN: a / b / c をコンパクション済み
+    bucket = LocalStorageClient(str(tmp_path)).bucket("out")
+    for name in ("a.pdf", "b.pdf", "c.pdf"):
+        _put_document(bucket, name, [name + "-old"])
+    compaction.compact(bucket, target_rows=100)
+    old_segment = compaction.read_manifest(bucket)["segments"][0]["name"]
+
+    # WHEN: a を削除、b を再アップロードしてからコンパクション
+    compaction.delete_document(bucket, "a.pdf")
+    _put_document(bucket, "b.pdf", ["b.pdf-new"])
+    stats = compaction.compact(bucket, target_rows=100, grace_seconds=0)
+
+    # THEN: a は消え、b は新しい版、c はそのまま。旧セグメントと tombstone は削除待ちとして残る
+    assert stats["tombstones"] == 1 and stats["rewritten_segments"] == 1
+    assert _compacted_rows(bucket) == {"b.pdf": ["b.pdf-new"], "c.pdf": ["c.pdf-old"]}
+    assert bucket.blob(old_segment + ".seg.npy").exists() and bucket.blob("a.pdf.tombstone").exists()
+    assert _pending_level0(bucket) == {}
+
+    # WHEN: 次のコンパクション（新しいドキュメントで manifest が切り替わる）
+    _put_document(bucket, "d.pdf", ["d.pdf-new"])
+    compaction.compact(bucket, target_rows=100, grace_seconds=0)
+
+    # THEN: 前回の削除待ち（旧セグメント・tombstone・旧 manifest）が片付く
+    assert not bucket.blob(old_segment + ".seg.npy").exists() and not bucket.blob("a.pdf.tombstone").exists()
+    assert [b.name for b in bucket.list_blobs("_segments/manifest-")] == [
+        "_segments/manifest-000002.json", "_segments/manifest-000003.json",
+    ]
+
+
+def test_superseded_objects_are_kept_until_grace_period_passes(tmp_path, monkeypatch):
+    # GIVEN: a をコンパクション済み（取り込んだ a は削除待ち）
+    bucket = LocalStorageClient(str(tmp_path)).bucket("out")
+    _put_document(bucket, "a.pdf", ["A"])
+    compaction.compact(bucket, target_rows=100, grace_seconds=60)
+    start = compaction.time.time()
+
+    # WHEN: 猶予内に次のコンパクション
+    _put_document(bucket, "b.pdf", ["B"])
+    stats = compaction.compact(bucket, target_rows=100, grace_seconds=60)
+
+    # THEN: 何も消さず、削除待ちは新しい manifest に引き継がれる
+    assert stats["deleted_objects"] == 0 and bucket.blob("a.pdf.seg.npy").exists()
+    assert ("a.pdf.seg.npy", bucket.blob("a.pdf.seg.npy").generation) in compaction.superseded_objects(compaction.read_manifest(bucket))
+
+    # WHEN: 猶予を過ぎてから次のコンパクション
+    monkeypatch.setattr(compaction.time, "time", lambda: start + 61)
+    _put_document(bucket, "c.pdf", ["C"])
+    compaction.compact(bucket, target_rows=100, grace_seconds=60)
+
+    # THEN: a のレベル 0 と最初の manifest が消え、内容は変わらない
+    assert not bucket.blob("a.pdf.seg.npy").exists() and not bucket.blob("_segments/manifest-000001.json").exists()
+    assert _compacted_rows(bucket) == {"a.pdf": ["A"], "b.pdf": ["B"], "c.pdf": ["C"]}
+
+
+def test_compact_splits_by_target_rows_without_splitting_documents(tmp_path):
+    # GIVEN: 3 行ずつのドキュメント 3 つ
+    bucket = LocalStorageClient(str(tmp_path)).bucket("out")
+    for d in range(3):
+        _put_document(bucket, f"d{d}.pdf", [f"d{d}-{i}" for i in range(3)])
+
+    # WHEN: 1 セグメント 5 行を目安にコンパクション
+    compaction.compact(bucket, target_rows=5)
+
+    # THEN: ドキュメントは分割されず、各セグメントは目安以下
+    segments = compaction.read_manifest(bucket)["segments"]
+    assert [s["rows"] for s in segments] == [3, 3, 3]
+    assert all(len(s["documents"]) == 1 for s in segments)
+
+
+def test_changed_level0_object_is_not_deleted(tmp_path, monkeypatch):
+    # GIVEN: 取り込み後・削除前に a が上書きされる
+    bucket = LocalStorageClient(str(tmp_path)).bucket("out")
+    _put_jsonl(bucket, "a.pdf", ["old"])
+    read_document = compaction.read_document
+
+    def read_then_overwrite(parts):
+        result = read_document(parts)
+        _put_jsonl(bucket, "a.pdf", ["new"])
+        return result
+
+    monkeypatch.setattr(compaction, "read_document", read_then_overwrite)
+
+    # WHEN: コンパクションを 2 回（2 回目で 1 回目に取り込んだ版の削除を試みる）
+    compaction.compact(bucket, target_rows=100, grace_seconds=0)
+    monkeypatch.setattr(compaction, "read_document", read_document)
+    assert "a.pdf" in _pending_level0(bucket)
+    compaction.compact(bucket, target_rows=100, grace_seconds=0)
+
+    # THEN: 上書き後のオブジェクトは消されず、2 回目の入力として取り込まれる
+    assert "new" in bucket.blob("a.pdf.jsonl").download_as_text()
+    assert _compacted_rows(bucket) == {"a.pdf": ["new"]}
@@ -0,0 +1,108 @@
+# tests/unit/document_processor/test_embedding.py
+import threading
+import time
+
+import pytest
+
+import document_processor.embedding as embedding
+
+
+class QuotaError(Exception):
+    """429 を表すフェイク例外（google.api_core が無くても code で判定される）。"""
+    code = 429
+
+
+class RecordingEmbedder:
+    """呼び出しを記録し、[len(text)] を返すフェイク。fail_first 回だけ QuotaError を投げる。"""
+    def __init__(self, fail_first: int = 0, delay: float = 0.0):
+        self.fail_first = fail_first
+        self.delay = delay
+        self.batches: list[list[str]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get_embeddings(self, batch: list[str]):
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                raise QuotaError("quota exceeded")
+            self.batches.append(list(batch))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        return [[float(len(t))] for t in batch]
+
+
+def test_plan_batches_respects_count_and_char_budget():
+    # GIVEN: 文字数 3,3,3,10,1 のテキストと 件数<=2 / 文字数<=6 の予算
+    texts = ["aaa", "bbb", "ccc", "x" * 10, "d"]
+
+    # WHEN: バッチ計画
+    batches = embedding.plan_batches(texts, max_batch_size=2, max_batch_chars=6)
+
+    # THEN: 予算内でまとめ、予算を超える 1 件は単独バッチ
+    assert batches == [(0, 2), (2, 3), (3, 4), (4, 5)]
+
+
+def test_embed_preserves_order_with_concurrency():
+    # GIVEN: 並列 3 / 1 バッチ 2 件のスケジューラ
+    embedder = RecordingEmbedder(delay=0.01)
+    scheduler = embedding.EmbeddingScheduler(embedder, max_in_flight=3, max_batch_size=2, max_batch_chars=1000)
+    texts = ["x" * i for i in range(1, 21)]
+
+    # WHEN: 埋め込み
+    result = scheduler.embed(texts)
+
+    # THEN: 入力順どおり、同時実行数は上限以内で実際に並列化されている
+    assert result == [[float(i)] for i in range(1, 21)]
+    assert 1 < embedder.max_in_flight <= 3
+
+
+def test_embed_retries_quota_errors_with_backoff():
+    # GIVEN: 最初の 2 回は 429 を返す埋め込みモデル
+    embedder = RecordingEmbedder(fail_first=2)
+    sleeps: list[float] = []
+    scheduler = embedding.EmbeddingScheduler(embedder, max_in_flight=1, base_delay=1.0, sleep=sleeps.append)
+
+    # WHEN: 埋め込み
+    result = scheduler.embed(["a", "bb"])
+
+    # THEN: 再試行で成功し、待ち時間は指数的に伸びる（ジッタ込みで 0.5x〜1x）
+    assert result == [[1.0], [2.0]]
+    assert scheduler.retries == 2
+    assert 0.5 <= sleeps[0] <= 1.0 and 1.0 <= sleeps[1] <= 2.0
+
+
+def test_embed_does_not_retry_other_errors():
+    # GIVEN/WHEN/THEN: クォータ以外の例外は再試行せずにそのまま送出
+    class Broken:
+        def get_embeddings(self, batch):
+            raise RuntimeError("boom")
+
+    scheduler = embedding.EmbeddingScheduler(Broken(), sleep=lambda s: None)
+    with pytest.raises(RuntimeError):
+        scheduler.embed(["a"])
+
+
+def test_embed_stream_sends_batches_while_input_is_produced():
+    # GIVEN: 1 件ずつ生成するジェネレータ（生成のたびに、それまでに送られたバッチ数を記録）
+    embedder = RecordingEmbedder()
+    scheduler = embedding.EmbeddingScheduler(embedder, max_in_flight=2, max_batch_size=2, max_batch_chars=1000)
+    sent_before: list[int] = []
+
+    def produce():
+        for i in range(1, 9):
+            time.sleep(0.005)
+            sent_before.append(len(embedder.batches))
+            yield "x" * i
+
+    # WHEN: ストリーム埋め込み
+    texts, result = scheduler.embed_stream(produce())
+
+    # THEN: 入力順で返り、最後の入力を生成する前に既にバッチが送られている
+    assert texts == ["x" * i for i in range(1, 9)]
+    assert result == [[float(i)] for i in range(1, 9)]
+    assert sent_before[-1] > 0
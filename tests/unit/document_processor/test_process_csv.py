@@ -1,6 +1,7 @@
 # 純粋関数の正常系だけ確認（依存不要）
 
 import pandas as pd
+import document_processor.chunking as chunking
 import document_processor.main as main
 
 def test_process_csv_reads_text(tmp_path):
@@ -14,4 +15,28 @@ def test_process_csv_reads_text(tmp_path):
     # THEN: ヘッダ/値が壊れず含まれる
     assert "col1" in text and "num" in text
     assert "A" in text and "B" in text
-    assert "1" in text and "2" in text
\ No newline at end of file
+    assert "1" in text and "2" in text
+
+def test_iter_csv_chunks_reads_in_pieces_and_keeps_rows_intact(tmp_path):
+    # GIVEN: 区切り文字・改行を含む値と空欄を持つ CSV（読み込みは 2 行ずつ）
+    p = tmp_path / "quoted.csv"
+    pd.DataFrame(
+        {"name": ["a,b", "line1\nline2", "plain", ""], "code": ["007", "x", "y", "z"]}
+    ).to_csv(p, index=False)
+
+    # WHEN: 1 チャンクあたり最大 20 文字でチャンク化
+    chunks = list(chunking.iter_csv_chunks(str(p), max_chars=20, read_rows=2))
+
+    # THEN: 行範囲は 1..4 を覆い、値は文字列のまま（先頭 0 や空欄も保持）引用符付きで直列化される
+    assert chunks[0][1] == 1 and chunks[-1][2] == 4
+    text = "\n".join(c for c, _, _ in chunks)
+    assert '"a,b",007' in text
+    assert '"line1\nline2",x' in text
+    assert all(c.startswith("name,code\n") for c, _, _ in chunks)
+
+
+def test_process_csv_handles_empty_file(tmp_path):
+    # GIVEN/WHEN/THEN: 空ファイルは空文字列
+    p = tmp_path / "empty.csv"
+    p.write_text("", encoding="utf-8")
+    assert main.process_csv(str(p)) == ""
@@ -6,6 +6,7 @@ from __future__ import annotations
 import json
 from pathlib import Path
 import pytest
+from reportlab.pdfgen import canvas
 import document_processor.main as main
 
 # =========================
@@ -27,6 +28,13 @@ class FakeBlob:
         data = Path(src_path).read_bytes()
         Path(dst_path).write_bytes(data)
 
+    def download_as_bytes(self) -> bytes:
+        obj = self.client._uploaded_objects.get((self.bucket, self.name))
+        if obj is None:
+            raise FileNotFoundError(f"未作成: {(self.bucket, self.name)}")
+        data = obj["data"]
+        return data.encode("utf-8") if isinstance(data, str) else data
+
     def upload_from_string(self, data: str, content_type: str = "application/octet-stream") -> None:
         self.client._uploaded_objects[(self.bucket, self.name)] = {
             "content_type": content_type,
@@ -69,8 +77,12 @@ class ConstantSplitter:
 
 
 class FakeEmbedder:
-    """get_embeddings(chunks) -> list[list[float]] を返すだけのフェイク。"""
+    """get_embeddings(chunks) -> list[list[float]] を返すだけのフェイク。送られたチャンクを記録する。"""
+    def __init__(self):
+        self.sent: list[str] = []
+
     def get_embeddings(self, chunks: list[str]) -> list[list[float]]:
+        self.sent.extend(chunks)
         # 各チャンクに対して [len(chunk), 0.0] のような簡単なベクトルを返す
         return [[float(len(c)), 0.0] for c in chunks]
 
@@ -110,6 +122,7 @@ def test_process_document_csv_to_jsonl(tmp_path: Path):
         region="us-central1",
         output_bucket=out_bucket,
         batch_size=25,  # バッチは埋め込み呼び出し単位にだけ効く（出力は1ファイル）
+        csv_streaming=False,  # 全文をスプリッタで分割する経路（行単位の経路は別テスト）
     )
 
     # THEN: 出力は out-bkt に "big.csv.jsonl" が1つ、60行のJSONL
@@ -123,6 +136,108 @@ def test_process_document_csv_to_jsonl(tmp_path: Path):
     rec0 = json.loads(lines[0])
     assert set(["source_file", "chunk_id", "text_content", "embedding"]).issubset(rec0.keys())
 
+    # 列指向セグメント（行列 + メタ）も併せて出力される
+    assert (out_bucket, "big.csv.seg.npy") in storage._uploaded_objects
+    assert (out_bucket, "big.csv.seg.meta") in storage._uploaded_objects
+
+
+def test_process_document_csv_streaming_chunks_on_row_boundaries(tmp_path: Path):
+    """CSV ストリーミング: 行境界でチャンク化し、各チャンクにヘッダと row_start / row_end を付ける。"""
+    # GIVEN: 100 行の CSV と、1 チャンク 200 文字の目安
+    csv_path = tmp_path / "rows.csv"
+    csv_path.write_text("id,name\n" + "".join(f"{i},name-{i}\n" for i in range(1, 101)), encoding="utf-8")
+    storage = MemoryStorageClient()
+    storage.seed_source_file("src", "rows.csv", str(csv_path))
+
+    # WHEN: ストリーミングモードで実行
+    main.process_document(
+        {"bucket": "src", "name": "rows.csv"},
+        context=None,
+        storage_client=storage,
+        embedding_model=FakeEmbedder(),
+        output_bucket="out",
+        csv_streaming=True,
+        csv_chunk_chars=200,
+    )
+
+    # THEN: 行範囲は 1..100 を隙間なく覆い、各チャンクはヘッダで始まって範囲内の行をそのまま含む
+    records = [json.loads(ln) for ln in storage._uploaded_objects[("out", "rows.csv.jsonl")]["data"].splitlines()]
+    assert len(records) > 1
+    assert records[0]["row_start"] == 1 and records[-1]["row_end"] == 100
+    for prev, cur in zip(records, records[1:]):
+        assert cur["row_start"] == prev["row_end"] + 1
+    for r in records:
+        lines = r["text_content"].split("\n")
+        assert lines[0] == "id,name"
+        assert lines[1:] == [f"{i},name-{i}" for i in range(r["row_start"], r["row_end"] + 1)]
+
+
+def test_process_document_reupload_embeds_only_changed_chunks(tmp_path: Path):
+    """再アップロード: 前回のセグメントと本文が同じチャンクは再利用し、変わったチャンクだけを埋め込む。"""
+    # GIVEN: 3 行ずつのチャンクになる CSV を一度処理済み
+    csv_path = tmp_path / "weekly.csv"
+    rows = [f"{i},value-{i}" for i in range(1, 10)]
+    csv_path.write_text("id,value\n" + "\n".join(rows) + "\n", encoding="utf-8")
+    storage = MemoryStorageClient()
+    storage.seed_source_file("src", "weekly.csv", str(csv_path))
+    kwargs = dict(
+        context=None,
+        storage_client=storage,
+        output_bucket="out",
+        csv_streaming=True,
+        csv_chunk_chars=30,
+    )
+    first = FakeEmbedder()
+    main.process_document({"bucket": "src", "name": "weekly.csv"}, embedding_model=first, **kwargs)
+    first_records = storage._uploaded_objects[("out", "weekly.csv.jsonl")]["data"].splitlines()
+
+    # WHEN: 最後の 1 行だけ変えて再処理
+    rows[-1] = "9,edited"
+    csv_path.write_text("id,value\n" + "\n".join(rows) + "\n", encoding="utf-8")
+    second = FakeEmbedder()
+    main.process_document({"bucket": "src", "name": "weekly.csv"}, embedding_model=second, **kwargs)
+
+    # THEN: 2 回目に API へ送られるのは変更を含むチャンクだけで、出力のチャンク数は変わらない
+    records = [json.loads(ln) for ln in storage._uploaded_objects[("out", "weekly.csv.jsonl")]["data"].splitlines()]
+    assert len(records) == len(first_records) > 1
+    assert second.sent == [records[-1]["text_content"]]
+    assert "9,edited" in second.sent[0]
+
+
+def test_process_document_records_stage_spans(tmp_path: Path):
+    """計測: 1 回の処理がトレースになり、ダウンロード〜アップロードの各段階と埋め込みバッチが記録される。"""
+    from document_processor.telemetry import Telemetry
+
+    # GIVEN: 3 ページの PDF と、ログを出さない計測器
+    pdf_path = tmp_path / "traced.pdf"
+    c = canvas.Canvas(str(pdf_path))
+    for i in range(3):
+        c.drawString(100, 750, f"Page {i + 1} body text")
+        c.showPage()
+    c.save()
+    storage = MemoryStorageClient()
+    storage.seed_source_file("src", "traced.pdf", str(pdf_path))
+    telemetry = Telemetry(emit=None)
+
+    # WHEN: 実行
+    main.process_document(
+        {"bucket": "src", "name": "traced.pdf"},
+        context=None,
+        storage_client=storage,
+        splitter=main.build_text_splitter(chunk_size=20, chunk_overlap=5),
+        embedding_model=FakeEmbedder(),
+        output_bucket="out",
+        batch_size=2,
+        telemetry=telemetry,
+    )
+
+    # THEN: 段階ごとのスパン（ワーカースレッドの埋め込みバッチを含む）がトレースに入る
+    names = [s["name"] for s in telemetry.last_trace["spans"]]
+    for stage in ("download", "extract", "chunk", "embed", "serialize", "upload", "embed_batch"):
+        assert stage in names
+    assert telemetry.last_trace["source_file"] == "traced.pdf"
+    assert telemetry.percentiles("process_document")["count"] == 1
+
 
 def test_process_document_unsupported_ext_returns(tmp_path: Path):
     """未サポート拡張子: 例外を投げずに return する（安全側の早期終了）。"""
@@ -150,4 +265,36 @@ def test_process_document_unsupported_ext_returns(tmp_path: Path):
         region="us-central1",
         output_bucket="out",
     )
-    assert ("out", "note.txt.jsonl") not in storage._uploaded_objects
\ No newline at end of file
+    assert ("out", "note.txt.jsonl") not in storage._uploaded_objects
+
+def test_process_document_pdf_records_page_metadata(tmp_path: Path):
+    """PDF: ページ単位で抽出・チャンク化し、各チャンクに page_start / page_end を付けて出力する。"""
+    # GIVEN: 3 ページの PDF と、実スプリッタ・埋め込みフェイク・メモリStorage
+    src_name = "doc.pdf"
+    pdf_path = tmp_path / src_name
+    c = canvas.Canvas(str(pdf_path))
+    for i in range(3):
+        c.drawString(100, 750, f"Page {i + 1} body text")
+        c.showPage()
+    c.save()
+
+    storage = MemoryStorageClient()
+    storage.seed_source_file("src", src_name, str(pdf_path))
+
+    # WHEN: 小さなチャンクサイズで実行
+    main.process_document(
+        {"bucket": "src", "name": src_name},
+        context=None,
+        storage_client=storage,
+        splitter=main.build_text_splitter(chunk_size=20, chunk_overlap=5),
+        embedding_model=FakeEmbedder(),
+        output_bucket="out",
+    )
+
+    # THEN: 各行にページ番号が付き、先頭は 1 ページ目・末尾は 3 ページ目
+    lines = storage._uploaded_objects[("out", "doc.pdf.jsonl")]["data"].splitlines()
+    records = [json.loads(ln) for ln in lines]
+    assert records[0]["page_start"] == 1
+    assert records[-1]["page_end"] == 3
+    assert all(r["page_start"] <= r["page_end"] for r in records)
+    assert ("out", "doc.pdf.seg.meta") in storage._uploaded_objects
@@ -0,0 +1,71 @@
+# tests/unit/document_processor/test_segment.py
+import io
+import json
+
+import numpy as np
+import pytest
+
+import document_processor.segment as segment
+
+
+def test_encode_segment_writes_normalized_float32_and_offsets():
+    # GIVEN: 日本語を含むテキストと未正規化の埋め込み
+    texts = ["税・控除🧾", "abc"]
+    vectors, meta = segment.encode_segment("a.pdf", texts, [[3.0, 4.0], [np.nan, 2.0]], columns={"chunk_id": [0, 1]})
+
+    # WHEN: 行列とヘッダを読み戻す
+    matrix = np.load(io.BytesIO(vectors))
+    header_line, blob = meta.split(b"\n", 1)
+    header = json.loads(header_line)
+
+    # THEN: float32 で正規化済み、オフセットで元のテキストが取り出せる
+    assert matrix.dtype == np.float32
+    assert np.allclose(matrix, [[0.6, 0.8], [0.0, 1.0]])
+    assert header["count"] == 2 and header["dim"] == 2 and header["source_file"] == "a.pdf"
+    offs = header["text_offsets"]
+    assert [blob[offs[i] : offs[i + 1]].decode("utf-8") for i in range(2)] == texts
+    assert header["columns"] == {"chunk_id": [0, 1]}
+
+
+def test_encode_segment_mismatched_rows_raises():
+    # GIVEN/WHEN/THEN: テキスト数と行数が不一致なら ValueError
+    with pytest.raises(ValueError):
+        segment.encode_segment("a.pdf", ["x"], [[1.0], [2.0]])
+
+
+def test_jsonl_to_segment_keeps_source_and_chunk_ids():
+    # GIVEN: process_document 形式の JSONL
+    lines = [
+        json.dumps({"source_file": "b.csv", "chunk_id": i, "text_content": f"T{i}", "embedding": [1.0, float(i)]})
+        for i in range(3)
+    ]
+
+    # WHEN: 変換
+    _, meta = segment.jsonl_to_segment("\n".join(lines))
+    header = json.loads(meta.split(b"\n", 1)[0])
+
+    # THEN: ソース名とチャンクIDが列として保持される
+    assert header["source_file"] == "b.csv"
+    assert header["columns"]["chunk_id"] == [0, 1, 2]
+
+
+def test_jsonl_to_segment_round_trips_location_columns_and_model():
+    # GIVEN: ページ範囲付きの PDF と、行範囲付きの CSV の JSONL
+    pdf = [
+        json.dumps({"source_file": "a.pdf", "chunk_id": i, "page_start": i + 1, "page_end": i + 2,
+                    "text_content": f"P{i}", "embedding": [1.0, float(i)]})
+        for i in range(2)
+    ]
+    csv = [json.dumps({"source_file": "b.csv", "chunk_id": 0, "row_start": 1, "row_end": 5,
+                       "text_content": "R", "embedding": [0.0, 1.0]})]
+
+    # WHEN: 変換して読み戻す
+    header, texts, _ = segment.decode_segment(*segment.jsonl_to_segment("\n".join(pdf), embedding_model="m-1"))
+    csv_header, _, _ = segment.decode_segment(*segment.jsonl_to_segment("\n".join(csv)))
+
+    # THEN: 出所の列と埋め込みモデル名が残り、本文・埋め込み・ソース名は列にならない
+    assert texts == ["P0", "P1"]
+    assert header["columns"] == {"chunk_id": [0, 1], "page_start": [1, 2], "page_end": [2, 3]}
+    assert header["embedding_model"] == "m-1"
+    assert csv_header["columns"] == {"chunk_id": [0], "row_end": [5], "row_start": [1]}
+    assert "embedding_model" not in csv_header
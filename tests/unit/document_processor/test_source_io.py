@@ -0,0 +1,153 @@
+# tests/unit/document_processor/test_source_io.py
+import tempfile
+from pathlib import Path
+
+import pytest
+from reportlab.pdfgen import canvas
+
+import document_processor.chunking as chunking
+import document_processor.main as main
+from document_processor.local_storage import LocalStorageClient
+from document_processor.source_io import open_source
+
+
+@pytest.fixture
+def scratch(tmp_path, monkeypatch):
+    """一時ファイルの置き場所をテスト用ディレクトリにし、残ったファイルを検査できるようにする。"""
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(scratch))
+    return scratch
+
+
+def _pdf_bytes(tmp_path, pages: list[str]) -> bytes:
+    path = tmp_path / "src.pdf"
+    c = canvas.Canvas(str(path))
+    for text in pages:
+        c.drawString(100, 750, text)
+        c.showPage()
+    c.save()
+    return path.read_bytes()
+
+
+def test_csv_is_streamed_without_temp_file(tmp_path, scratch):
+    # GIVEN: ローカルバケット上の CSV
+    bucket = LocalStorageClient(str(tmp_path / "gcs")).bucket("src")
+    bucket.blob("a.csv").upload_from_string("name,qty\nりんご,3\nみかん,5\n")
+
+    # WHEN: ソースとして開き、行単位のチャンクにする
+    with open_source(bucket.blob("a.csv"), "a.csv") as source:
+        assert not isinstance(source, (str, bytes))
+        chunks = list(chunking.iter_csv_chunks(source, max_chars=100))
+
+    # THEN: ストリームから読め、一時ファイルは作られない
+    assert chunks == [("name,qty\nりんご,3\nみかん,5", 1, 2)]
+    assert list(scratch.iterdir()) == []
+
+
+def test_small_pdf_is_opened_from_memory(tmp_path, scratch):
+    # GIVEN: 上限以下の PDF
+    bucket = LocalStorageClient(str(tmp_path / "gcs")).bucket("src")
+    bucket.blob("a.pdf").upload_from_string(_pdf_bytes(tmp_path, ["Page one", "Page two"]))
+
+    # WHEN: ソースとして開く
+    with open_source(bucket.blob("a.pdf"), "a.pdf") as source:
+        pages = list(chunking.iter_pdf_pages(source))
+
+    # THEN: バイト列のまま抽出できる
+    assert isinstance(source, bytes)
+    assert [n for n, _ in pages] == [1, 2] and "Page two" in pages[1][1]
+    assert list(scratch.iterdir()) == []
+
+
+def test_large_pdf_spills_to_unique_temp_file_and_is_removed(tmp_path, scratch):
+    # GIVEN: メモリ上限を超える PDF
+    data = _pdf_bytes(tmp_path, ["Big"])
+    bucket = LocalStorageClient(str(tmp_path / "gcs")).bucket("src")
+    bucket.blob("dir/a.pdf").upload_from_string(data)
+
+    # WHEN: 上限を小さくして同じ名前のオブジェクトを同時に開く
+    with open_source(bucket.blob("dir/a.pdf"), "dir/a.pdf", max_in_memory=16) as first, \
+            open_source(bucket.blob("dir/a.pdf"), "dir/a.pdf", max_in_memory=16) as second:
+        # THEN: それぞれ別の一時ファイルに全体が書き出される
+        assert first != second
+        assert Path(first).read_bytes() == data == Path(second).read_bytes()
+
+    # THEN: with を抜けると消える
+    assert list(scratch.iterdir()) == []
+
+
+def test_blob_without_stream_falls_back_to_temp_file(tmp_path, scratch):
+    # GIVEN: download_to_filename しか持たないクライアント
+    class DownloadOnlyBlob:
+        def download_to_filename(self, path):
+            Path(path).write_text("a\n1\n", encoding="utf-8")
+
+    # WHEN / THEN: 一時ファイルのパスが渡され、抜けると消える
+    with open_source(DownloadOnlyBlob(), "x.csv") as source:
+        assert Path(source).parent == scratch
+        assert main.process_csv(source) == "a\n1"
+    assert list(scratch.iterdir()) == []
+
+
+def test_process_document_leaves_no_temp_files(tmp_path, scratch):
+    # GIVEN: ローカルストレージ上の PDF と CSV
+    storage = LocalStorageClient(str(tmp_path / "gcs"))
+    storage.bucket("src").blob("a.pdf").upload_from_string(_pdf_bytes(tmp_path, ["Hello PDF"]))
+    storage.bucket("src").blob("b.csv").upload_from_string("k,v\nx,1\n")
+
+    class Embedder:
+        def get_embeddings(self, texts):
+            return [[1.0, 0.0] for _ in texts]
+
+    # WHEN: 両方を処理
+    for name in ("a.pdf", "b.csv"):
+        main.process_document(
+            {"bucket": "src", "name": name}, None,
+            storage_client=storage, embedding_model=Embedder(), output_bucket="out", reuse_embeddings=False,
+        )
+
+    # THEN: 出力はあり、一時ファイルは残らない
+    assert storage.bucket("out").blob("a.pdf.seg.npy").exists()
+    assert storage.bucket("out").blob("b.csv.seg.npy").exists()
+    assert list(scratch.iterdir()) == []
+
+
+def test_large_pdf_prefix_is_released_before_yield(tmp_path, scratch):
+    # GIVEN: メモリ上限を超える PDF
+    import gc
+    import weakref
+
+    bucket = LocalStorageClient(str(tmp_path / "gcs")).bucket("src")
+    bucket.blob("a.pdf").upload_from_string(_pdf_bytes(tmp_path, ["Big"]))
+    refs = []
+
+    class Buffer(bytearray):
+        """弱参照を作れる bytearray。"""
+
+    class TrackedStream:
+        """read の戻り値を弱参照で追跡できるストリーム。"""
+        def __init__(self, raw):
+            self.raw = raw
+
+        def read(self, n=-1):
+            data = Buffer(self.raw.read(n))
+            refs.append(weakref.ref(data))
+            return data
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.raw.close()
+
+    class TrackedBlob:
+        def open(self, mode="rb"):
+            return TrackedStream(bucket.blob("a.pdf").open("rb"))
+
+    # WHEN: 一時ファイルへ書き出したパスを受け取った時点で
+    with open_source(TrackedBlob(), "a.pdf", max_in_memory=16) as path:
+        gc.collect()
+        # THEN: 上限分の先頭バッファはもう参照されていない
+        assert refs[0]() is None
+        assert Path(path).read_bytes() == bucket.blob("a.pdf").download_as_bytes()
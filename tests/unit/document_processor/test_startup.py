@@ -0,0 +1,73 @@
+# tests/unit/document_processor/test_startup.py
+import json
+import subprocess
+import sys
+import types
+from pathlib import Path
+
+import document_processor.main as main
+from document_processor.startup import StartupProfile
+
+ROOT = Path(__file__).resolve().parents[3]
+
+
+def test_importing_main_does_not_load_heavy_dependencies():
+    # GIVEN: 新しいプロセス
+    heavy = ["fitz", "pandas", "langchain_text_splitters", "google.cloud.storage", "google.cloud.aiplatform", "vertexai"]
+    script = f"import sys, json; import document_processor.main; print(json.dumps([m for m in {heavy!r} if m in sys.modules]))"
+
+    # WHEN: main を読み込むだけ
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True, cwd=ROOT)
+
+    # THEN: 形式ごとのライブラリも GCP クライアントも読み込まれていない
+    assert json.loads(out.stdout.strip().splitlines()[-1]) == []
+
+
+def test_startup_profile_reports_first_request_once():
+    # GIVEN: 1 秒ずつ進む時計
+    ticks = iter(range(100))
+    profile = StartupProfile(started=-1.0, clock=lambda: float(next(ticks)))
+    profile.imported()
+    logs: list[str] = []
+
+    # WHEN: 遅延 import を含むリクエストを 2 回
+    with profile.request(emit=logs.append):
+        assert profile.load("json") is json  # 読み込み済みなら記録しない
+        with profile.initializing("client"):
+            pass
+    with profile.request(emit=logs.append):
+        pass
+
+    # THEN: 初回の分だけ 1 行の JSON ログになる
+    assert len(logs) == 1
+    record = json.loads(logs[0])
+    assert record["event"] == "startup" and record["import_ms"] == 1000.0
+    assert record["init_ms"] == {"client": 1000.0} and record["lazy_import_ms"] == {}
+    assert record["first_request_ms"] == 3000.0
+
+
+def test_embedding_model_is_initialized_once_per_instance(monkeypatch):
+    # GIVEN: Vertex AI の代わりに初期化回数を数えるフェイク
+    calls = {"init": 0, "from_pretrained": 0}
+
+    def init(**kwargs):
+        calls["init"] += 1
+
+    def from_pretrained(name):
+        calls["from_pretrained"] += 1
+        return object()
+
+    fakes = {
+        "google.cloud.aiplatform": types.SimpleNamespace(init=init),
+        "vertexai.language_models": types.SimpleNamespace(TextEmbeddingModel=types.SimpleNamespace(from_pretrained=from_pretrained)),
+    }
+    monkeypatch.setattr(main, "_RESOURCES", {})
+    monkeypatch.setattr(main.STARTUP, "load", fakes.__getitem__)
+
+    # WHEN: 同じ設定で 2 回取得
+    first = main.get_embedding_model("proj", "us-central1", "m")
+    second = main.get_embedding_model("proj", "us-central1", "m")
+
+    # THEN: 初期化は 1 回だけで、同じインスタンスが返る
+    assert first is second
+    assert calls == {"init": 1, "from_pretrained": 1}
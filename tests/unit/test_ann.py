@@ -0,0 +1,74 @@
+# tests/unit/test_ann.py
+
+import numpy as np
+import pytest
+from app.ann import IVFIndex, recall_at_k
+from app.vector_index import VectorIndex
+
+
+def _clustered_index(n_clusters=8, per_cluster=50, dim=16, seed=0):
+    """クラスタ構造を持つランダムなコーパス（各クラスタ中心のまわりに点をばらまく）。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    points = np.repeat(centers, per_cluster, axis=0) + 0.1 * rng.normal(size=(n_clusters * per_cluster, dim))
+    return VectorIndex(points, [str(i) for i in range(len(points))]), rng
+
+
+# GIVEN/WHEN/THEN: 全リストを調べれば厳密検索と完全に一致する
+def test_full_probe_matches_exact_search():
+    """GIVEN nlist=8 の IVF。WHEN nprobe=8（全リスト）。THEN recall@5 = 1.0。"""
+    index, rng = _clustered_index()
+    ivf = IVFIndex.train(index, nlist=8, nprobe=8)
+
+    assert recall_at_k(ivf, index, rng.normal(size=(10, 16)), k=5) == 1.0
+
+
+# GIVEN/WHEN/THEN: クラスタ構造があれば少数のリストでも高い再現率
+def test_small_nprobe_keeps_high_recall_on_clustered_data():
+    """GIVEN クラスタ上のクエリ。WHEN nprobe=2。THEN recall@5 >= 0.9。"""
+    index, rng = _clustered_index()
+    ivf = IVFIndex.train(index, nlist=8, nprobe=2)
+    queries = index.matrix[rng.choice(len(index), 20, replace=False)]
+
+    assert recall_at_k(ivf, index, queries, k=5) >= 0.9
+
+
+# GIVEN/WHEN/THEN: 保存物から復元すると再学習なしで同じ結果になる
+def test_round_trip_reuses_assignments_when_fingerprint_matches():
+    """GIVEN 学習済み IVF。WHEN to_bytes → from_bytes（同じ fingerprint）。THEN 割り当てと結果が一致。"""
+    index, rng = _clustered_index()
+    ivf = IVFIndex.train(index, nlist=8, nprobe=3)
+
+    restored = IVFIndex.from_bytes(ivf.to_bytes("fp-1"), index, fingerprint="fp-1")
+
+    assert np.array_equal(restored.labels, ivf.labels)
+    assert restored.nprobe == 3
+    q = rng.normal(size=16)
+    assert list(restored.search(q, 5)[0]) == list(ivf.search(q, 5)[0])
+
+
+# GIVEN/WHEN/THEN: 学習後に追加/削除された行も反映される
+def test_appended_and_removed_rows_are_respected():
+    """GIVEN 学習済み IVF。WHEN 行を追加し、別の行を削除。THEN 追加行は見つかり、削除行は出ない。"""
+    index, _ = _clustered_index()
+    ivf = IVFIndex.train(index, nlist=8, nprobe=8)
+    new_vec = np.zeros((1, 16), dtype=np.float32)
+    new_vec[0, 0] = 1.0
+
+    (new_row,) = index.append(new_vec, ["new"])
+    index.remove([0])
+
+    idx, _ = ivf.search(new_vec[0], 1)
+    assert list(idx) == [new_row]
+    idx_all, _ = ivf.search(index.matrix[0] + 1e-3, len(index))
+    assert 0 not in idx_all
+
+
+# GIVEN/WHEN/THEN: クエリの検証規則は厳密検索と同じ
+def test_zero_query_raises():
+    """GIVEN IVF。WHEN ゼロベクトル。THEN ValueError。"""
+    index, _ = _clustered_index()
+    ivf = IVFIndex.train(index, nlist=4)
+
+    with pytest.raises(ValueError):
+        ivf.search(np.zeros(16), 3)
@@ -0,0 +1,55 @@
+# tests/unit/test_answer_cache.py
+
+import numpy as np
+import pytest
+from app.answer_cache import SemanticAnswerCache
+
+
+# GIVEN/WHEN/THEN: 近い質問 + 同じチャンク集合なら保存済みの回答を返す
+def test_near_duplicate_question_with_same_chunks_hits():
+    """GIVEN 保存済みの回答。WHEN ほぼ同じ向きの質問で同じチャンク（順不同）。THEN 回答を返す。"""
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store([1.0, 0.0, 0.0], [3, 1, 2], "回答A", version=1)
+
+    assert cache.lookup([0.99, 0.05, 0.0], [1, 2, 3], version=1) == "回答A"
+    assert cache.stats()["hits"] == 1
+
+
+# GIVEN/WHEN/THEN: 類似度が閾値未満、またはチャンク集合が違えばミス
+@pytest.mark.parametrize("query,chunks", [([0.0, 1.0, 0.0], [1, 2]), ([1.0, 0.0, 0.0], [1, 9])])
+def test_dissimilar_question_or_different_chunks_misses(query, chunks):
+    """GIVEN 保存済みの回答。WHEN 別の向きの質問 / 別のチャンク。THEN None。"""
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store([1.0, 0.0, 0.0], [1, 2], "回答A")
+
+    assert cache.lookup(query, chunks) is None
+    assert cache.stats()["misses"] == 1
+
+
+# GIVEN/WHEN/THEN: ベクトルストアの版が変わると全エントリを破棄する
+def test_version_change_invalidates_entries():
+    """GIVEN version=1 で保存。WHEN version=2 で参照。THEN ミスし、エントリは空。"""
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], [1], "回答A", version=1)
+
+    assert cache.lookup([1.0, 0.0], [1], version=2) is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["invalidations"] == 1
+
+
+# GIVEN/WHEN/THEN: 上限を超えたら LRU / LFU で追い出す
+@pytest.mark.parametrize("policy,evicted", [("lru", "a"), ("lfu", "b")])
+def test_eviction_policy(policy, evicted):
+    """GIVEN 上限 2 件で a を 2 回、その後 b を 1 回参照。WHEN c を追加。THEN LRU は a、LFU は b を追い出す。"""
+    cache = SemanticAnswerCache(max_entries=2, policy=policy)
+    vectors = {"a": [1.0, 0.0, 0.0], "b": [0.0, 1.0, 0.0], "c": [0.0, 0.0, 1.0]}
+    ids = {"a": [1], "b": [2], "c": [3]}
+    cache.store(vectors["a"], ids["a"], "a")
+    cache.store(vectors["b"], ids["b"], "b")
+    cache.lookup(vectors["a"], ids["a"])
+    cache.lookup(vectors["a"], ids["a"])
+    cache.lookup(vectors["b"], ids["b"])
+
+    cache.store(vectors["c"], ids["c"], "c")
+
+    remaining = {name for name in "abc" if cache.lookup(vectors[name], ids[name]) is not None}
+    assert remaining == set("abc") - {evicted}
@@ -0,0 +1,45 @@
+# tests/unit/test_benchmarks.py
+# ベンチマークスイートが小さな合成データで最後まで動き、比較できる JSON を返すことだけを確認する
+
+import json
+
+from benchmarks.load_test import run_load_test
+from benchmarks.run import compare, run_suite
+
+
+def test_run_suite_produces_json_serializable_results():
+    # GIVEN/WHEN: 極小サイズで全ベンチマークを実行
+    report = run_suite(
+        (300,), load_sizes=(20,), search_modes=("exact", "sq"), shard_counts=(1, 2), n_queries=5, chunk_chars=3000, pdf_pages=2, csv_rows=40
+    )
+
+    # THEN: 各ホットパスの結果が揃い、JSON に直列化できる
+    names = {r["name"] for r in report["results"]}
+    assert {"search.exact", "search.sq", "search.batch", "search.sharded", "load.jsonl", "load.segment"} <= names
+    assert {"chunking.split_text", "chunking.pdf", "chunking.csv", "process_document.pdf", "process_document.csv"} <= names
+    exact = next(r for r in report["results"] if r["name"] == "search.exact")
+    assert exact["p50_ms"] <= exact["p95_ms"] <= exact["p99_ms"]
+    json.dumps(report)
+
+
+def test_compare_flags_regressions_by_metric_direction():
+    # GIVEN: レイテンシが 50% 悪化し、スループットが 50% 改善した結果
+    before = {"results": [{"name": "x", "params": {"n": 1}, "p50_ms": 10.0, "rows_per_sec": 100}]}
+    after = {"results": [{"name": "x", "params": {"n": 1}, "p50_ms": 15.0, "rows_per_sec": 150}]}
+
+    # WHEN: 比較
+    rows = {r["metric"]: r for r in compare(before, after)}
+
+    # THEN: 小さいほど良い指標の増加だけが悪化と判定される
+    assert rows["p50_ms"]["regression"] is True
+    assert rows["rows_per_sec"]["regression"] is False
+
+
+def test_load_test_runs_against_local_stand_ins():
+    # GIVEN/WHEN: ローカルバケットの 2 ドキュメントに対して、フェイクモデルで /search と /answer を 6 件ずつ送る
+    results = run_load_test(n_docs=2, rows_per_doc=20, n_requests=6, concurrency=3, distinct_queries=3)
+
+    # THEN: エラーなしで、エンドポイントごとにスループットとパーセンタイルが出る
+    assert [r["name"] for r in results] == ["service.search", "service.answer"]
+    assert all(r["errors"] == 0 and r["requests_per_sec"] > 0 for r in results)
+    assert results[0]["params"]["rows"] == 40
@@ -0,0 +1,90 @@
+# tests/unit/test_embedding_cache.py
+
+import numpy as np
+from app.embedding_cache import QueryEmbeddingCache, normalize_query_text
+
+
+class CountingEmbedder:
+    """呼び出し回数を数えるだけの埋め込み関数。"""
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text: str) -> list[float]:
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+
+class FakeClock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+# GIVEN/WHEN/THEN: 全角/半角・空白の違いは同じキーになる
+def test_normalize_query_text_folds_width_and_spaces():
+    """GIVEN 表記ゆれのある質問。WHEN 正規化。THEN 同じ文字列。"""
+    assert normalize_query_text("  ＡＢＣ　の 申請　方法 ") == normalize_query_text("abc の 申請 方法")
+
+
+# GIVEN/WHEN/THEN: 2 回目以降は埋め込み API を呼ばない
+def test_get_or_compute_hits_after_first_call():
+    """GIVEN 空のキャッシュ。WHEN 同じ質問を 3 回。THEN 埋め込みは 1 回だけ、hit=2 / miss=1。"""
+    cache = QueryEmbeddingCache("model-a")
+    embed = CountingEmbedder()
+
+    vectors = [cache.get_or_compute("質問", embed) for _ in range(3)]
+
+    assert embed.calls == 1
+    assert all(np.array_equal(v, vectors[0]) for v in vectors)
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+# GIVEN/WHEN/THEN: モデル名が違えば別エントリ
+def test_model_name_is_part_of_key():
+    """GIVEN モデル名だけが異なる 2 つのキャッシュ。WHEN 同じ質問。THEN ヒットしない。"""
+    a = QueryEmbeddingCache("model-a")
+    a.put("質問", [1.0, 0.0])
+    b = QueryEmbeddingCache("model-b")
+
+    assert a.get("質問") is not None
+    assert b.get("質問") is None
+
+
+# GIVEN/WHEN/THEN: LRU は上限を超えたら最も古く使われたものを捨てる
+def test_lru_evicts_least_recently_used():
+    """GIVEN 上限 2 件。WHEN a,b を入れ a を参照後に c を追加。THEN b が追い出される。"""
+    cache = QueryEmbeddingCache("m", max_entries=2)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    cache.get("a")
+    cache.put("c", [3.0])
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+# GIVEN/WHEN/THEN: TTL を過ぎたエントリは使わない
+def test_ttl_expires_entries():
+    """GIVEN TTL 10 秒。WHEN 11 秒後に取得。THEN ミス。"""
+    clock = FakeClock()
+    cache = QueryEmbeddingCache("m", ttl_sec=10, clock=clock)
+    cache.put("a", [1.0])
+
+    clock.now = 11.0
+
+    assert cache.get("a") is None
+
+
+# GIVEN/WHEN/THEN: SQLite 層は別インスタンス（再起動後）からも参照できる
+def test_persistent_tier_survives_new_instance(tmp_path):
+    """GIVEN SQLite 付きキャッシュに保存。WHEN 新しいインスタンスで取得。THEN 永続層からヒット。"""
+    db = str(tmp_path / "cache.sqlite")
+    QueryEmbeddingCache("m", db_path=db).put("質問", [0.5, 0.25])
+
+    cache = QueryEmbeddingCache("m", db_path=db)
+    vector = cache.get("質問")
+
+    assert np.allclose(vector, [0.5, 0.25])
+    assert cache.stats()["persistent_hits"] == 1
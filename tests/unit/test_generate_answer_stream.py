@@ -0,0 +1,48 @@
+# tests/unit/test_generate_answer_stream.py
+
+from types import SimpleNamespace
+
+from app.app import generate_answer, generate_answer_stream
+
+
+class FakeGenerativeModel:
+    """generate_content を記録し、stream=True なら部分応答のイテレータを返すフェイク。"""
+    def __init__(self, parts: list[str]):
+        self.parts = parts
+        self.calls = []
+
+    def generate_content(self, contents, stream: bool = False):
+        self.calls.append({"contents": contents, "stream": stream})
+        if stream:
+            return iter(SimpleNamespace(text=p) for p in self.parts)
+        return SimpleNamespace(text="".join(self.parts))
+
+
+# GIVEN/WHEN/THEN: 部分応答を届いた順に yield する
+def test_stream_yields_parts_in_order():
+    """GIVEN 3 つの部分応答（空を含む）。WHEN ストリーム生成。THEN 空以外を順に返し stream=True で呼ぶ。"""
+    model = FakeGenerativeModel(["こんにちは", "", "、世界"])
+
+    parts = list(generate_answer_stream(model, "prompt"))
+
+    assert parts == ["こんにちは", "、世界"]
+    assert model.calls == [{"contents": ["prompt"], "stream": True}]
+
+
+# GIVEN/WHEN/THEN: 最初の応答までの時間と完了までの時間を別々に記録する
+def test_stream_records_ttft_and_total():
+    """GIVEN timings 用の dict。WHEN 最後まで消費。THEN ttft_sec <= total_sec が入る。"""
+    timings: dict = {}
+
+    list(generate_answer_stream(FakeGenerativeModel(["a", "b"]), "prompt", timings))
+
+    assert 0.0 <= timings["ttft_sec"] <= timings["total_sec"]
+
+
+# GIVEN/WHEN/THEN: 非ストリーム版は従来どおり全文を strip して返す
+def test_generate_answer_keeps_contract():
+    """GIVEN 前後に空白を含む応答。WHEN generate_answer。THEN strip された全文、stream 指定なし。"""
+    model = FakeGenerativeModel([" 回答 "])
+
+    assert generate_answer(model, "prompt") == "回答"
+    assert model.calls == [{"contents": ["prompt"], "stream": False}]
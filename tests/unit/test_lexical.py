@@ -0,0 +1,96 @@
+# tests/unit/test_lexical.py
+
+import numpy as np
+import pytest
+from app.lexical import HybridSearcher, LexicalIndex, char_ngram_ids, reciprocal_rank_fusion
+from app.vector_index import VectorIndex
+
+TEXTS = [
+    "補助金の申請は様式第1号を窓口に提出してください。",
+    "住民票の写しはオンラインで請求できます。",
+    "第3条に定める対象者は所得の証明書が必要です。",
+    "郵送による手続きは期限までに到着したものに限ります。",
+]
+
+
+def _index(texts=TEXTS, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return VectorIndex(rng.normal(size=(len(texts), dim)), list(texts))
+
+
+# GIVEN/WHEN/THEN: 全角英数字と大文字小文字は正規化され、空白を跨ぐ n-gram は作らない
+def test_char_ngrams_normalize_width_and_skip_spaces():
+    """GIVEN 全角・大文字の "ＡＢ" と半角・小文字の "ab"。THEN 同じ ID 列。空白を挟む "a b" は 1-gram も 2-gram も作らない。"""
+    assert np.array_equal(char_ngram_ids("ＡＢ"), char_ngram_ids("ab"))
+    assert char_ngram_ids("a b").size == 0
+    assert char_ngram_ids("申請書").size == 3  # 2-gram 2 個 + 3-gram 1 個
+
+
+# GIVEN/WHEN/THEN: 正式名称・番号の完全一致で目的の行が最上位になる
+def test_bm25_ranks_exact_official_terms_first():
+    """GIVEN 4 チャンク。WHEN "第3条" / "様式第1号" で検索。THEN それを含む行が 1 位。"""
+    lexical = LexicalIndex.build(_index())
+
+    assert lexical.search("第3条", 2)[0][0] == 2
+    assert lexical.search("様式第1号", 2)[0][0] == 0
+    assert lexical.search("zzz", 2)[0].size == 0
+
+
+# GIVEN/WHEN/THEN: 追加行は次の検索で取り込まれ、削除行は結果に出ない
+def test_lexical_index_follows_appends_and_removals():
+    """GIVEN 構築後に 1 行追加し、行 2 を削除。THEN 追加行はヒットし、削除行はヒットしない。"""
+    index = _index()
+    lexical = LexicalIndex.build(index)
+    index.append(np.ones((1, 8), dtype=np.float32) / np.sqrt(8), ["様式第9号の記入例"])
+    index.remove([2])
+
+    assert lexical.search("様式第9号", 1)[0].tolist() == [4]
+    assert lexical.search("第3条", 3)[0].size == 0
+
+
+# GIVEN/WHEN/THEN: RRF は複数の順位リストの上位に共通して現れる行を上げる
+def test_reciprocal_rank_fusion_scores():
+    """GIVEN [1,2,3] と [3,1]。THEN 1 = 1/61 + 1/62、3 = 1/63 + 1/61 で 1 > 3 > 2。"""
+    rows, scores = reciprocal_rank_fusion([np.array([1, 2, 3]), np.array([3, 1])], k=60)
+
+    assert rows.tolist() == [1, 3, 2]
+    assert scores[0] == pytest.approx(1 / 61 + 1 / 62)
+
+
+# GIVEN/WHEN/THEN: 密ベクトルでは下位でも、語彙が一致する行がハイブリッド検索で上位に入る
+def test_hybrid_search_surfaces_lexical_matches():
+    """GIVEN 密ベクトルでは行 2 が最下位になるクエリ。WHEN "第3条" を併用。THEN 行 2 が上位 2 件に入る。"""
+    index = VectorIndex(np.eye(4, 8), list(TEXTS))
+    q = np.array([1.0, 0.5, 0.0, 0.2, 0, 0, 0, 0])
+    hybrid = HybridSearcher(index, LexicalIndex.build(index))
+
+    assert index.search(q, 4)[0][-1] == 2
+    assert 2 in hybrid.search(q, 2, query_text="第3条")[0].tolist()
+    # 語彙の指定が無ければ密ベクトル検索と同じ
+    assert hybrid.search(q, 2)[0].tolist() == index.search(q, 2)[0].tolist()
+
+
+# GIVEN/WHEN/THEN: prefilter では語彙候補の行だけが採点対象になる
+def test_hybrid_prefilter_scores_only_lexical_candidates():
+    """GIVEN prefilter=True。WHEN "証明書" で検索。THEN 結果は語彙候補（行 2）の中だけ。"""
+    index = _index()
+    hybrid = HybridSearcher(index, LexicalIndex.build(index), prefilter=True)
+
+    rows, _ = hybrid.search(index.matrix[0], 3, query_text="証明書")
+    assert rows.tolist() == [2]
+
+
+# GIVEN/WHEN/THEN: 追加分をマージした転置リストは一括構築と同じで、1 エントリ 10 バイト
+def test_incremental_postings_match_full_build():
+    """GIVEN 2 行で構築して残りを追加。THEN 一括構築と同じ転置リスト・スコアになり、型は uint32 / int32 / uint16。"""
+    full = LexicalIndex.build(_index())
+    index = _index(TEXTS[:2])
+    lexical = LexicalIndex.build(index)
+    index.append(_index(TEXTS[2:]).matrix, TEXTS[2:])
+    lexical.search("第3条", 1)
+
+    for a, b in ((lexical._terms, full._terms), (lexical._rows, full._rows), (lexical._tf, full._tf)):
+        assert a.dtype == b.dtype and np.array_equal(a, b)
+    assert (lexical._terms.dtype, lexical._rows.dtype, lexical._tf.dtype) == (np.uint32, np.int32, np.uint16)
+    assert np.allclose(lexical.scores("様式第1号の提出"), full.scores("様式第1号の提出"))
+    assert lexical.nbytes == 10 * lexical._terms.size + 4 * len(lexical)
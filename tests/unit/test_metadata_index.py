@@ -0,0 +1,104 @@
+# tests/unit/test_metadata_index.py
+
+import numpy as np
+import pytest
+from app.lexical import HybridSearcher, LexicalIndex
+from app.metadata_index import MetadataIndex, format_citation, parse_page_range
+from app.vector_index import VectorIndex
+
+
+def _index():
+    """a.pdf（p.1-2, p.3-4, p.5）・b.csv（2 行）・a.pdf（p.6、再アップロード分）の 6 行。"""
+    metadata = [
+        {"source_file": "a.pdf", "chunk_id": 0, "page_start": 1, "page_end": 2},
+        {"source_file": "a.pdf", "chunk_id": 1, "page_start": 3, "page_end": 4},
+        {"source_file": "a.pdf", "chunk_id": 2, "page_start": 5, "page_end": 5},
+        {"source_file": "b.csv", "chunk_id": 0, "row_start": 1, "row_end": 10},
+        {"source_file": "b.csv", "chunk_id": 1, "row_start": 11, "row_end": 20},
+        {"source_file": "a.pdf", "chunk_id": 3, "page_start": 6, "page_end": 6},
+    ]
+    texts = ["補助金の申請", "様式第1号", "第3条の対象者", "住民票", "所得の証明書", "郵送の期限"]
+    return VectorIndex(np.eye(6, 8), texts, metadata)
+
+
+# GIVEN/WHEN/THEN: ソースファイル・ページ範囲（重なり判定）で行を絞り込む
+def test_select_by_source_and_pages():
+    """GIVEN 6 行。WHEN a.pdf / p.4-5 / b.csv+p.1 で絞る。THEN 該当行だけが昇順で返る。"""
+    meta = MetadataIndex.build(_index())
+
+    assert meta.select(source_files=["a.pdf"]).tolist() == [0, 1, 2, 5]
+    assert meta.select(pages=(4, 5)).tolist() == [1, 2]
+    assert meta.select(source_files=["b.csv"], pages=(1, 1)).tolist() == []  # CSV にページは無い
+    assert meta.select(source_files=["missing.pdf"]).tolist() == []
+    assert meta.select().tolist() == list(range(6))
+
+
+# GIVEN/WHEN/THEN: 構築後の追加行を取り込み、件数は削除行を除いて数える
+def test_metadata_index_follows_appends_and_removals():
+    """GIVEN 構築後に c.pdf を 1 行追加し、行 3 を削除。THEN 追加行が選べて、b.csv の件数は 1。"""
+    index = _index()
+    meta = MetadataIndex.build(index)
+    index.append(np.ones((1, 8), dtype=np.float32), ["追加"], [{"source_file": "c.pdf", "chunk_id": 0, "page_start": 1, "page_end": 1}])
+    index.remove([3])
+
+    assert meta.select(source_files=["c.pdf"]).tolist() == [6]
+    assert meta.source_counts() == {"a.pdf": 4, "b.csv": 1, "c.pdf": 1}
+
+
+# GIVEN/WHEN/THEN: rows を渡した検索はその行だけを採点し、削除行は除く
+def test_search_restricted_to_rows():
+    """GIVEN 行 0 に一致するクエリ。WHEN rows=[2, 3, 4]（行 3 は削除済み）。THEN 2 と 4 だけが返る。"""
+    index = _index()
+    index.remove([3])
+    q = np.eye(1, 8)[0] + 0.1 * np.eye(8)[2]
+
+    rows, _ = index.search(q, 5, rows=[2, 3, 4])
+
+    assert rows.tolist() == [2, 4]
+
+
+# GIVEN/WHEN/THEN: 範囲外の行番号は黙って捨てずに ValueError。すべて削除済みなら空
+@pytest.mark.parametrize("bad", [[-1], [0, 6], [[0, 1]], [0.5]])
+def test_search_rejects_out_of_range_rows(bad):
+    """GIVEN 6 行。WHEN 負・行数以上・2 次元・非整数の rows。THEN 密ベクトル検索も語彙検索も ValueError。"""
+    index = _index()
+    lexical = LexicalIndex.build(index)
+
+    with pytest.raises(ValueError):
+        index.search(np.eye(1, 8)[0], 3, rows=bad)
+    with pytest.raises(ValueError):
+        lexical.search("様式", 3, rows=bad)
+
+    index.remove([3, 4])
+    assert index.search(np.eye(1, 8)[0], 3, rows=[3, 4])[0].size == 0
+
+
+# GIVEN/WHEN/THEN: ハイブリッド検索も rows で絞り込まれる（語彙一致が範囲外なら除外）
+def test_hybrid_search_respects_rows():
+    """GIVEN "様式第1号" は行 1 にだけある。WHEN b.csv の行に絞る。THEN 結果は b.csv の行だけ。"""
+    index = _index()
+    meta = MetadataIndex.build(index)
+    searcher = HybridSearcher(index, LexicalIndex.build(index))
+
+    rows, _ = searcher.search(np.eye(1, 8)[0], 3, query_text="様式第1号", rows=meta.select(source_files=["b.csv"]))
+
+    assert set(rows.tolist()) <= {3, 4}
+    assert searcher.get_metadata(rows)[0]["source_file"] == "b.csv"
+
+
+# GIVEN/WHEN/THEN: ページ範囲の入力解析と出典表記
+def test_parse_page_range_and_format_citation():
+    """GIVEN "3" / "3-10" / "3〜10" / 空 / 不正値。THEN 範囲・None・ValueError。出典は種類ごとの表記。"""
+    assert parse_page_range("3") == (3, 3)
+    assert parse_page_range(" 3 - 10 ") == (3, 10)
+    assert parse_page_range("3〜10") == (3, 10)
+    assert parse_page_range("") is None
+    with pytest.raises(ValueError):
+        parse_page_range("10-3")
+    with pytest.raises(ValueError):
+        parse_page_range("p3")
+
+    assert format_citation({"source_file": "a.pdf", "page_start": 3, "page_end": 4}) == "a.pdf p.3-4"
+    assert format_citation({"source_file": "a.pdf", "page_start": 5, "page_end": 5}) == "a.pdf p.5"
+    assert format_citation({"source_file": "b.csv", "row_start": 10, "row_end": 20}) == "b.csv 行 10-20"
+    assert format_citation({"source_file": "c.txt", "chunk_id": 7}) == "c.txt #7"
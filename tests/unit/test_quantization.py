@@ -0,0 +1,97 @@
+# tests/unit/test_quantization.py
+
+import numpy as np
+import pytest
+from app.ann import recall_at_k
+from app.quantization import ProductQuantizer, QuantizedIndex, ScalarQuantizer
+from app.vector_index import VectorIndex
+
+
+def _random_index(n=300, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return VectorIndex(rng.normal(size=(n, dim)), [str(i) for i in range(n)]), rng
+
+
+# GIVEN/WHEN/THEN: int8 量子化は復元誤差が量子化幅の半分以内
+def test_scalar_quantizer_round_trip_error_is_bounded():
+    """GIVEN 正規化済み行列。WHEN encode → decode。THEN 誤差 <= scale/2 (+丸め誤差)。"""
+    index, _ = _random_index()
+    sq = ScalarQuantizer.fit(index.matrix)
+
+    codes = sq.encode(index.matrix)
+    restored = sq.decode(codes)
+
+    assert codes.dtype == np.int8
+    assert np.all(np.abs(restored - index.matrix) <= sq.scale / 2 + 1e-6)
+
+
+# GIVEN/WHEN/THEN: コード上の採点は復元ベクトルとの内積に一致する
+@pytest.mark.parametrize("quantizer_cls", [ScalarQuantizer, ProductQuantizer])
+def test_code_scores_match_decoded_dot_product(quantizer_cls):
+    """GIVEN 学習済み量子化器。WHEN scores(codes, q)。THEN decode(codes) @ q と一致。"""
+    index, rng = _random_index()
+    quantizer = quantizer_cls.fit(index.matrix, 4) if quantizer_cls is ProductQuantizer else quantizer_cls.fit(index.matrix)
+    codes = quantizer.encode(index.matrix)
+    q = rng.normal(size=16).astype(np.float32)
+
+    assert np.allclose(quantizer.scores(codes, q), quantizer.decode(codes) @ q, atol=1e-4)
+
+
+# GIVEN/WHEN/THEN: リランキング付きなら厳密検索に近い再現率で、元ベクトルをメモリマップにすればメモリは小さい
+@pytest.mark.parametrize("mode,kwargs,min_recall", [("sq", {}, 0.95), ("pq", {"pq_subspaces": 4}, 0.8)])
+def test_quantized_search_recall_and_footprint(tmp_path, mode, kwargs, min_recall):
+    """GIVEN 元ベクトルを .npy のメモリマップにした量子化インデックス。WHEN recall@5 を測る。THEN 閾値以上で、ヒープはコードだけ。"""
+    index, rng = _random_index()
+    path = tmp_path / "index.npy"
+    np.save(path, index.matrix)
+    index.map_file(str(path))
+    qindex = QuantizedIndex.build(index, mode, rerank_factor=8, **kwargs)
+
+    assert recall_at_k(qindex, index, rng.normal(size=(20, 16)), k=5) >= min_recall
+    report = qindex.memory_report()
+    assert report["float_heap_bytes"] == 0 and report["resident_bytes"] == report["code_bytes"]
+    assert report["compression"] >= 4.0
+
+
+# GIVEN/WHEN/THEN: 元ベクトルがヒープにあれば、その分も保持バイト数に数える
+def test_memory_report_counts_heap_matrix():
+    """GIVEN ヒープ上の行列を元にした sq インデックス。THEN resident にはコードと float32 行列の両方が入る。"""
+    index, _ = _random_index()
+    report = QuantizedIndex.build(index, "sq").memory_report()
+
+    assert report["float_heap_bytes"] == report["float_bytes"]
+    assert report["resident_bytes"] == report["code_bytes"] + report["float_bytes"]
+    assert report["compression"] < 1.0
+
+
+# GIVEN/WHEN/THEN: リランキング後のスコアは厳密なコサイン類似度
+def test_reranked_scores_are_exact():
+    """GIVEN sq インデックス。WHEN search。THEN スコアは元行列との内積そのもの。"""
+    index, rng = _random_index()
+    qindex = QuantizedIndex.build(index, "sq")
+    q = rng.normal(size=16)
+
+    idx, scores = qindex.search(q, 3)
+
+    qn = (q / np.linalg.norm(q)).astype(np.float32)
+    assert np.allclose(scores, index.matrix[idx] @ qn, atol=1e-5)
+
+
+# GIVEN/WHEN/THEN: 構築後の追加行も検索対象になる
+def test_appended_rows_are_encoded_on_search():
+    """GIVEN sq インデックス。WHEN base に行を追加。THEN 追加行が最上位で見つかる。"""
+    index, _ = _random_index()
+    qindex = QuantizedIndex.build(index, "sq")
+    v = np.zeros((1, 16), dtype=np.float32)
+    v[0, 3] = 1.0
+
+    (row,) = index.append(v, ["new"])
+
+    assert list(qindex.search(v[0], 1)[0]) == [row]
+
+
+def test_unknown_mode_raises():
+    """GIVEN/WHEN 未知のモード。THEN ValueError。"""
+    index, _ = _random_index()
+    with pytest.raises(ValueError):
+        QuantizedIndex.build(index, "xyz")
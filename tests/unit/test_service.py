@@ -0,0 +1,161 @@
+# tests/unit/test_service.py
+
+import asyncio
+import json
+import time
+
+import httpx
+import numpy as np
+from app.service import RagService, create_app
+from app.vector_index import VectorIndex
+from starlette.testclient import TestClient
+
+TEXTS = ["補助金の申請は様式第1号で行う", "住民票はオンラインで請求できる", "第3条の対象者は証明書が必要", "郵送は期限必着"]
+METADATA = [
+    {"source_file": "a.pdf", "chunk_id": 0, "page_start": 1, "page_end": 1},
+    {"source_file": "a.pdf", "chunk_id": 1, "page_start": 2, "page_end": 3},
+    {"source_file": "b.csv", "chunk_id": 0, "row_start": 1, "row_end": 10},
+    {"source_file": "b.csv", "chunk_id": 1, "row_start": 11, "row_end": 20},
+]
+
+
+class FakeStore:
+    def __init__(self, index):
+        self.index = index
+        self.version = 1
+        self.refreshes = 0
+
+    def refresh(self):
+        self.refreshes += 1
+        return {"added": 0, "updated": 0, "removed": 0, "unchanged": 2}
+
+
+class FakeEmbeddingModel:
+    """本文に含まれるキーワードで決まるベクトルを返す（delay 秒だけブロックする）。"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def get_embeddings(self, texts):
+        self.calls += 1
+        time.sleep(self.delay)
+        keys = ["補助金", "住民票", "第3条", "郵送"]
+        return [[1.0 if key in text else 0.01 for key in keys] for text in texts]
+
+
+class FakeGenerativeModel:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, contents, stream=False):
+        self.calls += 1
+        parts = [type("R", (), {"text": t})() for t in ("回答", "です")]
+        return parts if stream else type("R", (), {"text": "回答です"})()
+
+
+def _service(*, index=None, delay=0.0, max_workers=4):
+    index = index if index is not None else VectorIndex(np.eye(4), TEXTS, METADATA)
+    return RagService(FakeStore(index), FakeEmbeddingModel(delay), FakeGenerativeModel(), hybrid_mode="off", max_workers=max_workers)
+
+
+# GIVEN/WHEN/THEN: /search は共有インデックスから出典付きで返し、ソース絞り込みも効く
+def test_search_returns_citations_and_honors_filters():
+    """GIVEN 4 チャンク。WHEN "住民票" で検索 / b.csv に絞って検索。THEN 1 位は住民票の行、絞り込み時は b.csv だけ。"""
+    service = _service()
+    with TestClient(create_app(service)) as client:
+        hits = client.post("/search", json={"query": "住民票の請求", "k": 2}).json()["results"]
+        filtered = client.post("/search", json={"query": "住民票の請求", "source_files": ["b.csv"]}).json()["results"]
+        health = client.get("/healthz").json()
+
+    assert hits[0]["row"] == 1 and hits[0]["citation"] == "a.pdf p.2-3"
+    assert {h["metadata"]["source_file"] for h in filtered} == {"b.csv"}
+    assert health == {"status": "ok", "chunks": 4, "version": 1}
+
+
+# GIVEN/WHEN/THEN: /answer は 2 回目を回答キャッシュから返し、stream=true なら NDJSON で順に返す
+def test_answer_uses_cache_and_streams_ndjson():
+    """GIVEN 同じ質問を 2 回。THEN LLM 呼び出しは 1 回。stream では sources → delta → done の順。"""
+    service = _service()
+    with TestClient(create_app(service)) as client:
+        first = client.post("/answer", json={"query": "第3条の対象者"}).json()
+        second = client.post("/answer", json={"query": "第3条の対象者"}).json()
+        events = [json.loads(line) for line in client.post("/answer", json={"query": "郵送の期限", "stream": True}).text.splitlines()]
+
+    assert first["answer"] == "回答です" and first["cached"] is False and second["cached"] is True
+    assert service.generative_model.calls == 2  # 非ストリーム 1 回 + ストリーム 1 回
+    assert "sources" in events[0] and "".join(e.get("delta", "") for e in events) == "回答です"
+    assert events[-1] == {"done": True, "cached": False}
+
+
+# GIVEN/WHEN/THEN: 入力不正は 400、インデックス未ロードは 503
+def test_bad_requests_and_unloaded_index():
+    """GIVEN 質問なし / 不正なページ範囲 / k=0。THEN 400。インデックスが None なら /search と /healthz は 503。"""
+    with TestClient(create_app(_service())) as client:
+        assert client.post("/search", json={}).status_code == 400
+        assert client.post("/search", json={"query": "x", "pages": "10-3"}).status_code == 400
+        assert client.post("/search", json={"query": "x", "k": 0}).status_code == 400
+        assert client.post("/search", content=b"not json").status_code == 400
+
+    service = _service()
+    service.store.index = None
+    with TestClient(create_app(service)) as client:
+        assert client.post("/search", json={"query": "x"}).status_code == 503
+        assert client.get("/healthz").status_code == 503
+
+
+# GIVEN/WHEN/THEN: ブロッキング処理はスレッドプールで動き、同時リクエストがイベントループで直列化されない
+def test_concurrent_requests_do_not_block_event_loop():
+    """GIVEN 埋め込みに 0.2 秒かかるモデルとワーカー 4。WHEN 異なる質問を 4 件同時に送る。THEN 全体で 0.6 秒未満。"""
+    service = _service(delay=0.2, max_workers=4)
+    app = create_app(service)
+
+    async def fire():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(client.post("/search", json={"query": f"補助金 {i}"}) for i in range(4)))
+            return time.perf_counter() - start, responses
+
+    try:
+        elapsed, responses = asyncio.run(fire())
+    finally:
+        service.close()
+
+    assert all(r.status_code == 200 for r in responses)
+    assert elapsed < 0.6
+
+
+# GIVEN/WHEN/THEN: 絞り込みに合うチャンクが無ければ LLM を呼ばず、ストリーム中の例外は error イベントになる
+def test_answer_without_matching_chunks_and_stream_errors():
+    """GIVEN 存在しないソースで絞り込み。THEN LLM もキャッシュも使わない。ストリーム中の例外は error 行で閉じる。"""
+    service = _service()
+    with TestClient(create_app(service)) as client:
+        empty = client.post("/answer", json={"query": "第3条", "source_files": ["nope.pdf"]}).json()
+        events = [json.loads(line) for line in client.post(
+            "/answer", json={"query": "第3条", "source_files": ["nope.pdf"], "stream": True}
+        ).text.splitlines()]
+
+        def broken(*args, **kwargs):
+            raise ValueError("bad filter")
+
+        service._retrieve_sync = broken
+        response = client.post("/answer", json={"query": "第3条", "stream": True})
+
+    assert empty == {"answer": "", "cached": False, "sources": []}
+    assert events == [{"sources": []}, {"done": True, "cached": False}]
+    assert service.generative_model.calls == 0 and service.answer_cache.stats()["entries"] == 0
+    assert response.status_code == 200 and json.loads(response.text.splitlines()[-1]) == {"error": "bad filter"}
+
+
+# GIVEN/WHEN/THEN: /embed は未キャッシュのテキストを 1 回の呼び出しでまとめて埋め込む
+def test_embed_batches_uncached_texts():
+    """GIVEN 1 件だけキャッシュ済み。WHEN 重複を含む 4 件を /embed。THEN get_embeddings は 1 回で、順序どおりに返る。"""
+    service = _service()
+    with TestClient(create_app(service)) as client:
+        client.post("/embed", json={"texts": ["補助金"]})
+        service.embedding_model.calls = 0
+        vectors = client.post("/embed", json={"texts": ["住民票", "補助金", "郵送", "住民票"]}).json()["embeddings"]
+
+    assert service.embedding_model.calls == 1
+    assert [int(np.argmax(v)) for v in vectors] == [1, 0, 3, 1]
@@ -0,0 +1,83 @@
+# tests/unit/test_sharded.py
+
+import numpy as np
+import pytest
+from app.sharded import ShardedIndex, scaling_report, shard_bounds
+from app.vector_index import VectorIndex
+
+
+def _index(n=2000, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return VectorIndex(rng.normal(size=(n, dim)), [f"t{i}" for i in range(n)])
+
+
+# GIVEN/WHEN/THEN: シャード境界は全行を隙間なく覆う
+def test_shard_bounds_cover_all_rows():
+    """GIVEN 10 行を 3 分割 / 2 行を 4 分割。THEN 先頭 0・末尾 n の単調な境界。"""
+    assert shard_bounds(10, 3).tolist() == [0, 3, 6, 10]
+    assert shard_bounds(2, 4)[[0, -1]].tolist() == [0, 2]
+
+
+# GIVEN/WHEN/THEN: シャード並列検索の結果は単一スレッドの厳密検索と一致する（追加・削除の後も）
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_sharded_search_matches_exact_search(backend):
+    """GIVEN 2000 行を 3 シャード。WHEN 構築後に行を削除・追加。THEN 上位 5 件が VectorIndex.search と同じ。"""
+    index = _index()
+    queries = np.random.default_rng(1).normal(size=(4, 16))
+    sharded = ShardedIndex.build(index, 3, backend=backend)
+    try:
+        for q in queries:
+            assert sharded.search(q, 5)[0].tolist() == index.search(q, 5)[0].tolist()
+
+        index.remove(index.search(queries[0], 2)[0])
+        index.append(np.tile(queries[1], (2, 1)).astype(np.float32), ["new0", "new1"])
+
+        for q in queries:
+            rows, scores = sharded.search(q, 5)
+            expected_rows, expected_scores = index.search(q, 5)
+            assert sorted(rows.tolist()) == sorted(expected_rows.tolist())
+            assert np.allclose(scores, expected_scores, atol=1e-6)
+        assert set(sharded.search(queries[1], 2)[0].tolist()) == {2000, 2001}
+    finally:
+        sharded.close()
+
+
+# GIVEN/WHEN/THEN: 検索規則と rows 指定は VectorIndex と同じ
+def test_sharded_search_validation_and_rows():
+    """GIVEN スレッド 2 シャード。THEN ゼロクエリは ValueError、rows 指定はその行だけ。"""
+    index = _index(50)
+    sharded = ShardedIndex.build(index, 2)
+    try:
+        with pytest.raises(ValueError):
+            sharded.search(np.zeros(16), 3)
+        assert set(sharded.search(np.ones(16), 3, rows=[1, 2, 3])[0].tolist()) == {1, 2, 3}
+        assert sharded.get_texts([4]) == ["t4"]
+    finally:
+        sharded.close()
+
+
+# GIVEN/WHEN/THEN: スケーリング効率の報告はシャード数ごとに 1 行
+def test_scaling_report_rows():
+    """GIVEN シャード数 (1, 2)。THEN 1 シャードが基準（高速化率 1.0）で、効率 = 高速化率 / シャード数。"""
+    rows = scaling_report(_index(500), np.ones((3, 16)), (1, 2), k=3, backend="thread")
+
+    assert [r["shards"] for r in rows] == [1, 2]
+    assert rows[0]["speedup"] == 1.0
+    assert rows[1]["efficiency"] == pytest.approx(rows[1]["speedup"] / 2, abs=1e-3)
+
+
+# GIVEN/WHEN/THEN: 共有ファイルをマップ済みのインデックスなら、ワーカーは共有メモリへコピーせず同じファイルを読む
+def test_process_backend_reuses_mapped_file(tmp_path):
+    """GIVEN map_file で .npy に差し替えたインデックス。WHEN プロセス 2 シャード。THEN 共有メモリは生存マスクだけで、結果は厳密検索と同じ。"""
+    index = _index(300)
+    path = str(tmp_path / "index.npy")
+    np.save(path, index.matrix)
+    index.map_file(path)
+    q = np.random.default_rng(2).normal(size=16)
+
+    sharded = ShardedIndex.build(index, 2, backend="process")
+    try:
+        assert len(sharded._segments) == 1  # 生存マスクのみ
+        assert sharded.search(q, 5)[0].tolist() == index.search(q, 5)[0].tolist()
+    finally:
+        sharded.close()
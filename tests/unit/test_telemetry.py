@@ -0,0 +1,99 @@
+# tests/unit/test_telemetry.py
+
+import json
+import threading
+
+import pytest
+
+from app.telemetry import Telemetry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_trace_collects_spans_and_emits_json_logs():
+    # GIVEN: 手動で進める時計と、ログを溜めるリスト
+    clock = FakeClock()
+    logs: list[str] = []
+    telemetry = Telemetry(emit=logs.append, clock=clock)
+
+    # WHEN: トレースの中で 2 つのスパンを記録
+    with telemetry.trace("query"):
+        with telemetry.span("retrieval", mode="exact"):
+            clock.now += 0.010
+        with telemetry.span("llm_generation"):
+            clock.now += 0.250
+
+    # THEN: 内訳が順に残り、合計と開始オフセットが分かる。ログはすべて JSON
+    trace = telemetry.last_trace
+    assert [s["name"] for s in trace["spans"]] == ["retrieval", "llm_generation"]
+    assert trace["spans"][0]["mode"] == "exact"
+    assert trace["spans"][1]["offset_ms"] == pytest.approx(10.0)
+    assert trace["total_ms"] == pytest.approx(260.0)
+    records = [json.loads(line) for line in logs]
+    assert records[-1]["event"] == "trace"
+    assert {r["trace_id"] for r in records if r["event"] == "span" and r["name"] != "query"} == {trace["trace_id"]}
+
+
+def test_span_records_errors_and_reraises():
+    # GIVEN/WHEN: 例外を投げるスパン
+    telemetry = Telemetry(emit=None)
+    with telemetry.trace("query"), pytest.raises(RuntimeError):
+        with telemetry.span("retrieval"):
+            raise RuntimeError("boom")
+
+    # THEN: 例外は伝わり、スパンには error が付く
+    assert telemetry.last_trace["spans"][0]["error"] == "RuntimeError"
+
+
+def test_percentiles_use_recent_samples_only():
+    # GIVEN: 直近 100 件だけを保持する集計に 1..200 ms を記録
+    telemetry = Telemetry(emit=None, max_samples=100)
+    for ms in range(1, 201):
+        telemetry.record("retrieval", ms / 1000.0)
+
+    # WHEN/THEN: パーセンタイルは 101..200 ms から計算される
+    stats = telemetry.percentiles("retrieval")
+    assert stats["count"] == 100
+    assert stats["p50_ms"] == pytest.approx(150.5)
+    assert stats["p99_ms"] == pytest.approx(199.01)
+    assert telemetry.percentiles("unknown") == {"count": 0}
+    assert set(telemetry.summary()) == {"retrieval"}
+
+
+def test_spans_from_other_threads_do_not_leak_into_trace():
+    # GIVEN/WHEN: トレース中に、コンテキストを引き継がない別スレッドでスパンを記録
+    telemetry = Telemetry(emit=None)
+    with telemetry.trace("query"):
+        t = threading.Thread(target=lambda: telemetry.record("background", 0.001))
+        t.start()
+        t.join()
+
+    # THEN: ヒストグラムには入るが、トレースの内訳には入らない
+    assert telemetry.last_trace["spans"] == []
+    assert telemetry.percentiles("background")["count"] == 1
+
+
+def test_timed_iterator_accumulates_time_spent_in_next():
+    # GIVEN: 1 件ごとに時計を 5ms 進めるジェネレータ
+    clock = FakeClock()
+    telemetry = Telemetry(emit=None, clock=clock)
+
+    def produce():
+        for i in range(3):
+            clock.now += 0.005
+            yield i
+
+    # WHEN: 消費側でも時間を進めながら読む
+    timed = telemetry.timed(produce())
+    for _ in timed:
+        clock.now += 1.0
+
+    # THEN: 生成側で掛かった時間だけが数えられる
+    assert timed.count == 3
+    assert timed.seconds == pytest.approx(0.015)
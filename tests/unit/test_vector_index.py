@@ -0,0 +1,161 @@
+# tests/unit/test_vector_index.py
+
+import numpy as np
+import pytest
+from app.vector_index import MetadataColumns, VectorIndex
+
+
+# GIVEN/WHEN/THEN: 構築時に正規化済み float32 の読み取り専用行列を保持する
+def test_matrix_is_normalized_float32_readonly():
+    """GIVEN 長さの異なるベクトル。WHEN 構築。THEN 各行が単位長の float32（ゼロ行はゼロのまま）。"""
+    embeddings = np.array([[3.0, 4.0], [0.0, 0.0], [np.nan, 2.0]])
+    index = VectorIndex(embeddings, ["A", "B", "C"])
+
+    M = index.matrix
+    assert M.dtype == np.float32
+    assert M.flags["C_CONTIGUOUS"]
+    assert not M.flags["WRITEABLE"]
+    assert np.allclose(M[0], [0.6, 0.8])
+    assert np.array_equal(M[1], [0.0, 0.0])
+    assert np.allclose(M[2], [0.0, 1.0])  # NaN→0 後に正規化
+
+
+# GIVEN/WHEN/THEN: 入力配列を変更しない
+def test_build_is_non_destructive():
+    """GIVEN float32 の入力。WHEN 構築。THEN 元配列は変更されない。"""
+    embeddings = np.array([[3.0, 4.0], [np.inf, 1.0]], dtype=np.float32)
+    before = embeddings.copy()
+
+    VectorIndex(embeddings, ["A", "B"])
+
+    assert np.array_equal(embeddings, before)
+
+
+# GIVEN/WHEN/THEN: search は (行インデックス, 類似度) を降順で返す
+def test_search_returns_indices_and_scores():
+    """GIVEN 猫/犬/鳥のベクトル。WHEN 猫に近いクエリで k=2。THEN 猫→犬の順で類似度付き。"""
+    embeddings = np.array([
+        [0.9, 0.1, 0.1],
+        [0.2, 0.8, 0.1],
+        [0.1, 0.1, 0.9],
+    ])
+    index = VectorIndex(embeddings, ["猫", "犬", "鳥"])
+
+    idx, scores = index.search(np.array([1.0, 0.0, 0.0]), 2)
+
+    assert list(idx) == [0, 1]
+    assert scores[0] >= scores[1]
+    assert index.get_texts(idx) == ["猫", "犬"]
+
+
+# GIVEN/WHEN/THEN: 不正なクエリは ValueError
+@pytest.mark.parametrize("query", [np.array([1.0, 0.0]), np.array([0.0, 0.0, 0.0])])
+def test_search_invalid_query_raises(query):
+    """GIVEN 3次元のインデックス。WHEN 次元不一致/ゼロベクトルのクエリ。THEN ValueError。"""
+    index = VectorIndex(np.eye(3), ["A", "B", "C"])
+
+    with pytest.raises(ValueError):
+        index.search(query, 1)
+
+
+# GIVEN/WHEN/THEN: テキスト数と行数の不一致は構築時に ValueError
+def test_mismatched_texts_raises():
+    """GIVEN 3行の行列と2件のテキスト。WHEN 構築。THEN ValueError。"""
+    with pytest.raises(ValueError):
+        VectorIndex(np.eye(3), ["A", "B"])
+
+
+# GIVEN/WHEN/THEN: バッチ検索はクエリごとの単発検索と同じ結果を返す（タイル分割しても同じ）
+@pytest.mark.parametrize("block_rows", [None, 1, 7])
+def test_search_batch_matches_single_search(block_rows):
+    """GIVEN ランダムな 50 件のコーパスと 4 件のクエリ。WHEN バッチ検索。THEN 単発検索と一致。"""
+    rng = np.random.default_rng(0)
+    index = VectorIndex(rng.normal(size=(50, 8)), [str(i) for i in range(50)])
+    queries = rng.normal(size=(4, 8))
+
+    idx, scores = index.search_batch(queries, 5, block_rows=block_rows)
+
+    assert idx.shape == (4, 5) and scores.shape == (4, 5)
+    for qi, q in enumerate(queries):
+        single_idx, single_scores = index.search(q, 5)
+        assert list(idx[qi]) == list(single_idx)
+        assert np.allclose(scores[qi], single_scores)
+
+
+# GIVEN/WHEN/THEN: バッチ内にゼロベクトルのクエリがあれば ValueError
+def test_search_batch_zero_query_raises():
+    """GIVEN 2件のクエリの片方がゼロ。WHEN バッチ検索。THEN ValueError。"""
+    index = VectorIndex(np.eye(3), ["A", "B", "C"])
+
+    with pytest.raises(ValueError):
+        index.search_batch(np.array([[1.0, 0.0, 0.0], [0.0, 0.0, 0.0]]), 1)
+
+
+# GIVEN/WHEN/THEN: append / remove はインデックスを作り直さずに反映される
+def test_append_and_remove_patch_index_in_place():
+    """GIVEN 2件のインデックス。WHEN 1件追加し 1件削除。THEN 検索結果に反映され、行番号は安定。"""
+    index = VectorIndex(np.array([[1.0, 0.0], [0.0, 1.0]]), ["A", "B"])
+
+    rows = index.append(np.array([[0.6, 0.8]], dtype=np.float32), ["C"])
+    index.remove([0])
+
+    assert list(rows) == [2]
+    assert len(index) == 2
+    idx, _ = index.search(np.array([1.0, 0.0]), 5)
+    assert index.get_texts(idx) == ["C", "B"]
+    idx_b, _ = index.search_batch(np.array([[1.0, 0.0]]), 5, block_rows=1)
+    assert list(idx_b[0]) == list(idx)
+
+
+# GIVEN/WHEN/THEN: compacted は削除行を詰めた新インデックスと行番号の対応を返す
+def test_compacted_returns_new_index_and_mapping():
+    """GIVEN 3件中 1件削除。WHEN compacted。THEN 2件の新インデックスと旧->新の対応（削除は -1）。"""
+    index = VectorIndex(np.eye(3), ["A", "B", "C"])
+    index.remove([1])
+
+    compacted, mapping = index.compacted()
+
+    assert compacted.texts == ["A", "C"]
+    assert list(mapping) == [0, -1, 1]
+    assert len(index) == 2  # 元のインデックスは変更されない
+
+
+# GIVEN/WHEN/THEN: map_file は同じ形状の .npy のメモリマップに差し替え、append でヒープに戻る
+def test_map_file_swaps_in_memory_map_and_append_detaches(tmp_path):
+    """GIVEN 2件のインデックスを .npy に保存。WHEN map_file → 1件追加。THEN 検索結果は変わらず、追加後は mapped_path が外れる。"""
+    index = VectorIndex(np.array([[1.0, 0.0], [0.0, 1.0]]), ["A", "B"])
+    path = str(tmp_path / "m.npy")
+    np.save(path, index.matrix)
+
+    index.map_file(path)
+    assert index.mapped_path == path and not index.matrix.flags["WRITEABLE"]
+    assert index.get_texts(index.search(np.array([0.0, 1.0]), 1)[0]) == ["B"]
+    np.save(str(tmp_path / "bad.npy"), np.eye(3, dtype=np.float32))
+    with pytest.raises(ValueError):
+        index.map_file(str(tmp_path / "bad.npy"))
+
+    index.append(np.array([[0.6, 0.8]], dtype=np.float32), ["C"])
+    assert index.mapped_path is None
+    assert index.get_texts(index.search(np.array([0.6, 0.8]), 1)[0]) == ["C"]
+
+
+# GIVEN/WHEN/THEN: 行メタデータは列ごとの配列で 1 度だけ持ち、返す行だけを dict にする
+def test_metadata_is_stored_as_columns():
+    """GIVEN ページ付き・行範囲付き・追加キー付き・メタデータ無しの行。THEN 列に格納され、dict は元と同じに戻る。"""
+    metadata = [
+        {"source_file": "a.pdf", "chunk_id": 0, "page_start": 1, "page_end": 2},
+        {"source_file": "b.csv", "chunk_id": 0, "row_start": 1, "row_end": 10},
+        {"source_file": "a.pdf", "chunk_id": 1, "note": "付記", "page_start": 2**40},
+        {},
+    ]
+    index = VectorIndex(np.eye(4), ["a", "b", "c", "d"], metadata)
+
+    assert isinstance(index.metadata, MetadataColumns)
+    assert index.metadata.sources == ["a.pdf", "b.csv"]
+    assert index.metadata.source_ids.tolist() == [0, 1, 0, -1]
+    assert index.metadata.column("page_start").dtype == np.int32
+    assert index.get_metadata([3, 2, 0]) == [metadata[3], metadata[2], metadata[0]]
+
+    index.remove([1])
+    compacted, _ = index.compacted()
+    assert compacted.get_metadata(range(3)) == [metadata[0], metadata[2], metadata[3]]
@@ -0,0 +1,317 @@
+# tests/unit/test_vector_store.py
+
+import io
+import json
+from pathlib import Path
+
+import numpy as np
+from app.vector_store import VectorStore, load_vector_store, parse_jsonl_stream
+from document_processor.segment import encode_segment
+
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.generation = bucket.generations.get(name)
+
+    def download_as_text(self) -> str:
+        self.bucket.downloads.append(self.name)
+        return self.bucket.objects[self.name].decode("utf-8")
+
+    def open(self, mode: str = "rb"):
+        self.bucket.downloads.append(self.name)
+        return io.BytesIO(self.bucket.objects[self.name])
+
+    def download_to_filename(self, path: str) -> None:
+        self.bucket.downloads.append(self.name)
+        Path(path).write_bytes(self.bucket.objects[self.name])
+
+
+class FakeBucket:
+    """list_blobs / blob だけを持つ GCS バケットもどき（name -> bytes、put で generation を進める）。"""
+    def __init__(self, objects: dict[str, bytes]):
+        self.objects = {}
+        self.generations: dict[str, int] = {}
+        self.downloads: list[str] = []
+        for name, data in objects.items():
+            self.put(name, data)
+
+    def put(self, name: str, data: bytes) -> None:
+        self.objects[name] = data
+        self.generations[name] = self.generations.get(name, 0) + 1
+
+    def list_blobs(self):
+        return [FakeBlob(self, n) for n in self.objects]
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+
+class FakeStorageClient:
+    def __init__(self, objects: dict[str, bytes]):
+        self._bucket = FakeBucket(objects)
+
+    def bucket(self, name: str) -> FakeBucket:
+        return self._bucket
+
+
+def _jsonl(source: str, texts: list[str], embeddings: list[list[float]]) -> bytes:
+    lines = [
+        json.dumps({"source_file": source, "chunk_id": i, "text_content": t, "embedding": e}, ensure_ascii=False)
+        for i, (t, e) in enumerate(zip(texts, embeddings))
+    ]
+    return "\n".join(lines).encode("utf-8")
+
+
+# GIVEN/WHEN/THEN: セグメントと JSONL が混在していても 1 つのインデックスにまとまる
+def test_load_mixes_segments_and_jsonl(tmp_path):
+    """GIVEN a.pdf はセグメント付き、b.csv は JSONL のみ。WHEN ロード。THEN 両方が検索できる。"""
+    vectors, meta = encode_segment("a.pdf", ["猫", "犬"], [[1.0, 0.0], [0.0, 1.0]], columns={"chunk_id": [0, 1]})
+    objects = {
+        "a.pdf.jsonl": _jsonl("a.pdf", ["古い猫", "古い犬"], [[1.0, 0.0], [0.0, 1.0]]),
+        "a.pdf.seg.npy": vectors,
+        "a.pdf.seg.meta": meta,
+        "b.csv.jsonl": _jsonl("b.csv", ["鳥"], [[0.6, 0.8]]),
+    }
+
+    index = load_vector_store(FakeStorageClient(objects), "bkt", cache_dir=str(tmp_path))
+
+    # セグメントがある a.pdf は JSONL ではなくセグメントの内容が使われる
+    assert index.texts == ["猫", "犬", "鳥"]
+    assert index.metadata[2] == {"source_file": "b.csv", "chunk_id": 0}
+    idx, _ = index.search(np.array([1.0, 0.0]), 1)
+    assert index.get_texts(idx) == ["猫"]
+
+
+# GIVEN/WHEN/THEN: セグメント 1 つだけならメモリマップをそのまま参照する
+def test_single_segment_is_memory_mapped(tmp_path):
+    """GIVEN セグメント 1 つ。WHEN ロード。THEN 行列はファイルを参照する読み取り専用配列。"""
+    vectors, meta = encode_segment("a.pdf", ["A", "B"], [[1.0, 0.0], [0.0, 2.0]])
+    objects = {"a.pdf.seg.npy": vectors, "a.pdf.seg.meta": meta}
+
+    index = load_vector_store(FakeStorageClient(objects), "bkt", cache_dir=str(tmp_path))
+
+    base = index.matrix
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert isinstance(base, np.memmap)
+    assert not index.matrix.flags["WRITEABLE"]
+
+
+# GIVEN/WHEN/THEN: ベクトルデータが無ければ None
+def test_empty_bucket_returns_none(tmp_path):
+    """GIVEN 空のバケット。WHEN ロード。THEN None。"""
+    assert load_vector_store(FakeStorageClient({}), "bkt", cache_dir=str(tmp_path)) is None
+
+
+# GIVEN/WHEN/THEN: refresh は新規/更新/削除されたドキュメントだけを反映する
+def test_refresh_downloads_only_changed_documents(tmp_path):
+    """GIVEN a/b をロード済み。WHEN c 追加・a 更新・b 削除。THEN 変化分だけ取得し、検索結果に反映。"""
+    client = FakeStorageClient({
+        "a.pdf.jsonl": _jsonl("a.pdf", ["猫"], [[1.0, 0.0]]),
+        "b.pdf.jsonl": _jsonl("b.pdf", ["犬"], [[0.0, 1.0]]),
+    })
+    store = VectorStore(client, "bkt", cache_dir=str(tmp_path), compact_ratio=1.0)
+    store.refresh()
+    bucket = client.bucket("bkt")
+    bucket.downloads.clear()
+
+    bucket.put("a.pdf.jsonl", _jsonl("a.pdf", ["新しい猫"], [[1.0, 0.0]]))
+    bucket.put("c.pdf.jsonl", _jsonl("c.pdf", ["鳥"], [[0.6, 0.8]]))
+    del bucket.objects["b.pdf.jsonl"]
+
+    stats = store.refresh()
+
+    assert stats == {"added": 1, "updated": 1, "removed": 1, "unchanged": 0}
+    assert store.version == 2  # 初回ロードと今回の差分反映で 1 ずつ進む
+    assert sorted(bucket.downloads) == ["a.pdf.jsonl", "c.pdf.jsonl"]
+    assert len(store.index) == 2
+    idx, _ = store.index.search(np.array([1.0, 0.0]), 5)
+    assert store.index.get_texts(idx) == ["新しい猫", "鳥"]
+
+
+# GIVEN/WHEN/THEN: 変化が無ければ何もダウンロードしない
+def test_refresh_without_changes_is_noop(tmp_path):
+    """GIVEN ロード済みのストア。WHEN 変化なしで refresh。THEN ダウンロード 0 件、同じインデックス。"""
+    client = FakeStorageClient({"a.pdf.jsonl": _jsonl("a.pdf", ["猫"], [[1.0, 0.0]])})
+    store = VectorStore(client, "bkt", cache_dir=str(tmp_path))
+    store.refresh()
+    index_before = store.index
+    client.bucket("bkt").downloads.clear()
+
+    stats = store.refresh()
+
+    assert stats["unchanged"] == 1
+    assert client.bucket("bkt").downloads == []
+    assert store.index is index_before
+    assert store.version == 1
+
+
+# GIVEN/WHEN/THEN: tombstone が閾値を超えたら詰めたインデックスに差し替える
+def test_refresh_compacts_after_many_deletions(tmp_path):
+    """GIVEN 2 ドキュメント。WHEN 片方を削除（削除率 50% > 25%）。THEN 削除行の無いインデックスになる。"""
+    client = FakeStorageClient({
+        "a.pdf.jsonl": _jsonl("a.pdf", ["猫"], [[1.0, 0.0]]),
+        "b.pdf.jsonl": _jsonl("b.pdf", ["犬"], [[0.0, 1.0]]),
+    })
+    store = VectorStore(client, "bkt", cache_dir=str(tmp_path), compact_ratio=0.25)
+    store.refresh()
+
+    del client.bucket("bkt").objects["a.pdf.jsonl"]
+    store.refresh()
+
+    assert store.index.texts == ["犬"]
+    assert store.index.deleted_ratio == 0.0
+
+
+# GIVEN/WHEN/THEN: ドキュメントごとの行数/バイト数/所要時間が記録される
+def test_refresh_reports_per_document_bytes(tmp_path):
+    """GIVEN JSONL 1件。WHEN ロード。THEN last_load_report にバイト数と行数が入る。"""
+    data = _jsonl("a.pdf", ["猫", "犬"], [[1.0, 0.0], [0.0, 1.0]])
+    store = VectorStore(FakeStorageClient({"a.pdf.jsonl": data}), "bkt", cache_dir=str(tmp_path), max_workers=2)
+
+    store.refresh()
+
+    assert len(store.last_load_report) == 1
+    report = store.last_load_report[0]
+    assert report["document"] == "a.pdf" and report["rows"] == 2 and report["bytes"] == len(data)
+    assert report["seconds"] >= 0.0
+
+
+# GIVEN/WHEN/THEN: ストリーム解析はバッファを拡張しながら全行を float32 で取り込む
+def test_parse_jsonl_stream_grows_buffer():
+    """GIVEN 初期容量(64)を超える 150 行。WHEN 逐次解析。THEN 全行が正規化済み float32 で揃う。"""
+    lines = _jsonl("a.pdf", [f"T{i}" for i in range(150)], [[float(i + 1), 0.0] for i in range(150)]).splitlines()
+
+    matrix, texts, metadata, nbytes = parse_jsonl_stream(lines)
+
+    assert matrix.shape == (150, 2) and matrix.dtype == np.float32
+    assert np.allclose(matrix[:, 0], 1.0)
+    assert texts[-1] == "T149" and metadata[-1]["chunk_id"] == 149
+    assert nbytes == sum(len(ln) for ln in lines)
+
+
+# GIVEN/WHEN/THEN: ページ・行の位置情報はメタデータに残る（出典表示と絞り込みに使う）
+def test_parse_jsonl_stream_keeps_location_columns():
+    """GIVEN page_start/page_end を持つ行と持たない行。THEN 持つ行だけメタデータに残る。"""
+    rows = [
+        {"source_file": "a.pdf", "chunk_id": 0, "text_content": "x", "embedding": [1.0, 0.0], "page_start": 3, "page_end": 4},
+        {"source_file": "a.pdf", "chunk_id": 1, "text_content": "y", "embedding": [0.0, 1.0]},
+    ]
+
+    _, _, metadata, _ = parse_jsonl_stream([json.dumps(r) for r in rows])
+
+    assert metadata[0]["page_start"] == 3 and metadata[0]["page_end"] == 4
+    assert "page_start" not in metadata[1]
+
+
+# GIVEN/WHEN/THEN: shared_dir を指定すると、同じ内容のストアは同じファイルをメモリマップで共有する
+def test_shared_dir_maps_one_file_across_stores(tmp_path):
+    """GIVEN 同じバケットを読む 2 つのストア。THEN 同じ .npy をマップし、更新後は新しい版に切り替わって旧版は消える。"""
+    client = FakeStorageClient({
+        "a.pdf.jsonl": _jsonl("a.pdf", ["猫"], [[1.0, 0.0]]),
+        "b.pdf.jsonl": _jsonl("b.pdf", ["犬"], [[0.0, 1.0]]),
+    })
+    shared = tmp_path / "shared"
+    first = VectorStore(client, "bkt", cache_dir=str(tmp_path / "c1"), shared_dir=str(shared))
+    second = VectorStore(client, "bkt", cache_dir=str(tmp_path / "c2"), shared_dir=str(shared))
+    first.refresh()
+    second.refresh()
+
+    assert first.index.mapped_path == second.index.mapped_path
+    base = first.index.matrix
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert isinstance(base, np.memmap)
+    assert not first.index.matrix.flags["WRITEABLE"]
+    idx, _ = second.index.search(np.array([0.0, 1.0]), 1)
+    assert second.index.get_texts(idx) == ["犬"]
+
+    old_path = first.index.mapped_path
+    client.bucket("bkt").put("c.pdf.jsonl", _jsonl("c.pdf", ["鳥"], [[0.6, 0.8]]))
+    first.refresh()
+
+    assert first.index.mapped_path != old_path
+    assert sorted(p.name for p in shared.iterdir()) == [Path(first.index.mapped_path).name]
+    assert first.index.get_texts(first.index.search(np.array([0.6, 0.8]), 1)[0]) == ["鳥"]
+
+
+# GIVEN/WHEN/THEN: コンパクション済みの行と、レベル 0 の新しい版・tombstone が矛盾なく合成される
+def test_refresh_reads_compacted_segments_with_level0_overrides(tmp_path):
+    """GIVEN a/b をコンパクション済み。WHEN b を更新・a を削除・c を追加し、さらにコンパクション。THEN 常に最新の内容だけが見える。"""
+    import document_processor.compaction as compaction
+    from document_processor.local_storage import LocalStorageClient
+
+    client = LocalStorageClient(str(tmp_path / "gcs"))
+    bucket = client.bucket("bkt")
+    bucket.blob("a.pdf.jsonl").upload_from_string(_jsonl("a.pdf", ["猫"], [[1.0, 0.0]]))
+    bucket.blob("b.pdf.jsonl").upload_from_string(_jsonl("b.pdf", ["犬"], [[0.0, 1.0]]))
+    compaction.compact(bucket, target_rows=100)
+    store = VectorStore(client, "bkt", cache_dir=str(tmp_path / "cache"))
+    store.refresh()
+
+    assert sorted(store.index.texts) == ["犬", "猫"]
+    assert store.index.get_metadata([0]) == [{"source_file": "a.pdf", "chunk_id": 0}]
+    # 取り込み済みで削除待ちのレベル 0 は読まず、コンパクション済みの行範囲から読む
+    assert bucket.blob("a.pdf.jsonl").exists() and store.manifest["a.pdf"][0] == "compacted"
+
+    compaction.delete_document(bucket, "a.pdf")
+    bucket.blob("b.pdf.jsonl").upload_from_string(_jsonl("b.pdf", ["新しい犬"], [[0.0, 1.0]]))
+    bucket.blob("c.pdf.jsonl").upload_from_string(_jsonl("c.pdf", ["鳥"], [[0.6, 0.8]]))
+    stats = store.refresh()
+
+    live = lambda: sorted(store.index.get_texts(store.index.search(np.array([1.0, 1.0]), 10)[0]))  # noqa: E731
+    assert stats["updated"] == 2 and stats["added"] == 1
+    assert live() == ["新しい犬", "鳥"]
+
+    compaction.compact(bucket, target_rows=100)
+    store.refresh()
+
+    assert live() == ["新しい犬", "鳥"]
+    # 入れ替わった旧セグメントのキャッシュファイルは消える
+    assert len([p for p in (tmp_path / "cache").iterdir() if p.name.startswith("_segments")]) == 2
+
+
+# GIVEN/WHEN/THEN: 一覧の後に消えた（NotFound）新しい版は読み込まず、前の版を検索対象に残す
+def test_refresh_keeps_previous_version_when_download_fails(tmp_path, monkeypatch):
+    """GIVEN a.pdf を読み込み済み。WHEN 更新後の版のダウンロードが NotFound。THEN 旧版が残り、次回の refresh で差し替わる。"""
+    from google.api_core.exceptions import NotFound
+
+    client = FakeStorageClient({"a.pdf.jsonl": _jsonl("a.pdf", ["古い猫"], [[1.0, 0.0]])})
+    store = VectorStore(client, "bkt", cache_dir=str(tmp_path))
+    store.refresh()
+    bucket = client.bucket("bkt")
+    bucket.put("a.pdf.jsonl", _jsonl("a.pdf", ["新しい猫"], [[1.0, 0.0]]))
+    version = store.version
+
+    def gone(self, mode="rb"):
+        raise NotFound("gone")
+
+    with monkeypatch.context() as m:
+        m.setattr(FakeBlob, "open", gone)
+        store.refresh()
+
+    assert store.index.get_texts(store.index.search(np.array([1.0, 0.0]), 1)[0]) == ["古い猫"]
+    assert store.version == version
+
+    store.refresh()
+    assert store.index.get_texts(store.index.search(np.array([1.0, 0.0]), 1)[0]) == ["新しい猫"]
+
+
+# GIVEN/WHEN/THEN: セグメントの再ダウンロードは置き換えで行い、マップ中の旧ファイルの中身は変わらない
+def test_segment_redownload_replaces_file_instead_of_truncating(tmp_path):
+    """GIVEN a.pdf のセグメントをマップ済み。WHEN 別のストアが同じ版を落とし直す。THEN 先のストアのマップは元の inode を読み続ける。"""
+    vectors, meta = encode_segment("a.pdf", ["猫"], [[1.0, 0.0]], columns={"chunk_id": [0]})
+    client = FakeStorageClient({"a.pdf.seg.npy": vectors, "a.pdf.seg.meta": meta})
+    first = VectorStore(client, "bkt", cache_dir=str(tmp_path))
+    first.refresh()
+    path = first._files["a.pdf"][0]
+    inode = Path(path).stat().st_ino
+
+    second = VectorStore(client, "bkt", cache_dir=str(tmp_path))
+    second.refresh()
+
+    assert Path(path).stat().st_ino != inode
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+    assert first.index.get_texts(first.index.search(np.array([1.0, 0.0]), 1)[0]) == ["猫"]